@@ -1,27 +1,58 @@
-import subprocess
+import argparse
+import asyncio
+import bisect
 import csv
+import itertools
+import json
+import math
 import os
 import sys
-import time
 import random
-import requests
-import statistics
+import re
+import ssl
+import subprocess
+import time
+import numpy as np
 import pandas as pd
 import matplotlib
 matplotlib.use('Agg') 
 import matplotlib.pyplot as plt
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from collections import Counter
+from datetime import datetime, timezone
+from typing import NamedTuple
+from urllib.parse import urlencode, urlsplit
+try:
+    import aiohttp  # Optionnel: client HTTP asyncio plus complet; à défaut, client intégré
+except ImportError:
+    aiohttp = None
+
+import clean
+import instrumentation
+import seed
+import seeding
+import storage
 
 # --- CONFIGURATION ---
-URL = "https://tp-big-data-473713.ew.r.appspot.com"
+URL = os.environ.get("BENCH_URL", "https://tp-big-data-473713.ew.r.appspot.com")
 OUT_DIR = "out"
+# Un fichier JSON par exécution (métadonnées, percentiles, histogrammes), pour comparer les runs
+RUNS_DIR = os.path.join(OUT_DIR, "runs")
+# Graine des jeux de données: même graine et mêmes paramètres = jeu réutilisable d'un run à l'autre
+BENCH_SEED = int(os.environ.get("BENCH_SEED", "42"))
+FORCE_RESEED = os.environ.get("BENCH_RESEED") == "1"
+ZIPF_S = 1.1
+# Trace des requêtes d'un mélange (rejouable); requests.jsonl à la racine est le backlog du dépôt
+TRACE_FILE = os.path.join(OUT_DIR, "requests.jsonl")
+FORM_HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+_client = None
 
 EXP_CONFIG = {
     "conc": {"csv": "conc.csv", "title": "Temps moyen par requête selon la concurrence", "xlabel": "Nombre d'utilisateurs concurrents"},
     "post": {"csv": "post.csv", "title": "Temps moyen selon le nombre de posts", "xlabel": "Nombre de posts par utilisateur"},
     "fanout": {"csv": "fanout.csv", "title": "Temps moyen selon le nombre de followers", "xlabel": "Nombre de followees par utilisateur"},
+    "hybrid": {"csv": "hybrid.csv", "title": "Temps moyen selon le mode de timeline (followers Zipf)", "xlabel": "Mode de timeline"},
+    "mix": {"csv": "mix.csv", "title": "Temps moyen des lectures selon la part d'écritures", "xlabel": "Part d'écritures (%)"},
+    "ingest": {"csv": "ingest.csv", "title": "Temps moyen de POST /post selon le débit d'écriture", "xlabel": "Posts par seconde"},
 }
 
 # ------------------ UTILITIES ------------------
@@ -30,73 +61,642 @@ def ensure_dir(directory):
     if not os.path.exists(directory):
         os.makedirs(directory)
 
-def run_command(cmd):
-    try:
-        subprocess.run(cmd, shell=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    except subprocess.CalledProcessError:
-        print(f"Warning: Command failed slightly but continuing: {cmd}")
+def get_client():
+    """Client du seed en processus (créé au premier jeu de données préparé, voir storage.py)."""
+    global _client
+    if _client is None:
+        _client = storage.get_client()
+    return _client
 
-def reset_db(users, posts, follows, prefix):
-    print(f"\n[SETUP] Reset DB: {users} users, {posts} posts, {follows} follows ({prefix})...")
-    run_command("python clean.py")
-    run_command(f"python seed.py --users {users} --posts {posts} --follows {follows} --prefix {prefix}")
-    print("  -> DB reset OK.")
+def ensure_dataset(users, posts, follows, prefix, timelines=False, distribution="uniform"):
+    """
+    Prépare le jeu de données du préfixe, dans ce processus:
+    - manifeste complet identique -> réutilisé tel quel;
+    - même graphe mais moins de posts -> seuls les posts manquants sont écrits;
+    - sinon -> le préfixe est nettoyé puis regénéré (les autres préfixes restent en place).
+    'timelines': False, True (timelines push) ou le mode de matérialisation ('push', 'hybrid').
+    """
+    print(f"\n[SETUP] Dataset {prefix}: {users} users, {posts} posts, {follows} follows ({distribution})...")
+    client = get_client()
+    manifest = seeding.get_manifest(client, prefix)
+    same = seeding.same_graph(manifest, users=users, follows_count=follows, distribution=distribution,
+                              zipf_s=ZIPF_S, seed=BENCH_SEED)
+    # Posts écrits avec un autre nombre de shards: l'app ne les retrouverait pas tous
+    same = same and manifest.get('post_shards', 1) == seeding.POST_SHARDS
+    if same and not FORCE_RESEED and manifest['posts_per_user'] <= posts:
+        added = seeding.extend_posts(client, prefix, posts)
+        print(f"  -> Jeu de données réutilisé ({added} posts ajoutés).")
+    else:
+        clean.clean(prefix, client=client)
+        seeding.seed_dataset(client, users, posts, follows, prefix, seed=BENCH_SEED,
+                             distribution=distribution, zipf_s=ZIPF_S)
+        print("  -> Jeu de données regénéré.")
+    mode = 'push' if timelines is True else timelines
+    current = seeding.get_manifest(client, prefix).get('timelines')
+    if mode and current != mode:
+        if current:
+            # Timelines d'un autre mode: les entrées des auteurs très suivis ne doivent pas rester
+            clean.clean(prefix, kinds=['TimelineEntry'], client=client)
+        seed.rebuild_timelines(prefix, mode)
 
 # ------------------ BENCHMARK CORE ------------------
 
-def create_session(concurrency):
-    """Crée une session optimisée pour le nombre de threads."""
-    session = requests.Session()
-    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
-    session.mount('https://', adapter)
-    session.mount('http://', adapter)
-    return session
-
-def fetch_url(session, url):
-    """Simple HTTP GET sans retry (Fail fast)."""
-    start = time.time()
+# Deux modes:
+# - boucle ouverte (rate=): les requêtes partent à débit constant, qu'elles aient abouti ou non.
+#   La latence est mesurée depuis l'instant d'envoi PRÉVU: un serveur qui ralentit fait monter
+#   la latence au lieu de freiner le générateur (correction de l'omission coordonnée);
+# - concurrence fixe (concurrency=): N clients enchaînent les requêtes. Sur demande (correct_co=),
+#   la correction rejoue dans l'histogramme les requêtes qu'un client lent n'a pas pu envoyer (comme
+#   HdrHistogram), à l'intervalle attendu fourni ou mesuré pendant l'échauffement.
+# Le temps de service brut (depuis l'envoi réel, jamais corrigé) est gardé à part: c'est lui que
+# reprennent les CSV historiques.
+# Les erreurs (statut >= 400, timeouts) sont comptées par statut, jamais comme une latence de 0 ms.
+
+class LatencyHistogram:
+    """Histogramme à seaux logarithmiques (façon HdrHistogram): précision relative de 1%, fusionnable."""
+    PRECISION = 0.01
+    _LOG = math.log1p(PRECISION)
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def _bucket(self, ms):
+        return int(math.log(max(ms * 1000, 1.0)) / self._LOG)  # microsecondes, >= 1
+
+    def record(self, ms, count=1):
+        self.buckets[self._bucket(ms)] += count
+        self.count += count
+        self.total += ms * count
+        self.min = min(self.min, ms)
+        self.max = max(self.max, ms)
+
+    def record_corrected(self, ms, expected_interval_ms):
+        """Enregistre 'ms' et les requêtes qui auraient dû partir pendant cette attente."""
+        self.record(ms)
+        if expected_interval_ms and expected_interval_ms > 0:
+            missing = ms - expected_interval_ms
+            while missing >= expected_interval_ms:
+                self.record(missing)
+                missing -= expected_interval_ms
+
+    def merge(self, other):
+        self.buckets.update(other.buckets)
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                value = math.exp((bucket + 0.5) * self._LOG) / 1000
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def summary(self):
+        return {"count": self.count, "mean": self.mean, "p50": self.percentile(50),
+                "p90": self.percentile(90), "p95": self.percentile(95), "p99": self.percentile(99),
+                "p99.9": self.percentile(99.9), "max": self.max if self.count else None}
+
+    def to_dict(self):
+        return {"precision": self.PRECISION, "count": self.count, "total": self.total,
+                "min": self.min if self.count else None, "max": self.max,
+                "buckets": {str(bucket): n for bucket, n in sorted(self.buckets.items())}}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        histogram.buckets = Counter({int(bucket): n for bucket, n in data["buckets"].items()})
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.min = data["min"] if data["min"] is not None else math.inf
+        histogram.max = data["max"]
+        return histogram
+
+    def resample_percentile(self, p, iterations, rng):
+        """Percentile 'p' de 'iterations' rééchantillonnages bootstrap (tirages multinomiaux sur les seaux)."""
+        buckets = sorted(self.buckets)
+        values = np.exp((np.array(buckets) + 0.5) * self._LOG) / 1000
+        counts = np.array([self.buckets[bucket] for bucket in buckets], dtype=float)
+        samples = rng.multinomial(self.count, counts / counts.sum(), size=iterations)
+        return values[(samples.cumsum(axis=1) >= p / 100 * self.count).argmax(axis=1)]
+
+class LoadStats:
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        # Temps de service brut: depuis l'envoi réel, sans requête rejouée par la correction
+        self.service = LatencyHistogram()
+        self.errors = Counter()
+        self.warmup = LatencyHistogram()
+        self.responses = 0
+        self.first = None
+        self.last = None
+        self.by_op = {}
+        self.strategies = Counter()
+        # Coût côté serveur (en-tête Server-Timing): RPC Datastore et entités, sur 'costed' réponses
+        self.costed = 0
+        self.rpcs = 0
+        self.entities = 0
+
+    def record(self, status, ms, done, expected_interval_ms=None, op=None, strategy=None, cost=None,
+               service_ms=None):
+        started = done - ms / 1000
+        self.first = started if self.first is None else min(self.first, started)
+        self.last = done if self.last is None else max(self.last, done)
+        self.responses += 1
+        if strategy is not None:
+            # Stratégie de lecture annoncée par le serveur (en-tête X-Timeline-Strategy)
+            self.strategies[strategy] += 1
+        if cost is not None:
+            self.costed += 1
+            self.rpcs += cost[0]
+            self.entities += cost[1]
+        if isinstance(status, int) and status < 400:
+            self.histogram.record_corrected(ms, expected_interval_ms)
+            self.service.record(ms if service_ms is None else service_ms)
+        else:
+            self.errors[str(status)] += 1
+        if op is not None:
+            # Même mesure, ventilée par type d'opération (lecture, post, follow...)
+            self.by_op.setdefault(op, LoadStats()).record(status, ms, done, expected_interval_ms,
+                                                          strategy=strategy, cost=cost, service_ms=service_ms)
+
+    @property
+    def duration(self):
+        return (self.last - self.first) if self.first is not None else 0.0
+
+    @property
+    def throughput(self):
+        # Réponses réellement reçues (sans les requêtes rejouées par la correction)
+        return self.responses / self.duration if self.duration > 0 else 0.0
+
+    def cost_per_request(self):
+        """(RPC, entités) moyens par réponse instrumentée, None si le serveur n'envoie pas Server-Timing."""
+        return (self.rpcs / self.costed, self.entities / self.costed) if self.costed else None
+
+    def to_dict(self):
+        """Résultat complet, sérialisable en JSON (histogramme inclus, pour le bootstrap de 'compare')."""
+        return {"summary": self.histogram.summary(), "service": self.service.summary(),
+                "errors": dict(self.errors), "responses": self.responses,
+                "duration": self.duration, "throughput": self.throughput, "strategies": dict(self.strategies),
+                "cost_per_request": self.cost_per_request(), "histogram": self.histogram.to_dict(),
+                "by_op": {op: stats.to_dict() for op, stats in sorted(self.by_op.items())}
+                if len(self.by_op) > 1 else {}}
+
+    def report(self):
+        s = self.histogram.summary()
+        if not s["count"]:
+            return f"     Stats: aucune réponse valide, Erreurs={dict(self.errors)}"
+        lines = [(f"     Stats: Avg={s['mean']:.2f}ms P50={s['p50']:.2f}ms P90={s['p90']:.2f}ms "
+                  f"P95={s['p95']:.2f}ms P99={s['p99']:.2f}ms P99.9={s['p99.9']:.2f}ms Max={s['max']:.2f}ms, "
+                  f"Débit={self.throughput:.1f} req/s, Erreurs={sum(self.errors.values())} {dict(self.errors) or ''}")]
+        cost = self.cost_per_request()
+        if cost:
+            lines[0] = lines[0].rstrip() + f", RPC/req={cost[0]:.1f} entités/req={cost[1]:.1f}"
+        if len(self.by_op) > 1:
+            for op, stats in sorted(self.by_op.items()):
+                lines.append(f"       {op:<7}" + stats.report().strip()[len("Stats:"):])
+        return "\n".join(lines)
+
+SERVER_COST = re.compile(r'rpc=(\d+) entities=(\d+)')
+
+def server_cost(server_timing):
+    """
+    (RPC, entités) de l'entrée 'datastore' d'un en-tête Server-Timing: (0, 0) sans cette entrée
+    (réponse servie sans RPC, depuis un cache), None sans en-tête.
+    """
+    if not server_timing:
+        return None
+    match = SERVER_COST.search(server_timing)
+    return (int(match[1]), int(match[2])) if match else (0, 0)
+
+class StreamHTTPClient:
+    """Client HTTP/1.1 minimal sur asyncio (connexions keep-alive réutilisées), utilisé sans aiohttp."""
+
+    def __init__(self, limit=100, timeout=20):
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(limit)
+        self._idle = {}
+        self._ssl = ssl.create_default_context()
+
+    async def request(self, method, url, body=None, headers=None):
+        async with self._slots:
+            return await asyncio.wait_for(self._request(method, url, body, headers or {}), self.timeout)
+
+    async def _request(self, method, url, body, headers):
+        parts = urlsplit(url)
+        origin = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        body = body.encode() if isinstance(body, str) else (body or b"")
+        head = [f"{method} {path} HTTP/1.1", f"Host: {parts.netloc}", f"Content-Length: {len(body)}"]
+        head += [f"{k}: {v}" for k, v in headers.items()]
+        payload = ("\r\n".join(head) + "\r\n\r\n").encode() + body
+        idle = self._idle.setdefault(origin, [])
+        while True:
+            reused = bool(idle)
+            reader, writer = idle.pop() if reused else await self._connect(origin)
+            try:
+                writer.write(payload)
+                await writer.drain()
+                status, response_headers = await self._read_head(reader)
+                data = await self._read_body(reader, response_headers)
+                break
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if not reused:
+                    raise
+                # Connexion keep-alive fermée par le serveur entre deux requêtes: on en ouvre une autre
+            except BaseException:
+                writer.close()
+                raise
+        if response_headers.get("connection", "").lower() == "close":
+            writer.close()
+        else:
+            idle.append((reader, writer))
+        return status, response_headers, data
+
+    async def _connect(self, origin):
+        scheme, host, port = origin
+        return await asyncio.open_connection(host, port, ssl=self._ssl if scheme == "https" else None)
+
+    async def _read_head(self, reader):
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("connexion fermée")
+        status = int(line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                return status, headers
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    async def _read_body(self, reader, headers):
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    return b"".join(chunks)
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+        if "content-length" in headers:
+            return await reader.readexactly(int(headers["content-length"]))
+        headers["connection"] = "close"
+        return await reader.read()
+
+    async def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+class AiohttpClient:
+    def __init__(self, limit=100, timeout=20):
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=limit),
+                                             timeout=aiohttp.ClientTimeout(total=timeout))
+
+    async def request(self, method, url, body=None, headers=None):
+        # Pas de redirection suivie: la latence d'un POST /post est celle de l'écriture, pas de la page d'accueil
+        async with self.session.request(method, url, data=body, headers=headers, allow_redirects=False) as response:
+            return response.status, {k.lower(): v for k, v in response.headers.items()}, await response.read()
+
+    async def close(self):
+        await self.session.close()
+
+def make_http_client(limit=100, timeout=20):
+    """
+    aiohttp s'il est installé, sinon le client asyncio intégré. Même interface:
+    request(méthode, url, corps, en-têtes) -> (statut, en-têtes en minuscules, corps).
+    """
+    return AiohttpClient(limit, timeout) if aiohttp is not None else StreamHTTPClient(limit, timeout)
+
+def arrival_times(rate, ramp=0.0):
+    """Instants d'arrivée (s) à débit constant 'rate', atteint linéairement en 'ramp' secondes."""
+    ramp_arrivals = rate * ramp / 2
+    for i in itertools.count():
+        if i < ramp_arrivals:
+            yield math.sqrt(2 * ramp * i / rate)
+        else:
+            yield ramp + (i - ramp_arrivals) / rate
+
+class Request(NamedTuple):
+    """Requête du générateur de charge; 'session' = utilisateur dont le cookie de session est joint."""
+    method: str
+    url: str
+    body: str = None
+    headers: dict = None
+    op: str = "read"
+    session: str = None
+
+async def run_load(next_request, rate=None, concurrency=None, duration=None, total=None, warmup=0.0,
+                   ramp=0.0, correct_co=False, expected_interval_ms=None, connections=None, timeout=20,
+                   schedule=None, sessions=None, trace=None):
+    """
+    Exécute une charge et retourne ses LoadStats. 'next_request()' donne une Request.
+    Phases: rampe ('ramp' s), échauffement ('warmup' s, non mesuré), puis mesure pendant 'duration'
+    secondes ou jusqu'à 'total' requêtes.
+    'schedule' (itérable de (instant en s, Request)) remplace le débit constant, pour rejouer une trace;
+    'sessions' associe un utilisateur à son cookie; 'trace' (fichier) reçoit une ligne JSON par requête.
+    """
+    if schedule is None and (rate is None) == (concurrency is None):
+        raise ValueError("préciser rate= (boucle ouverte) ou concurrency= (concurrence fixe)")
+    if schedule is None and duration is None and total is None:
+        raise ValueError("préciser duration= ou total=")
+    client = make_http_client(connections or concurrency or max(100, int(rate or 0)), timeout)
+    stats = LoadStats()
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    measure_from = start + warmup + ramp
+    deadline = measure_from + duration if duration is not None else math.inf
+    measured = 0
+
+    async def one(intended, expected_interval_ms=None, request=None):
+        request = request or next_request()
+        headers = request.headers
+        if request.session is not None:
+            headers = {**(headers or {}), "Cookie": sessions[request.session]}
+        sent = loop.time()
+        try:
+            status, response_headers, _ = await client.request(request.method, request.url, request.body, headers)
+            strategy = response_headers.get("x-timeline-strategy")
+            cost = server_cost(response_headers.get("server-timing"))
+        except asyncio.TimeoutError:
+            status, strategy, cost = "timeout", None, None
+        except Exception as e:
+            status, strategy, cost = type(e).__name__, None, None
+        done = loop.time()
+        # Depuis l'instant prévu: en boucle ouverte, l'attente d'un envoi en retard fait partie de la latence
+        latency = (done - intended) * 1000
+        if intended < measure_from:
+            stats.warmup.record(latency)
+        else:
+            stats.record(status, latency, done, expected_interval_ms, request.op, strategy, cost,
+                         service_ms=(done - sent) * 1000)
+        if trace is not None:
+            trace.write(trace_line(request, intended - start, status, latency) + "\n")
+
+    def budget_left(at):
+        return at < deadline and (total is None or measured < total)
+
     try:
-        response = session.get(url, timeout=20) 
-        latency = (time.time() - start) * 1000
-        return latency, response.status_code
-    except Exception:
-        return 0, 500
+        if schedule is None and rate is not None:
+            schedule = ((offset, None) for offset in arrival_times(rate, ramp))
+        if schedule is not None:
+            tasks = set()
+            for offset, request in schedule:
+                at = start + offset
+                if not budget_left(at):
+                    break
+                if at >= measure_from:
+                    measured += 1
+                delay = at - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                task = asyncio.create_task(one(at, request=request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        else:
+            interval = [expected_interval_ms]
+            if correct_co and expected_interval_ms is None and not warmup:
+                print("  [LOAD] Correction de l'omission coordonnée sans intervalle attendu ni "
+                      "échauffement: désactivée")
+                correct_co = False
 
-def run_threaded_test(concurrency, total_requests, user_prefix, user_count):
-    urls = [f"{URL}/api/timeline?user={user_prefix}{random.randint(1, user_count)}"
-            for _ in range(total_requests)]
+            async def worker(k):
+                nonlocal measured
+                # Rampe: les clients démarrent échelonnés
+                await asyncio.sleep(ramp * k / concurrency)
+                while True:
+                    intended = loop.time()
+                    if intended < measure_from:
+                        await one(intended)
+                        continue
+                    if not budget_left(intended):
+                        return
+                    measured += 1
+                    if correct_co and interval[0] is None:
+                        # Intervalle attendu: latence médiane observée pendant l'échauffement
+                        interval[0] = stats.warmup.percentile(50)
+                    await one(intended, interval[0] if correct_co else None)
+            await asyncio.gather(*(worker(k) for k in range(concurrency)))
+    finally:
+        await client.close()
+    return stats
 
-    latencies = []
-    errors = 0
+async def serve_stub(host="127.0.0.1", port=8081, latency_ms=20.0, error_rate=0.0):
+    """
+    Serveur de substitution local (HTTP/1.1 keep-alive): répond à toute requête après une latence
+    exponentielle de moyenne 'latency_ms', avec 'error_rate' de réponses 500. Sert à tester le moteur.
+    """
+    body = b'{"items":[]}'
 
-    session = create_session(concurrency)
-    print(f"  -> Lancement de {total_requests} requêtes avec {concurrency} threads...")
+    async def handle(reader, writer):
+        try:
+            while await reader.readline():
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    if name.strip().lower() == "content-length":
+                        length = int(value)
+                if length:
+                    await reader.readexactly(length)
+                if latency_ms > 0:
+                    await asyncio.sleep(random.expovariate(1 / latency_ms) / 1000)
+                status = "500 Internal Server Error" if random.random() < error_rate else "200 OK"
+                # Cookie constant: les clients à session du mélange peuvent s'y "connecter"
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                             f"Set-Cookie: session=stub; Path=/\r\n"
+                             f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
 
-    with ThreadPoolExecutor(max_workers=concurrency) as executor:
-        futures = [executor.submit(fetch_url, session, url) for url in urls]
-        
-        for f in as_completed(futures):
-            lat, status = f.result()
-            if status == 200:
-                latencies.append(lat)
-            else:
-                errors += 1
-    
-    session.close()
+    server = await asyncio.start_server(handle, host, port)
+    print(f"[STUB] http://{host}:{port} (latence moyenne {latency_ms}ms, erreurs {error_rate:.1%})")
+    async with server:
+        await server.serve_forever()
 
-    if not latencies:
-        return 0, 1 
+def run_timeline_test(concurrency, total_requests, user_prefix, user_count, timeline_mode=None):
+    """Lectures /api/timeline d'utilisateurs aléatoires par 'concurrency' clients; retourne les LoadStats."""
+    suffix = f"&mode={timeline_mode}" if timeline_mode else ""
 
-    avg_time = statistics.mean(latencies)
-    is_failed = 1 if errors > 0 else 0
-    
-    if len(latencies) > 1:
-        p95 = statistics.quantiles(latencies, n=100)[94]
-        print(f"     Stats: Avg={avg_time:.2f}ms, P95={p95:.2f}ms, Erreurs={errors}")
-    else:
-        print(f"     Stats: Avg={avg_time:.2f}ms, Erreurs={errors}")
+    def next_request():
+        return Request("GET", f"{URL}/api/timeline?user={user_prefix}{random.randint(1, user_count)}{suffix}")
+
+    print(f"  -> Lancement de {total_requests} requêtes avec {concurrency} clients...")
+    stats = asyncio.run(run_load(next_request, concurrency=concurrency, total=total_requests))
+    print(stats.report())
+    return stats
+
+def avg_failed(stats):
+    """(moyenne ms du temps de service brut, échec) d'un run, comme dans les CSV historiques."""
+    if not stats.service.count:
+        return 0, 1
+    return stats.service.mean, 1 if stats.errors else 0
+
+# ------------------ WORKLOAD MIX ------------------
+
+# Trafic réaliste: lectures, posts et follows mélangés selon des ratios, popularité Zipf:
+# - auteurs: l'utilisateur de rang i poste et est suivi avec une probabilité ∝ 1/i^s (mêmes rangs
+#   que le graphe 'zipf' du seed: les auteurs les plus suivis sont aussi les plus actifs);
+# - lecteurs: même loi sur une permutation des utilisateurs (les gros lecteurs ne sont pas les stars).
+# Les écritures passent par /post et /follow avec le cookie de session obtenu par POST /login.
+
+class ZipfChooser:
+    """Tire un rang 1..n avec une probabilité ∝ 1 / rang^s."""
+
+    def __init__(self, n, s, rng):
+        self.cum_weights = seeding.ZipfSampler(n, s).cum_weights
+        self.rng = rng
+
+    def __call__(self):
+        return bisect.bisect_left(self.cum_weights, self.rng.random() * self.cum_weights[-1]) + 1
+
+class WorkloadMix:
+    """Générateur du mélange, utilisé comme next_request() par run_load."""
+    OPS = ("read", "post", "follow")
+
+    def __init__(self, prefix, users, read=0.9, post=0.08, follow=0.02, zipf_s=ZIPF_S, timeline_mode=None,
+                 seed=None):
+        if min(read, post, follow) < 0 or read + post + follow <= 0:
+            raise ValueError("ratios read/post/follow positifs et de somme non nulle")
+        self.prefix = prefix
+        self.users = users
+        self.writes = post + follow > 0
+        self.rng = random.Random(seed)
+        self.cum_ratios = list(itertools.accumulate((read, post, follow)))
+        self.authors = ZipfChooser(users, zipf_s, self.rng)
+        self.readers = ZipfChooser(users, zipf_s, self.rng)
+        self.reader_ranks = list(range(1, users + 1))
+        self.rng.shuffle(self.reader_ranks)
+        self.suffix = f"&mode={timeline_mode}" if timeline_mode else ""
+        self.posted = itertools.count(1)
+
+    def user(self, rank):
+        return f"{self.prefix}{rank}"
+
+    def writers(self):
+        """Utilisateurs qui ont besoin d'une session (tous, dès que le mélange écrit)."""
+        return [self.user(i) for i in range(1, self.users + 1)] if self.writes else []
+
+    def __call__(self):
+        op = self.OPS[bisect.bisect_right(self.cum_ratios, self.rng.random() * self.cum_ratios[-1])]
+        if op == "read":
+            reader = self.user(self.reader_ranks[self.readers() - 1])
+            return Request("GET", f"{URL}/api/timeline?user={reader}{self.suffix}")
+        if op == "post":
+            author = self.user(self.authors())
+            body = urlencode({"content": f"Workload post {next(self.posted)} by {author}"})
+            return Request("POST", f"{URL}/post", body, FORM_HEADERS, "post", author)
+        # Un lecteur actif suit un auteur tiré selon sa popularité
+        follower = self.reader_ranks[self.readers() - 1]
+        followee = self.authors()
+        while followee == follower and self.users > 1:
+            followee = self.authors()
+        body = urlencode({"to_follow": self.user(followee)})
+        return Request("POST", f"{URL}/follow", body, FORM_HEADERS, "follow", self.user(follower))
+
+async def open_sessions(users, connections=50, timeout=20):
+    """POST /login pour chaque utilisateur; retourne {utilisateur: en-tête Cookie}."""
+    client = make_http_client(connections, timeout)
+    sessions = {}
+
+    async def login(user):
+        status, headers, _ = await client.request("POST", f"{URL}/login", urlencode({"username": user}),
+                                                  FORM_HEADERS)
+        cookie = headers.get("set-cookie")
+        if status >= 400 or not cookie:
+            raise RuntimeError(f"connexion de {user} refusée (statut {status})")
+        sessions[user] = cookie.split(";", 1)[0]
+
+    try:
+        await asyncio.gather(*(login(user) for user in users))
+    finally:
+        await client.close()
+    return sessions
+
+async def fetch_cache_stats(client):
+    """Compteurs de /admin/cache (de l'instance qui répond), ou None s'ils sont indisponibles."""
+    try:
+        status, _, body = await client.request("GET", f"{URL}/admin/cache")
+        return json.loads(body) if status == 200 else None
+    except Exception:
+        return None
 
-    return avg_time, is_failed
+def cache_report(before, after):
+    """Taux de hits de chaque cache pendant le run, d'après deux relevés de /admin/cache."""
+    if not before or not after:
+        return "     Cache: compteurs indisponibles"
+    parts = []
+    for name, counters in sorted(after.items()):
+        hits = counters["hits"] - before[name]["hits"]
+        misses = counters["misses"] - before[name]["misses"]
+        if hits < 0 or misses < 0:
+            # Autre instance ou redémarrage entre les deux relevés
+            return "     Cache: relevés de deux instances différentes, non comparables"
+        if hits + misses:
+            parts.append(f"{name}={hits / (hits + misses):.1%} ({hits}/{hits + misses})")
+    return f"     Cache (une instance): {', '.join(parts) or 'aucun accès'}"
+
+def trace_line(request, offset, status=None, latency_ms=None):
+    """Ligne JSON d'une requête: instant relatif, opération et chemin (indépendant de BENCH_URL)."""
+    path = request.url[len(URL):] if request.url.startswith(URL) else request.url
+    return json.dumps({"t": round(offset, 6), "op": request.op, "method": request.method, "path": path,
+                       "body": request.body, "headers": request.headers, "session": request.session,
+                       "status": status, "ms": round(latency_ms, 3) if latency_ms is not None else None})
+
+def load_trace(path, speed=1.0):
+    """Lit une trace: liste triée de (instant, Request), intervalles d'origine divisés par 'speed'."""
+    events = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            e = json.loads(line)
+            url = e["path"] if e["path"].startswith("http") else URL + e["path"]
+            events.append((e["t"] / speed, Request(e["method"], url, e.get("body"), e.get("headers"),
+                                                   e.get("op", "read"), e.get("session"))))
+    events.sort(key=lambda event: event[0])
+    start = events[0][0] if events else 0.0
+    return [(t - start, request) for t, request in events]
+
+async def run_workload(next_request=None, schedule=None, sessions=None, trace_path=None, **load):
+    """Mélange (next_request) ou trace (schedule) avec relevé des caches; retourne (LoadStats, rapport cache)."""
+    probe = make_http_client(1)
+    try:
+        before = await fetch_cache_stats(probe)
+        trace = open(trace_path, "w") if trace_path else None
+        try:
+            stats = await run_load(next_request, schedule=schedule, sessions=sessions, trace=trace, **load)
+        finally:
+            if trace is not None:
+                trace.close()
+        after = await fetch_cache_stats(probe)
+    finally:
+        await probe.close()
+    return stats, cache_report(before, after)
 
 def write_results(filename, data):
     filepath = os.path.join(OUT_DIR, filename)
@@ -106,9 +706,14 @@ def write_results(filename, data):
         writer.writerows(data)
     print(f"[CSV] Saved -> {filepath}")
 
-def generate_graph(exp_type):
+def result_name(exp_type, timeline_mode="pull"):
+    """Nom de base des résultats: 'fanout' en mode pull (historique), 'fanout_push' sinon."""
+    return exp_type if timeline_mode == "pull" else f"{exp_type}_{timeline_mode}"
+
+def generate_graph(exp_type, timeline_mode="pull"):
     conf = EXP_CONFIG[exp_type]
-    csv_path = os.path.join(OUT_DIR, conf["csv"])
+    name = result_name(exp_type, timeline_mode)
+    csv_path = os.path.join(OUT_DIR, f"{name}.csv")
     if not os.path.exists(csv_path): return
 
     try:
@@ -121,26 +726,124 @@ def generate_graph(exp_type):
         stds = grouped['std'].fillna(0)
 
         plt.bar(params, means, yerr=stds, capsize=5, color='cornflowerblue', edgecolor='black')
-        plt.title(conf["title"])
+        plt.title(conf["title"] if timeline_mode == "pull" else f"{conf['title']} (mode {timeline_mode})")
         plt.xlabel(conf["xlabel"])
         plt.ylabel("Temps moyen par requête (ms)")
         plt.grid(axis='y', linestyle='--', alpha=0.7)
         plt.tight_layout()
 
-        img_path = os.path.join(OUT_DIR, f"{exp_type}.png")
+        img_path = os.path.join(OUT_DIR, f"{name}.png")
         plt.savefig(img_path)
         plt.close("all")
         print(f"[GRAPH] Generated -> {img_path}")
     except Exception as e:
         print(f"Erreur génération graph {exp_type}: {e}")
 
+# ------------------ RUN STORE ------------------
+
+def git_revision():
+    """Révision git du code du benchmark ('dirty': modifications non commitées), None hors dépôt."""
+    repo = os.path.dirname(os.path.abspath(__file__))
+    try:
+        rev = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo, capture_output=True, text=True,
+                             check=True).stdout
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo,
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return {"rev": rev.strip(), "dirty": bool(status.strip())}
+
+def dataset_manifest(prefix):
+    """Manifeste Dataset du préfixe (dict), None s'il n'existe pas ou si Datastore est inaccessible."""
+    try:
+        manifest = seeding.get_manifest(get_client(), prefix)
+    except Exception as e:
+        print(f"  [RUN] Manifeste '{prefix}' indisponible: {e}")
+        return None
+    return dict(manifest) if manifest is not None else None
+
+class RunRecorder:
+    """Résultats complets d'une exécution, enregistrés dans out/runs/<id>.json."""
+
+    def __init__(self, experiment, timeline_mode="pull", params=None):
+        started = datetime.now(timezone.utc)
+        self.git = git_revision()
+        rev = f"-{self.git['rev'][:7]}" if self.git else ""
+        self.id = f"{started:%Y%m%d-%H%M%S}-{result_name(experiment, timeline_mode)}{rev}"
+        self.record = {"id": self.id, "experiment": experiment, "timeline_mode": timeline_mode,
+                       "params": params or {}, "url": URL, "started": started.isoformat(), "git": self.git,
+                       "engine": "aiohttp" if aiohttp is not None else "stream", "datasets": {}, "points": []}
+
+    def add(self, param, run, stats, prefix=None, **extra):
+        """Ajoute la mesure d'un point (valeur du paramètre, répétition) et le manifeste de son jeu."""
+        if prefix is not None and prefix not in self.record["datasets"]:
+            self.record["datasets"][prefix] = dataset_manifest(prefix)
+        self.record["points"].append({"param": str(param), "run": run, "prefix": prefix, **stats.to_dict(),
+                                      **extra})
+
+    def save(self):
+        ensure_dir(RUNS_DIR)
+        self.record["finished"] = datetime.now(timezone.utc).isoformat()
+        path = os.path.join(RUNS_DIR, f"{self.id}.json")
+        with open(path, "w") as f:
+            json.dump(self.record, f, indent=1, default=str)
+        print(f"[RUN] Saved -> {path}")
+        return path
+
+def load_run(ref):
+    """Run enregistré, par chemin ou par identifiant (out/runs/<id>.json)."""
+    path = ref if os.path.exists(ref) else os.path.join(RUNS_DIR, f"{ref}.json")
+    with open(path) as f:
+        return json.load(f)
+
+def run_histograms(run):
+    """Histogrammes par point, répétitions fusionnées: {libellé: LatencyHistogram} (et par opération)."""
+    merged = {}
+    for point in run["points"]:
+        parts = [(point["param"], point)]
+        parts += [(f"{point['param']}/{op}", stats) for op, stats in point.get("by_op", {}).items()]
+        for label, stats in parts:
+            merged.setdefault(label, LatencyHistogram()).merge(LatencyHistogram.from_dict(stats["histogram"]))
+    return merged
+
+def compare_runs(base, candidate, metrics=("p95", "p99"), iterations=2000, confidence=0.95, min_change=0.05):
+    """
+    Compare deux runs point par point: écart de chaque percentile avec son intervalle de confiance
+    bootstrap. Régression = intervalle entièrement au-dessus de 0 et hausse d'au moins 'min_change'.
+    Retourne la liste des régressions (libellé, métrique).
+    """
+    rng = np.random.default_rng(BENCH_SEED)
+    alpha = (1 - confidence) / 2
+    before, after = run_histograms(base), run_histograms(candidate)
+    regressions = []
+    for label in [label for label in before if label in after]:
+        a, b = before[label], after[label]
+        if not a.count or not b.count:
+            continue
+        for metric in metrics:
+            p = float(metric.lstrip("p"))
+            diffs = b.resample_percentile(p, iterations, rng) - a.resample_percentile(p, iterations, rng)
+            low, high = np.quantile(diffs, [alpha, 1 - alpha])
+            old, new = a.percentile(p), b.percentile(p)
+            change = (new - old) / old if old else 0.0
+            verdict = ""
+            if low > 0 and change >= min_change:
+                verdict = "RÉGRESSION"
+                regressions.append((label, metric))
+            elif high < 0 and -change >= min_change:
+                verdict = "amélioration"
+            print(f"  {label:<16} {metric:<5} {old:9.2f}ms -> {new:9.2f}ms ({change:+7.1%}) "
+                  f"IC{confidence:.0%} [{low:+.2f}, {high:+.2f}]ms {verdict}")
+    return regressions
+
 # ------------------ EXPERIMENT DEFINITIONS ------------------
 
 def run_exp_concurrency():
     print("\n=== EXP 1: CONCURRENCE ===")
-    reset_db(1000, 50, 20, "user")
+    ensure_dataset(1000, 50, 20, "user")
 
     results = []
+    recorder = RunRecorder("conc")
     concurrency_levels = [1, 10, 20, 50, 100, 1000]
 
     for c in concurrency_levels:
@@ -150,57 +853,613 @@ def run_exp_concurrency():
         print(f"Testing {c} concurrent users (Target: {n} reqs)")
 
         for run in range(1, 4):
-            avg, failed = run_threaded_test(c, n, "user", 1000)
+            stats = run_timeline_test(c, n, "user", 1000)
+            recorder.add(c, run, stats, "user")
+            avg, failed = avg_failed(stats)
             print(f"   Run {run}: {avg:.2f} ms (Failed: {failed})")
             results.append([c, avg, run, failed])
 
+    recorder.save()
     write_results("conc.csv", results)
     generate_graph("conc")
 
 def run_exp_post():
     print("\n=== EXP 2: VOLUME POSTS ===")
     results = []
+    recorder = RunRecorder("post")
     concurrency = 50
     
     for p in [10, 100, 1000]:
         prefix = f"post{p}"
-        reset_db(1000, p, 20, prefix)
+        ensure_dataset(1000, p, 20, prefix)
         print(f"Testing {p} posts per user")
         
         for run in range(1, 4):
-            avg, failed = run_threaded_test(concurrency, 200, prefix, 1000)
+            stats = run_timeline_test(concurrency, 200, prefix, 1000)
+            recorder.add(p, run, stats, prefix)
+            avg, failed = avg_failed(stats)
             print(f"   Run {run}: {avg:.2f} ms")
             results.append([p, avg, run, failed])
 
+    recorder.save()
     write_results("post.csv", results)
     generate_graph("post")
 
-def run_exp_fanout():
-    print("\n=== EXP 3: FANOUT ===")
+def run_exp_fanout(timeline_mode="pull"):
+    print(f"\n=== EXP 3: FANOUT (mode {timeline_mode}) ===")
     results = []
+    recorder = RunRecorder("fanout", timeline_mode)
     concurrency = 50
     
     for f in [10, 50, 100]:
         prefix = f"fan{f}"
-        reset_db(1000, 100, f, prefix)
+        ensure_dataset(1000, 100, f, prefix, timelines=(timeline_mode == "push"))
         print(f"Testing {f} followers per user")
         
         for run in range(1, 4):
-            avg, failed = run_threaded_test(concurrency, 200, prefix, 1000)
+            stats = run_timeline_test(concurrency, 200, prefix, 1000, timeline_mode=timeline_mode)
+            recorder.add(f, run, stats, prefix)
+            avg, failed = avg_failed(stats)
             print(f"   Run {run}: {avg:.2f} ms")
             results.append([f, avg, run, failed])
 
-    write_results("fanout.csv", results)
-    generate_graph("fanout")
+    recorder.save()
+    name = result_name("fanout", timeline_mode)
+    write_results(f"{name}.csv", results)
+    generate_graph("fanout", timeline_mode)
+
+def run_exp_hybrid():
+    """Même jeu de données Zipf (quelques auteurs très suivis) lu dans les trois modes."""
+    print("\n=== EXP 4: PULL / PUSH / HYBRID (followers Zipf) ===")
+    results = []
+    recorder = RunRecorder("hybrid")
+    concurrency = 50
+    prefix = "zipf"
+    for timeline_mode in ["pull", "push", "hybrid"]:
+        # Chaque mode lit les timelines qu'il aurait écrites: en hybrid, sans les auteurs très suivis
+        # (le nombre d'entrées écrites par la reconstruction montre l'économie d'écriture)
+        ensure_dataset(1000, 50, 50, prefix, timelines=timeline_mode if timeline_mode != "pull" else False,
+                       distribution="zipf")
+        print(f"Testing mode {timeline_mode}")
+        for run in range(1, 4):
+            stats = run_timeline_test(concurrency, 200, prefix, 1000, timeline_mode=timeline_mode)
+            recorder.add(timeline_mode, run, stats, prefix)
+            avg, failed = avg_failed(stats)
+            print(f"   Run {run}: {avg:.2f} ms")
+            results.append([timeline_mode, avg, run, failed])
+
+    recorder.save()
+    write_results("hybrid.csv", results)
+    generate_graph("hybrid")
+
+def run_exp_mix():
+    """Interférence lectures/écritures: même débit total, part croissante de posts et de follows."""
+    print("\n=== EXP 5: MÉLANGE LECTURES / ÉCRITURES (popularité Zipf) ===")
+    results = []
+    recorder = RunRecorder("mix")
+    prefix = "mix"
+    ensure_dataset(1000, 50, 20, prefix, distribution="zipf")
+    sessions = asyncio.run(open_sessions([f"{prefix}{i}" for i in range(1, 1001)]))
+
+    for writes in [0, 5, 20]:
+        print(f"Testing {writes}% d'écritures")
+        share = writes / 100
+        for run in range(1, 4):
+            mix = WorkloadMix(prefix, 1000, read=1 - share, post=share * 0.8, follow=share * 0.2,
+                              seed=BENCH_SEED + run)
+            stats, cache = asyncio.run(run_workload(mix, sessions=sessions, rate=100, duration=20, warmup=2))
+            print(stats.report())
+            print(cache)
+            recorder.add(writes, run, stats, prefix)
+            reads = stats.by_op.get("read")
+            avg = reads.service.mean if reads and reads.service.count else 0
+            print(f"   Run {run}: {avg:.2f} ms (lectures)")
+            results.append([writes, avg, run, 1 if stats.errors else 0])
+
+    # Les posts et follows du mélange ont modifié le jeu: il sera regénéré au prochain run
+    seeding.update_manifest(get_client(), prefix, complete=False)
+    recorder.save()
+    write_results("mix.csv", results)
+    generate_graph("mix")
+
+def fetch_admin(path):
+    """JSON d'une route d'administration (de l'instance qui répond), None si indisponible."""
+    async def fetch():
+        client = make_http_client(1, 20)
+        try:
+            status, _, body = await client.request("GET", f"{URL}{path}")
+            return json.loads(body) if status == 200 else None
+        except Exception:
+            return None
+        finally:
+            await client.close()
+    return asyncio.run(fetch())
+
+def group_commit_report(before, after):
+    """Lots du commit groupé entre deux relevés de /admin/commits (même instance), None sinon."""
+    if not before or not after or after["batches"] < before["batches"]:
+        return None
+    batches = after["batches"] - before["batches"]
+    requests = after["requests"] - before["requests"]
+    if not batches:
+        return {"batches": 0}
+    return {"batches": batches, "requests_per_batch": round(requests / batches, 2),
+            "avg_commit_ms": round((after["commit_ms"] - before["commit_ms"]) / batches, 2)}
+
+def run_exp_ingest():
+    """
+    Ingestion concurrente: POST /post en boucle ouverte à débit croissant, puis lectures des mêmes
+    utilisateurs pour mesurer leur coût (RPC et entités par requête, d'après Server-Timing).
+    À lancer une fois par déploiement (POST_SHARDS=1, puis POST_SHARDS=N) et comparer les runs.
+    """
+    shards = seeding.POST_SHARDS
+    served = (fetch_admin("/admin/planner") or {}).get("post_shards")
+    print(f"\n=== EXP 6: INGESTION CONCURRENTE (POST_SHARDS={shards}, app: {served or '?'}) ===")
+    if served is not None and served != shards:
+        print(f"  [WARN] l'app écrit sur {served} shard(s): relancer avec POST_SHARDS={served}")
+    # Résultats distincts par agencement: ingest.csv (non shardé), ingest_shards4.csv...
+    layout = "pull" if shards == 1 else f"shards{shards}"
+    results = []
+    recorder = RunRecorder("ingest", layout, params={"post_shards": shards, "served_post_shards": served})
+    prefix = "ingest"
+    ensure_dataset(500, 20, 20, prefix)
+    sessions = asyncio.run(open_sessions([f"{prefix}{i}" for i in range(1, 501)]))
+
+    for rate in [50, 100, 200]:
+        print(f"Testing {rate} posts/s")
+        for run in range(1, 4):
+            writes = WorkloadMix(prefix, 500, read=0, post=1, follow=0, seed=BENCH_SEED + run)
+            before = fetch_admin("/admin/commits")
+            stats, _ = asyncio.run(run_workload(writes, sessions=sessions, rate=rate, duration=15, warmup=2))
+            print(stats.report())
+            commits = group_commit_report(before, fetch_admin("/admin/commits"))
+            print(f"     Commit groupé: {commits or 'compteurs indisponibles'}")
+            recorder.add(f"{rate}/post", run, stats, prefix, group_commit=commits)
+            # Lectures juste après la rafale: coût de la fusion des shards sur des posts tout frais
+            reads = WorkloadMix(prefix, 500, read=1, post=0, follow=0, seed=BENCH_SEED + run)
+            read_stats, _ = asyncio.run(run_workload(reads, rate=50, duration=10, warmup=1))
+            print(read_stats.report())
+            recorder.add(f"{rate}/read", run, read_stats, prefix)
+            avg = stats.service.mean if stats.service.count else 0
+            print(f"   Run {run}: {avg:.2f} ms (posts), {stats.throughput:.1f} posts/s servis")
+            results.append([rate, avg, run, 1 if stats.errors else 0])
+
+    # Les posts de la rafale ont modifié le jeu: il sera regénéré au prochain run
+    seeding.update_manifest(get_client(), prefix, complete=False)
+    recorder.save()
+    write_results(f"{result_name('ingest', layout)}.csv", results)
+    generate_graph("ingest", layout)
+
+def run_micro(users=1000, posts=50, follows=20, distribution="uniform", samples=200, latency_ms=0.0):
+    """
+    Microbenchmark en processus sur le backend mémoire (storage.py), sans réseau ni GCP: débit du
+    seed, latence de fetch_timeline par mode et de chaque stratégie pull, débit du nettoyage.
+    Chaque appel est tracé comme une requête: RPC et entités lues par appel.
+    """
+    os.environ["DATASTORE_BACKEND"] = "memory"
+    os.environ["MEMSTORE_LATENCY_MS"] = str(latency_ms)
+    import main as app  # après le choix du backend: main crée son client à l'import
+    global _client
+    _client = storage.get_client()
+    prefix = "micro"
+    print(f"\n=== MICRO: backend mémoire, latence {latency_ms:g}ms/RPC, {users} users, {posts} posts, "
+          f"{follows} follows ({distribution}) ===")
+    recorder = RunRecorder("micro", params={"users": users, "posts": posts, "follows": follows,
+                                            "distribution": distribution, "samples": samples,
+                                            "latency_ms": latency_ms, "post_shards": seeding.POST_SHARDS})
+    clean.clean(prefix, client=_client)
+    started = time.perf_counter()
+    app.seed_data(users, posts, follows, prefix, timelines=False, seed=BENCH_SEED, distribution=distribution)
+    seconds = time.perf_counter() - started
+    print(f"[SEED] {users * posts} posts en {seconds:.2f}s ({users * posts / seconds:.0f} posts/s)")
+    started = time.perf_counter()
+    entries = app.rebuild_timelines(prefix)["entries_written"]
+    print(f"[TIMELINES] {entries} entrées en {time.perf_counter() - started:.2f}s")
+
+    rng = random.Random(BENCH_SEED)
+    names = [f"{prefix}{rng.randint(1, users)}" for _ in range(samples)]
+
+    def measure(label, call):
+        stats = LoadStats()
+        rpcs = entities = 0
+        for name in names:
+            # Timeline recalculée à chaque appel; le cache des follows reste chaud, comme en production
+            app.timeline_cache.discard_where(lambda k, v: True)
+            token = instrumentation.start("micro", label)
+            try:
+                started = time.perf_counter()
+                strategy = call(name)
+                ms = (time.perf_counter() - started) * 1000
+                trace = instrumentation.current()
+                rpcs += sum(trace.rpcs.values())
+                entities += sum(trace.entities.values())
+            finally:
+                instrumentation.end(token)
+            stats.record(200, ms, time.perf_counter(), strategy=strategy)
+        print(f"  {label:<18} RPC/appel={rpcs / samples:5.1f} entités/appel={entities / samples:7.1f} "
+              f"stratégies={dict(stats.strategies)}")
+        print(stats.report())
+        recorder.add(label, 1, stats, prefix, rpcs_per_call=rpcs / samples, entities_per_call=entities / samples)
+
+    for mode in app.TIMELINE_MODES:
+        measure(mode, lambda name, mode=mode: app.fetch_timeline(name, limit=20, mode=mode).strategy)
+    for strategy in ("in", "chunked_in", "head_pruned", "per_author"):
+        if strategy == "in" and follows + 1 > app.IN_MAX:
+            continue  # refusé par Datastore au-delà de IN_MAX valeurs, le moteur mémoire l'accepterait
+        measure(f"pull:{strategy}", lambda name, strategy=strategy: (
+            app.run_strategy(strategy, sorted({*app.get_follows(name), name}), 20), strategy)[1])
+
+    started = time.perf_counter()
+    deleted = sum(clean.clean(prefix, client=_client).values())
+    seconds = time.perf_counter() - started
+    print(f"[CLEAN] {deleted} entités en {seconds:.2f}s ({deleted / seconds:.0f}/s)")
+    recorder.save()
+
+def add_load_arguments(p, duration=10.0):
+    """Options du moteur communes à 'load' et 'workload'."""
+    p.add_argument("--rate", type=float, help="Boucle ouverte: requêtes par seconde")
+    p.add_argument("--concurrency", type=int, help="Concurrence fixe: nombre de clients")
+    p.add_argument("--duration", type=float, default=duration, help="Durée mesurée (s)")
+    p.add_argument("--total", type=int, help="Nombre de requêtes mesurées (au lieu d'une durée)")
+    p.add_argument("--warmup", type=float, default=2.0, help="Échauffement non mesuré (s)")
+    p.add_argument("--ramp", type=float, default=0.0, help="Montée en charge (s)")
+    p.add_argument("--co-correction", action="store_true",
+                   help="Concurrence fixe: corrige l'omission coordonnée (intervalle = médiane de l'échauffement)")
+    p.add_argument("--connections", type=int, help="Taille du pool de connexions")
+    p.add_argument("--timeline-mode", default=None)
+
+def load_options(args):
+    """Arguments de run_load tirés des options communes."""
+    return dict(rate=args.rate, concurrency=args.concurrency, duration=None if args.total else args.duration,
+                total=args.total, warmup=args.warmup, ramp=args.ramp, correct_co=args.co_correction,
+                connections=args.connections)
+
+def parse_load_args(argv):
+    p = argparse.ArgumentParser(prog="benchmark.py load", description="Charge /api/timeline sur BENCH_URL")
+    add_load_arguments(p)
+    p.add_argument("--prefix", default="user")
+    p.add_argument("--users", type=int, default=1000)
+    args = p.parse_args(argv)
+    if (args.rate is None) == (args.concurrency is None):
+        p.error("préciser --rate ou --concurrency")
+    return args
+
+def run_load_cli(argv):
+    args = parse_load_args(argv)
+    suffix = f"&mode={args.timeline_mode}" if args.timeline_mode else ""
+
+    def next_request():
+        return Request("GET", f"{URL}/api/timeline?user={args.prefix}{random.randint(1, args.users)}{suffix}")
+
+    target = f"{args.rate:g} req/s" if args.rate else f"{args.concurrency} clients"
+    print(f"[LOAD] {URL} - {target}, rampe {args.ramp}s, échauffement {args.warmup}s, "
+          f"{f'{args.total} requêtes' if args.total else f'{args.duration}s'}")
+    recorder = RunRecorder("load", args.timeline_mode or "pull", vars(args))
+    stats = asyncio.run(run_load(next_request, **load_options(args)))
+    print(stats.report())
+    recorder.add("load", 1, stats, args.prefix)
+    recorder.save()
+    return stats
+
+def parse_workload_args(argv):
+    p = argparse.ArgumentParser(prog="benchmark.py workload",
+                                description="Mélange lectures/posts/follows (popularité Zipf) sur BENCH_URL")
+    add_load_arguments(p, duration=30.0)
+    p.add_argument("--read", type=float, default=0.9, help="Part de lectures /api/timeline")
+    p.add_argument("--post", type=float, default=0.08, help="Part de POST /post")
+    p.add_argument("--follow", type=float, default=0.02, help="Part de POST /follow")
+    p.add_argument("--prefix", default="mix")
+    p.add_argument("--users", type=int, default=1000)
+    p.add_argument("--zipf-s", type=float, default=ZIPF_S, help="Exposant de popularité (0 = uniforme)")
+    p.add_argument("--seed", type=int, default=BENCH_SEED, help="Graine du tirage des requêtes")
+    p.add_argument("--record", nargs="?", const=TRACE_FILE, default=None,
+                   help=f"Enregistre la trace des requêtes (défaut: {TRACE_FILE})")
+    args = p.parse_args(argv)
+    if (args.rate is None) == (args.concurrency is None):
+        p.error("préciser --rate ou --concurrency")
+    return args
+
+def run_workload_cli(argv):
+    args = parse_workload_args(argv)
+    mix = WorkloadMix(args.prefix, args.users, args.read, args.post, args.follow, args.zipf_s,
+                      args.timeline_mode, args.seed)
+    sessions = asyncio.run(open_sessions(mix.writers()))
+    print(f"[WORKLOAD] {URL} - lectures {args.read:g} / posts {args.post:g} / follows {args.follow:g}, "
+          f"{args.users} utilisateurs '{args.prefix}' (Zipf s={args.zipf_s:g}), {len(sessions)} sessions")
+    recorder = RunRecorder("workload", args.timeline_mode or "pull", vars(args))
+    stats, cache = asyncio.run(run_workload(mix, sessions=sessions, trace_path=args.record, **load_options(args)))
+    print(stats.report())
+    print(cache)
+    recorder.add("workload", 1, stats, args.prefix)
+    recorder.save()
+    if args.record:
+        print(f"[TRACE] Saved -> {args.record}")
+    return stats
+
+def parse_replay_args(argv):
+    p = argparse.ArgumentParser(prog="benchmark.py replay",
+                                description="Rejoue une trace enregistrée avec ses intervalles d'origine")
+    p.add_argument("trace", nargs="?", default=TRACE_FILE)
+    p.add_argument("--speed", type=float, default=1.0, help="Facteur d'accélération (2 = deux fois plus vite)")
+    p.add_argument("--warmup", type=float, default=0.0, help="Début de trace non mesuré (s)")
+    p.add_argument("--connections", type=int, help="Taille du pool de connexions")
+    return p.parse_args(argv)
+
+def run_replay_cli(argv):
+    args = parse_replay_args(argv)
+    schedule = load_trace(args.trace, args.speed)
+    sessions = asyncio.run(open_sessions(sorted({r.session for _, r in schedule if r.session is not None})))
+    span = schedule[-1][0] if schedule else 0.0
+    print(f"[REPLAY] {args.trace}: {len(schedule)} requêtes sur {span:.1f}s (x{args.speed:g}) vers {URL}")
+    recorder = RunRecorder("replay", params=vars(args))
+    stats, cache = asyncio.run(run_workload(schedule=schedule, sessions=sessions, warmup=args.warmup,
+                                            connections=args.connections))
+    print(stats.report())
+    print(cache)
+    recorder.add(os.path.basename(args.trace), 1, stats)
+    recorder.save()
+    return stats
+
+STARTUP_TIMING = re.compile(r'startup;desc="import";dur=([\d.]+)')
+
+async def request_sequence(urls, timeout=60):
+    """Requêtes GET l'une après l'autre sur une connexion neuve: [(statut, ms, en-têtes)]."""
+    client = make_http_client(1, timeout)
+    results = []
+    try:
+        for url in urls:
+            started = time.perf_counter()
+            try:
+                status, headers, _ = await client.request("GET", url)
+            except asyncio.TimeoutError:
+                status, headers = "timeout", {}
+            except Exception as e:
+                status, headers = type(e).__name__, {}
+            results.append((status, (time.perf_counter() - started) * 1000, headers))
+    finally:
+        await client.close()
+    return results
+
+def parse_coldstart_args(argv):
+    p = argparse.ArgumentParser(prog="benchmark.py coldstart",
+                                description="Latence de la première requête après inactivité vs régime établi")
+    p.add_argument("--cycles", type=int, default=3)
+    p.add_argument("--idle", type=float, default=900,
+                   help="Inactivité avant chaque cycle (s): le temps qu'App Engine arrête ses instances")
+    p.add_argument("--before-cycle", help="Commande shell lancée avant chaque cycle (ex: redémarrer la version)")
+    p.add_argument("--steady", type=int, default=50, help="Requêtes mesurées après la première, en séquence")
+    p.add_argument("--prefix", default="user")
+    p.add_argument("--users", type=int, default=1000)
+    p.add_argument("--timeline-mode", default=None)
+    return p.parse_args(argv)
+
+def run_coldstart_cli(argv):
+    """
+    Chaque cycle: inactivité (ou --before-cycle), puis une requête de timeline suivie de --steady
+    autres. La première est comptée à part ('first'), les suivantes en régime établi ('steady').
+    L'en-tête X-Instance-Cold indique si la requête a payé le démarrage de l'instance (sinon le
+    warmup l'a absorbé, ou l'instance n'avait pas été arrêtée).
+    """
+    args = parse_coldstart_args(argv)
+    suffix = f"&mode={args.timeline_mode}" if args.timeline_mode else ""
+    rng = random.Random(BENCH_SEED)
+    first, steady = LoadStats(), LoadStats()
+    cycles = []
+    recorder = RunRecorder("coldstart", args.timeline_mode or "pull", vars(args))
+    print(f"[COLDSTART] {URL} - {args.cycles} cycles, {args.idle:g}s d'inactivité, {args.steady} requêtes ensuite")
+    for cycle in range(1, args.cycles + 1):
+        if args.before_cycle:
+            subprocess.run(args.before_cycle, shell=True, check=True)
+        if args.idle > 0:
+            print(f"  Cycle {cycle}: inactivité {args.idle:g}s...")
+            time.sleep(args.idle)
+        urls = [f"{URL}/api/timeline?user={args.prefix}{rng.randint(1, args.users)}{suffix}"
+                for _ in range(1 + args.steady)]
+        results = asyncio.run(request_sequence(urls))
+        for i, (status, ms, headers) in enumerate(results):
+            (first if i == 0 else steady).record(status, ms, time.perf_counter(),
+                                                 strategy=headers.get("x-timeline-strategy"),
+                                                 cost=server_cost(headers.get("server-timing")))
+        status, ms, headers = results[0]
+        startup = STARTUP_TIMING.search(headers.get("server-timing", ""))
+        cycles.append({"cycle": cycle, "first_ms": round(ms, 2), "status": status,
+                       "instance": headers.get("x-instance-id"), "cold": headers.get("x-instance-cold") == "1",
+                       "import_ms": float(startup[1]) if startup else None})
+        state = "à froid" if cycles[-1]["cold"] else "instance déjà prête"
+        print(f"  Cycle {cycle}: première requête {ms:.1f}ms ({state}"
+              f"{f', import {startup[1]}ms' if startup else ''}), instance {cycles[-1]['instance']}")
+    print("  Première requête:")
+    print(first.report())
+    print("  Régime établi:")
+    print(steady.report())
+    recorder.add("first", 1, first, args.prefix, cycles=cycles)
+    recorder.add("steady", 1, steady, args.prefix)
+    recorder.save()
+    return first, steady
+
+def start_local_server(threads, port=8090, latency_ms=10.0, users=500, posts=20, follows=20, prefix="cap"):
+    """
+    Lance l'app sous Gunicorn (gunicorn.conf.py) sur le backend mémoire, un seul processus, avec
+    'threads' threads (1 = worker sync) et 'latency_ms' par RPC, puis la peuple par /admin/seed.
+    Retourne le processus; URL pointe sur lui.
+    """
+    global URL
+    repo = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, "PORT": str(port), "DATASTORE_BACKEND": "memory", "MEMSTORE_LATENCY_MS": str(latency_ms),
+           "GUNICORN_WORKERS": "1", "GUNICORN_THREADS": str(threads), "REQUEST_LOG": "0", "SEED_TOKEN": ""}
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"],
+                              cwd=repo, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    URL = f"http://127.0.0.1:{port}"
+
+    async def seed_server():
+        client = make_http_client(1, 300)
+        try:
+            for _ in range(100):
+                try:
+                    await client.request("GET", f"{URL}/metrics")
+                    break
+                except OSError:
+                    await asyncio.sleep(0.1)
+            query = urlencode({"users": users, "posts": posts, "follows": follows, "prefix": prefix,
+                               "seed": BENCH_SEED})
+            status, _, _ = await client.request("GET", f"{URL}/admin/seed?{query}")
+            if status != 200:
+                raise RuntimeError(f"seed du serveur local refusé (statut {status})")
+        finally:
+            await client.close()
+    try:
+        asyncio.run(seed_server())
+    except BaseException:
+        server.terminate()
+        raise
+    return server
+
+def parse_capacity_args(argv):
+    p = argparse.ArgumentParser(prog="benchmark.py capacity",
+                                description="Débit maximal d'une instance à p95 donné (balayage de débits)")
+    p.add_argument("--p95", type=float, default=200.0, help="Objectif de latence p95 (ms)")
+    p.add_argument("--rates", default="10,20,40,80,160,320,640", help="Débits essayés, croissants (req/s)")
+    p.add_argument("--duration", type=float, default=15.0, help="Durée mesurée par débit (s)")
+    p.add_argument("--warmup", type=float, default=2.0)
+    p.add_argument("--max-error-rate", type=float, default=0.01)
+    p.add_argument("--prefix", default="user")
+    p.add_argument("--users", type=int, default=1000)
+    p.add_argument("--timeline-mode", default=None)
+    p.add_argument("--local-threads", type=int, default=None,
+                   help="Sert l'app en local (Gunicorn, backend mémoire) avec N threads (1 = sync) au lieu de BENCH_URL")
+    p.add_argument("--latency-ms", type=float, default=10.0, help="Latence par RPC du serveur local")
+    return p.parse_args(argv)
+
+def run_capacity_cli(argv):
+    """
+    Débit soutenable par une instance: débits croissants en boucle ouverte jusqu'à dépasser l'objectif
+    p95 (ou le taux d'erreurs admis). À comparer entre deux configurations de workers, sur une
+    instance unique (max_instances: 1 sur App Engine, ou --local-threads 1 puis 10).
+    """
+    args = parse_capacity_args(argv)
+    server = None
+    if args.local_threads is not None:
+        args.prefix, args.users = "cap", 500
+        server = start_local_server(args.local_threads, latency_ms=args.latency_ms, users=args.users,
+                                    prefix=args.prefix)
+    try:
+        suffix = f"&mode={args.timeline_mode}" if args.timeline_mode else ""
+
+        def next_request():
+            return Request("GET", f"{URL}/api/timeline?user={args.prefix}{random.randint(1, args.users)}{suffix}")
+
+        workers = f"{args.local_threads} thread(s), local" if server else "BENCH_URL"
+        print(f"[CAPACITY] {URL} ({workers}) - objectif p95 <= {args.p95:g}ms")
+        recorder = RunRecorder("capacity", args.timeline_mode or "pull", vars(args))
+        capacity = None
+        for rate in (float(r) for r in args.rates.split(",")):
+            stats = asyncio.run(run_load(next_request, rate=rate, duration=args.duration, warmup=args.warmup))
+            p95 = stats.histogram.percentile(95) if stats.histogram.count else math.inf
+            error_rate = sum(stats.errors.values()) / max(1, stats.responses)
+            within = p95 <= args.p95 and error_rate <= args.max_error_rate
+            print(f"  {rate:g} req/s: {'objectif tenu' if within else 'hors objectif'}")
+            print(stats.report())
+            recorder.add(f"{rate:g}", 1, stats, None if server else args.prefix, within_slo=within)
+            if not within:
+                break
+            capacity = stats.throughput
+        recorder.record["capacity_rps"] = capacity
+        print(f"[CAPACITY] {f'{capacity:.1f} req/s' if capacity else 'objectif non tenu au premier débit'}"
+              f" à p95 <= {args.p95:g}ms")
+        recorder.save()
+        return capacity
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+def parse_compare_args(argv):
+    p = argparse.ArgumentParser(prog="benchmark.py compare",
+                                description="Compare deux runs de out/runs (code de sortie 1 si régression)")
+    p.add_argument("base", help="Run de référence (identifiant ou chemin)")
+    p.add_argument("candidate", help="Run à évaluer (identifiant ou chemin)")
+    p.add_argument("--metric", action="append", help="Percentile(s) comparé(s) (défaut: p95 et p99)")
+    p.add_argument("--iterations", type=int, default=2000, help="Rééchantillonnages bootstrap")
+    p.add_argument("--confidence", type=float, default=0.95, help="Niveau de l'intervalle de confiance")
+    p.add_argument("--min-change", type=float, default=0.05,
+                   help="Hausse relative minimale pour parler de régression (0.05 = 5%%)")
+    return p.parse_args(argv)
+
+def run_compare_cli(argv):
+    """Affiche la comparaison et retourne le code de sortie: 1 en cas de régression, 0 sinon."""
+    args = parse_compare_args(argv)
+    base, candidate = load_run(args.base), load_run(args.candidate)
+    for name, run in (("base", base), ("candidat", candidate)):
+        git = run.get("git") or {}
+        strategies = Counter()
+        for point in run["points"]:
+            strategies.update(point.get("strategies", {}))
+        print(f"[{name}] {run['id']}: {run['experiment']} ({run['timeline_mode']}), "
+              f"rev {git.get('rev', '?')[:7]}{' (modifié)' if git.get('dirty') else ''}, "
+              f"stratégies {dict(strategies) or '-'}, erreurs "
+              f"{sum(sum(point['errors'].values()) for point in run['points'])}")
+    if base["experiment"] != candidate["experiment"]:
+        print("  Attention: expériences différentes, seuls les points de même libellé sont comparés.")
+    for prefix in set(base["datasets"]) & set(candidate["datasets"]):
+        a, b = base["datasets"][prefix] or {}, candidate["datasets"][prefix] or {}
+        if any(a.get(field) != b.get(field) for field in seeding.GRAPH_FIELDS + ("posts_per_user",)):
+            print(f"  Attention: jeu de données '{prefix}' différent entre les deux runs.")
+    regressions = compare_runs(base, candidate, tuple(args.metric or ("p95", "p99")), args.iterations,
+                               args.confidence, args.min_change)
+    if regressions:
+        print(f"[COMPARE] {len(regressions)} régression(s): {', '.join(f'{l} {m}' for l, m in regressions)}")
+        return 1
+    print("[COMPARE] Pas de régression significative.")
+    return 0
+
+def parse_micro_args(argv):
+    p = argparse.ArgumentParser(prog="benchmark.py micro", description="Microbenchmark sur le backend mémoire")
+    p.add_argument("--users", type=int, default=1000)
+    p.add_argument("--posts", type=int, default=50)
+    p.add_argument("--follows", type=int, default=20)
+    p.add_argument("--distribution", choices=["uniform", "zipf"], default="uniform")
+    p.add_argument("--samples", type=int, default=200, help="Timelines calculées par mode")
+    p.add_argument("--latency-ms", type=float, default=0.0, help="Latence injectée par RPC")
+    return p.parse_args(argv)
+
+def parse_stub_args(argv):
+    p = argparse.ArgumentParser(prog="benchmark.py stub", description="Serveur local de substitution")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8081)
+    p.add_argument("--latency-ms", type=float, default=20.0)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    return p.parse_args(argv)
 
 # ------------------ MAIN ------------------
 
 if __name__ == "__main__":
     ensure_dir(OUT_DIR)
     mode = sys.argv[1]
+    # Mode de timeline côté serveur: pull (défaut) ou push, ex: python benchmark.py fanout push
+    timeline_mode = sys.argv[2] if len(sys.argv) > 2 else "pull"
     if mode == "conc": run_exp_concurrency()
     elif mode == "post": run_exp_post()
-    elif mode == "fanout": run_exp_fanout()
+    elif mode == "fanout": run_exp_fanout(timeline_mode)
+    elif mode == "hybrid": run_exp_hybrid()
+    # Moteur seul, ex: BENCH_URL=http://127.0.0.1:8081 python benchmark.py load --rate 500 --duration 10
+    elif mode == "load": run_load_cli(sys.argv[2:])
+    elif mode == "mix": run_exp_mix()
+    # Même commande sur deux déploiements (POST_SHARDS=1 puis N, même valeur côté benchmark)
+    elif mode == "ingest": run_exp_ingest()
+    # Mélange seul, ex: python benchmark.py workload --rate 200 --post 0.1 --follow 0.02 --record
+    elif mode == "workload": run_workload_cli(sys.argv[2:])
+    elif mode == "replay": run_replay_cli(sys.argv[2:])
+    # Ex: python benchmark.py coldstart --cycles 3 --idle 900 (ou --idle 0 --before-cycle "<redémarrage>")
+    elif mode == "coldstart": run_coldstart_cli(sys.argv[2:])
+    # Ex: python benchmark.py capacity --local-threads 1, puis --local-threads 10 (même p95 visé)
+    elif mode == "capacity": run_capacity_cli(sys.argv[2:])
+    # Hors réseau, ex: python benchmark.py micro --users 1000 --follows 100 --latency-ms 2
+    elif mode == "micro": run_micro(**vars(parse_micro_args(sys.argv[2:])))
+    # Ex: python benchmark.py compare <run de référence> <nouveau run> (sort en 1 si régression p95/p99)
+    elif mode == "compare": sys.exit(run_compare_cli(sys.argv[2:]))
+    elif mode == "stub":
+        stub = parse_stub_args(sys.argv[2:])
+        asyncio.run(serve_stub(stub.host, stub.port, stub.latency_ms, stub.error_rate))
     elif mode == "all":
         run_exp_concurrency()
         run_exp_post()
@@ -1,33 +1,102 @@
-from google.cloud import datastore
+"""
+Nettoyage de la base TinyInsta.
+Sans option, vide toutes les entités du projet. Avec --prefix, ne supprime que le jeu de données
+d'un préfixe (utilisateurs '<prefix><n>' du seed, leurs posts, arêtes et timelines): les autres
+expériences sont conservées.
+"""
+import argparse
 
-def delete_all(kind):
-    client = datastore.Client()
+import seeding
+import storage
+
+# Ordre de suppression: le manifeste d'abord (le jeu n'est plus réutilisable), les données
+# dérivées ensuite, les utilisateurs en dernier
+KINDS = ['Dataset', 'Post', 'TimelineEntry', 'TimelineSnapshot', 'AuthorHead', 'Follow', 'User', 'SeedJob']
+
+# Propriété portant le nom d'utilisateur, pour une suppression par préfixe
+# ('__key__': le nom de la clé est le nom d'utilisateur)
+PREFIX_PROPERTY = {
+    'Dataset': 'prefix',
+    'Post': 'author',
+    'TimelineEntry': 'owner',
+    'TimelineSnapshot': '__key__',
+    'AuthorHead': '__key__',
+    'Follow': 'follower',
+    'User': '__key__',
+    'SeedJob': 'prefix',
+}
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Clean Datastore for Tiny Instagram")
+    p.add_argument('--prefix', type=str, default=None,
+                   help="Ne supprimer que le jeu de données de ce préfixe (utilisateurs <prefix><n>)")
+    p.add_argument('--kind', action='append', choices=KINDS, help="Limiter à ce(s) type(s) d'entité")
+    p.add_argument('--workers', type=int, default=8, help="Threads de suppression (delete_multi en parallèle)")
+    p.add_argument('--page-size', type=int, default=1000, help="Clés lues par page de requête")
+    return p.parse_args()
+
+
+def scoped_query(client, kind, prefix=None):
+    """Requête keys_only sur 'kind', restreinte aux utilisateurs du préfixe si fourni."""
     query = client.query(kind=kind)
     query.keys_only()  # On récupère seulement les IDs pour aller plus vite
-    
-    keys = list(query.fetch())
-    
-    if not keys:
+    if prefix is None:
+        return query
+    prop = PREFIX_PROPERTY[kind]
+    low, high = seeding.prefix_range(prefix)
+    if prop == 'prefix':
+        # Manifeste et jobs: une entité par préfixe, pas par utilisateur
+        query.add_filter('prefix', '=', prefix)
+    elif prop == '__key__':
+        query.key_filter(client.key(kind, low), '>=')
+        query.key_filter(client.key(kind, high), '<')
+    else:
+        query.add_filter(prop, '>=', low)
+        query.add_filter(prop, '<', high)
+    return query
+
+
+def iter_keys(query, page_size=1000):
+    """Parcourt les clés page par page avec le curseur Datastore: mémoire constante."""
+    cursor = None
+    while True:
+        it = query.fetch(limit=page_size, start_cursor=cursor)
+        count = 0
+        for entity in next(it.pages, []):
+            count += 1
+            yield entity.key
+        cursor = it.next_page_token
+        if count < page_size or cursor is None:
+            return
+
+
+def delete_all(kind, prefix=None, client=None, workers=8, page_size=1000):
+    """Supprime les entités 'kind' (du préfixe si fourni) par paquets delete_multi en parallèle."""
+    client = client or storage.get_client()
+    scope = f" du préfixe '{prefix}'" if prefix is not None else ''
+    print(f"Suppression des entités '{kind}'{scope}...")
+    progress = seeding.Progress(f"'{kind}' supprimés")
+    with seeding.BatchWriter(client, workers=workers) as writer:
+        deleted = writer.delete(iter_keys(scoped_query(client, kind, prefix), page_size), progress)
+    if not deleted:
         print(f"Aucune entité '{kind}' trouvée.")
-        return
-
-    print(f"Suppression de {len(keys)} entités de type '{kind}'...")
-    
-    # Suppression par paquets de 400 (limite Datastore)
-    batch_size = 400
-    for i in range(0, len(keys), batch_size):
-        batch = keys[i:i + batch_size]
-        client.delete_multi(batch)
-        print(f" - {len(batch)} supprimés...")
-    
-    print(f"Terminé pour '{kind}'.")
+    else:
+        progress.finish()
+    return deleted
+
+
+def clean(prefix=None, kinds=None, workers=8, page_size=1000, client=None):
+    """Supprime les types 'kinds' (tous par défaut); retourne le nombre d'entités supprimées par type."""
+    client = client or storage.get_client()
+    return {kind: delete_all(kind, prefix, client, workers, page_size) for kind in kinds or KINDS}
+
 
 if __name__ == '__main__':
+    args = parse_args()
     print("--- NETTOYAGE DE LA BASE DE DONNÉES ---")
-    
-    # 1. Supprimer les Posts
-    delete_all('Post')
-    
-    # 2. Supprimer les Users
-    delete_all('User')
-print("\nLa base de données est vide.")
+    total = seeding.Progress('total supprimé')
+    total.add(sum(clean(args.prefix, args.kind, args.workers, args.page_size).values()))
+    total.finish()
+    if args.prefix is None and args.kind is None:
+        print("\nLa base de données est vide.")
@@ -0,0 +1,27 @@
+"""
+Configuration Gunicorn de TinyInsta (app.yaml: gunicorn -c gunicorn.conf.py main:app).
+
+Workers 'gthread': chaque worker sert plusieurs requêtes à la fois, une par thread. Une requête qui
+attend Datastore (RPC gRPC, GIL relâché pendant l'attente) ne bloque plus les autres: une instance
+absorbe la concurrence que lui envoie App Engine (max_concurrent_requests) au lieu de la mettre en
+file. Les workers asynchrones (gevent) demanderaient de patcher gRPC: les threads suffisent ici.
+Tout l'état partagé du processus (client, caches, planificateur, commit groupé, métriques) est
+protégé par des verrous.
+"""
+import os
+
+bind = f":{os.environ.get('PORT', '8080')}"
+
+# Concurrence visée par instance: à garder égale à automatic_scaling.max_concurrent_requests
+_max_concurrent = int(os.environ.get('MAX_CONCURRENT_REQUESTS', '10'))
+# Un seul processus sur F1 (un cœur partagé, 384 Mo): le parallélisme vient des threads, et les
+# caches en mémoire ne sont pas dupliqués d'un processus à l'autre
+workers = int(os.environ.get('GUNICORN_WORKERS', '1'))
+# Assez de threads pour servir toutes les requêtes admises en même temps (GUNICORN_THREADS=1: sync)
+threads = int(os.environ.get('GUNICORN_THREADS', str(max(1, -(-_max_concurrent // workers)))))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# Le seed et la reconstruction des timelines passent par des requêtes /admin longues
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+# Journal d'accès inutile: chaque requête écrit déjà sa ligne JSON (instrumentation.py)
+accesslog = None
@@ -0,0 +1,347 @@
+"""
+Instrumentation par requête de TinyInsta.
+
+Chaque requête HTTP ouvre une trace (RequestTrace) rangée dans une ContextVar. Le client
+Datastore enveloppé (InstrumentedClient) y ajoute chaque RPC (appels, entités, durée) et
+stage() y chronomètre les étapes du traitement. En fin de requête, la trace devient un en-tête
+Server-Timing et une ligne de log JSON, et elle alimente les métriques du processus exposées
+sur /metrics (format texte Prometheus).
+Les threads d'un pool n'héritent pas du contexte: une tâche soumise pour le compte de la
+requête doit être enveloppée par propagate(). Sans trace (tâches de fond), les RPC ne sont
+comptées que dans les métriques, sous la route 'background'.
+"""
+from __future__ import annotations
+
+import contextvars
+import json
+import logging
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+# Seaux des histogrammes de latence (secondes)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BACKGROUND = 'background'
+
+_current = contextvars.ContextVar('request_trace', default=None)
+
+# Une ligne JSON par requête sur la sortie standard (reconnue comme log structuré par App Engine)
+request_log = logging.getLogger('tinyinsta.requests')
+request_log.propagate = False
+if not request_log.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    request_log.addHandler(_handler)
+    request_log.setLevel(logging.INFO)
+
+
+class RequestTrace:
+    """Mesures d'une requête. Partagée avec les threads du pool de requêtes: mises à jour sous verrou."""
+
+    def __init__(self, route: str, method: str):
+        self.route = route
+        self.method = method
+        self.strategy = None
+        self.started = time.perf_counter()
+        self.rpcs = Counter()      # méthode Datastore -> appels
+        self.entities = Counter()  # méthode Datastore -> entités lues ou écrites
+        self.rpc_ms = Counter()    # méthode Datastore -> durée cumulée
+        self.stages = {}           # étape -> durée cumulée (ms), dans l'ordre d'apparition
+        self._lock = threading.Lock()
+
+    def add_rpc(self, method: str, ms: float, entities: int = 0):
+        with self._lock:
+            self.rpcs[method] += 1
+            self.entities[method] += entities
+            self.rpc_ms[method] += ms
+
+    def add_stage(self, name: str, ms: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self, total_ms: float) -> str:
+        """En-tête Server-Timing: Datastore (RPC et entités en description), étapes, total."""
+        parts = []
+        if self.rpcs:
+            desc = f"rpc={sum(self.rpcs.values())} entities={sum(self.entities.values())}"
+            parts.append(f'datastore;desc="{desc}";dur={sum(self.rpc_ms.values()):.2f}')
+        parts += [f"{name};dur={ms:.2f}" for name, ms in self.stages.items()]
+        parts.append(f"total;dur={total_ms:.2f}")
+        return ', '.join(parts)
+
+    def to_log(self, status: int, total_ms: float) -> dict:
+        return {
+            'severity': 'ERROR' if status >= 500 else 'INFO',
+            'message': f"{self.method} {self.route} {status} {total_ms:.1f}ms",
+            'route': self.route,
+            'method': self.method,
+            'status': status,
+            'latency_ms': round(total_ms, 2),
+            'strategy': self.strategy,
+            'rpcs': dict(self.rpcs),
+            'entities': dict(self.entities),
+            'datastore_ms': {m: round(ms, 2) for m, ms in self.rpc_ms.items()},
+            'stages_ms': {name: round(ms, 2) for name, ms in self.stages.items()},
+        }
+
+
+def start(route: str, method: str):
+    """Ouvre la trace de la requête courante; retourne le jeton à passer à end()."""
+    return _current.set(RequestTrace(route, method))
+
+
+def current():
+    return _current.get()
+
+
+def end(token):
+    _current.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    """Chronomètre un bloc comme étape de la requête courante (sans effet hors requête)."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_stage(name, (time.perf_counter() - started) * 1000)
+
+
+def propagate(fn):
+    """
+    'fn' exécutée dans une copie du contexte de l'appelant (trace comprise), pour pool.submit/map.
+    Chaque appel a sa propre copie: un même Context ne peut pas être actif dans deux threads.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+# ------------------ MÉTRIQUES (format texte Prometheus) ------------------
+
+class MetricsRegistry:
+    """Compteurs et histogrammes étiquetés, agrégés pour le processus (une instance App Engine)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._meta = {}                         # nom -> (type, aide)
+        self._counters = defaultdict(Counter)   # nom -> étiquettes -> valeur
+        self._histograms = defaultdict(dict)    # nom -> étiquettes -> [seaux..., somme, total]
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._meta[name] = (kind, help_text)
+
+    def inc(self, name: str, labels: dict, value: float = 1.0):
+        with self._lock:
+            self._counters[name][tuple(sorted(labels.items()))] += value
+
+    def observe(self, name: str, labels: dict, seconds: float):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms[name].get(key)
+            if series is None:
+                series = self._histograms[name][key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name in sorted(self._meta):
+                kind, help_text = self._meta[name]
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                if kind == 'counter':
+                    for key, value in sorted(self._counters[name].items()):
+                        lines.append(f"{name}{_labels(key)} {_number(value)}")
+                    continue
+                for key, series in sorted(self._histograms[name].items()):
+                    for bound, count in zip(self.buckets, series):
+                        lines.append(f"{name}_bucket{_labels(key + (('le', f'{bound:g}'),))} {count}")
+                    lines.append(f"{name}_bucket{_labels(key + (('le', '+Inf'),))} {series[-1]}")
+                    lines.append(f"{name}_sum{_labels(key)} {series[-2]:.6f}")
+                    lines.append(f"{name}_count{_labels(key)} {series[-1]}")
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value) -> str:
+    """Valeur exacte d'un compteur: entière si possible ('g' arrondirait à 6 chiffres significatifs)."""
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _labels(key) -> str:
+    if not key:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in key)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(key, escaped)) + '}'
+
+
+metrics = MetricsRegistry()
+metrics.describe('tinyinsta_http_requests_total', 'counter', "Requêtes HTTP par route, méthode et statut")
+metrics.describe('tinyinsta_http_request_duration_seconds', 'histogram', "Latence des requêtes HTTP par route")
+metrics.describe('tinyinsta_timeline_duration_seconds', 'histogram',
+                 "Latence des requêtes de timeline par stratégie (X-Timeline-Strategy)")
+metrics.describe('tinyinsta_stage_duration_seconds', 'histogram', "Durée des étapes instrumentées par route")
+metrics.describe('tinyinsta_datastore_rpcs_total', 'counter', "Appels Datastore par route et méthode")
+metrics.describe('tinyinsta_datastore_entities_total', 'counter',
+                 "Entités lues ou écrites par les appels Datastore, par route et méthode")
+metrics.describe('tinyinsta_datastore_rpc_duration_seconds', 'histogram', "Latence des appels Datastore par méthode")
+
+
+def record_rpc(method: str, ms: float, entities: int = 0):
+    trace = _current.get()
+    if trace is not None:
+        trace.add_rpc(method, ms, entities)
+    labels = {'route': trace.route if trace is not None else BACKGROUND, 'method': method}
+    metrics.inc('tinyinsta_datastore_rpcs_total', labels)
+    metrics.inc('tinyinsta_datastore_entities_total', labels, entities)
+    metrics.observe('tinyinsta_datastore_rpc_duration_seconds', {'method': method}, ms / 1000)
+
+
+def finish(trace: RequestTrace, status: int, total_ms: float, log: bool = True):
+    """Verse la trace terminée dans les métriques et le log structuré."""
+    route = {'route': trace.route}
+    metrics.inc('tinyinsta_http_requests_total', {**route, 'method': trace.method, 'status': str(status)})
+    metrics.observe('tinyinsta_http_request_duration_seconds', route, total_ms / 1000)
+    if trace.strategy:
+        metrics.observe('tinyinsta_timeline_duration_seconds', {'strategy': trace.strategy}, total_ms / 1000)
+    for name, ms in trace.stages.items():
+        metrics.observe('tinyinsta_stage_duration_seconds', {**route, 'stage': name}, ms / 1000)
+    if log:
+        request_log.info(json.dumps(trace.to_log(status, total_ms), ensure_ascii=False, separators=(',', ':')))
+
+
+# ------------------ CLIENT DATASTORE INSTRUMENTÉ ------------------
+
+class InstrumentedClient:
+    """
+    Enveloppe d'un datastore.Client: get/put/delete et les pages de requêtes sont comptés et
+    chronométrés; le reste (key, transaction...) est délégué tel quel.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _timed(self, method: str, rpc, count, *args, **kwargs):
+        if method.startswith(('put', 'delete')) and getattr(self._client, 'current_transaction', None):
+            # Mutation mise en attente dans la transaction: envoyée par son commit
+            return rpc(*args, **kwargs)
+        started = time.perf_counter()
+        result = None
+        try:
+            result = rpc(*args, **kwargs)
+            return result
+        finally:
+            record_rpc(method, (time.perf_counter() - started) * 1000, count(args, result))
+
+    def get(self, key, **kwargs):
+        return self._timed('get', self._client.get, lambda a, r: int(r is not None), key, **kwargs)
+
+    def get_multi(self, keys, **kwargs):
+        return self._timed('get_multi', self._client.get_multi, lambda a, r: len(r or ()), keys, **kwargs)
+
+    def put(self, entity, **kwargs):
+        return self._timed('put', self._client.put, lambda a, r: 1, entity, **kwargs)
+
+    def put_multi(self, entities, **kwargs):
+        entities = list(entities)
+        return self._timed('put_multi', self._client.put_multi, lambda a, r: len(entities), entities, **kwargs)
+
+    def delete(self, key, **kwargs):
+        return self._timed('delete', self._client.delete, lambda a, r: 1, key, **kwargs)
+
+    def delete_multi(self, keys, **kwargs):
+        keys = list(keys)
+        return self._timed('delete_multi', self._client.delete_multi, lambda a, r: len(keys), keys, **kwargs)
+
+    def query(self, **kwargs):
+        return InstrumentedQuery(self._client.query(**kwargs))
+
+    def transaction(self, **kwargs):
+        return InstrumentedTransaction(self._client.transaction(**kwargs))
+
+
+class InstrumentedTransaction:
+    """Transaction dont l'ouverture et le commit (avec ses mutations) sont comptés comme RPC."""
+
+    def __init__(self, transaction):
+        self._transaction = transaction
+
+    def __getattr__(self, name):
+        return getattr(self._transaction, name)
+
+    def __enter__(self):
+        started = time.perf_counter()
+        self._transaction.__enter__()
+        record_rpc('begin_transaction', (time.perf_counter() - started) * 1000)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        mutations = len(getattr(self._transaction, 'mutations', ()))
+        started = time.perf_counter()
+        try:
+            return self._transaction.__exit__(exc_type, exc_value, traceback)
+        finally:
+            record_rpc('commit' if exc_type is None else 'rollback', (time.perf_counter() - started) * 1000,
+                       mutations)
+
+
+class InstrumentedQuery:
+    """Requête dont fetch() compte chaque page lue comme une RPC 'run_query'."""
+
+    def __init__(self, query):
+        object.__setattr__(self, '_query', query)
+
+    def __getattr__(self, name):
+        return getattr(self._query, name)
+
+    def __setattr__(self, name, value):
+        # query.order = [...], query.projection = [...]: portés par la requête enveloppée
+        setattr(self._query, name, value)
+
+    def fetch(self, *args, **kwargs):
+        return InstrumentedIterator(self._query.fetch(*args, **kwargs))
+
+
+class InstrumentedIterator:
+    """Itérateur de résultats: la durée d'une page inclut la RPC et le décodage de ses entités."""
+
+    def __init__(self, iterator):
+        self._iterator = iterator
+
+    def __getattr__(self, name):
+        # next_page_token, cursor...
+        return getattr(self._iterator, name)
+
+    @property
+    def pages(self):
+        pages = self._iterator.pages
+        while True:
+            started = time.perf_counter()
+            page = next(pages, None)
+            if page is None:
+                return
+            entities = list(page)
+            record_rpc('run_query', (time.perf_counter() - started) * 1000, len(entities))
+            yield entities
+
+    def __iter__(self):
+        for page in self.pages:
+            yield from page
@@ -1,12 +1,109 @@
-from flask import Flask, request, redirect, url_for, render_template_string, session, jsonify
+import time
+_IMPORT_STARTED = time.perf_counter()  # avant les autres imports: le démarrage à froid est mesuré en entier
+
+from flask import Flask, Response, request, redirect, url_for, render_template_string, session, jsonify, g
+from google.api_core.exceptions import Conflict, FailedPrecondition, InvalidArgument
 from google.cloud import datastore
-from datetime import datetime, timedelta
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import NamedTuple
+import base64
+import gzip
+import hashlib
+import heapq
+import json
+import logging
 import os
 import random
+import threading
+import uuid
+
+import instrumentation
+import seeding
+import storage
 
 app = Flask(__name__)
 app.secret_key = 'dev-key'  # À changer en prod
-client = datastore.Client()
+# Client enveloppé: chaque RPC est comptée dans la trace de la requête (voir instrumentation.py).
+# Créé au premier usage (warmup ou première requête), pas à l'import
+client = storage.LazyClient(lambda: instrumentation.InstrumentedClient(storage.get_client()))
+
+# Mode de construction des timelines:
+# - 'pull' : la timeline est recalculée à la lecture (requête sur Post)
+# - 'push' : /post écrit une entrée TimelineEntry par follower (fanout-on-write)
+# - 'incremental' : instantané par utilisateur complété à la lecture par les posts plus récents
+#   que son filigrane (as_of)
+# - 'hybrid' : push pour les auteurs ordinaires, pull à la lecture pour les auteurs très suivis
+TIMELINE_MODES = ('pull', 'push', 'incremental', 'hybrid')
+TIMELINE_MODE = os.environ.get('TIMELINE_MODE', 'pull')
+# Profondeur maximale matérialisée par utilisateur lors d'un backfill (= limit max de l'API)
+TIMELINE_DEPTH = 100
+# Mode hybrid: au-delà de ce nombre de followers, un auteur n'est plus poussé mais lu à la demande
+CELEBRITY_THRESHOLD = int(os.environ.get('CELEBRITY_THRESHOLD', '100'))
+# Hystérésis: la lecture tire en pull dès ce seuil, plus bas, pour couvrir les compteurs en cache
+# périmés; un auteur qui repasse dessous voit ses posts récents poussés à ses followers
+CELEBRITY_PULL_THRESHOLD = int(os.environ.get('CELEBRITY_PULL_THRESHOLD', str(CELEBRITY_THRESHOLD * 4 // 5)))
+# Taille des paquets put_multi (limite Datastore: 500 entités par commit)
+FANOUT_BATCH = 400
+# Le fanout tourne en tâche de fond pour que /post réponde immédiatement
+_fanout_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('FANOUT_WORKERS', '4')))
+# Datastore limite l'opérateur IN à 30 valeurs
+IN_MAX = 30
+# Arêtes par appel à /api/follow: chacune écrit 2 entités (arête + compteur), 500 mutations par commit
+BULK_FOLLOW_MAX = 200
+FOLLOW_TXN_ATTEMPTS = 3
+# Posts par appel à /api/posts (écrits par paquets de FANOUT_BATCH entités, têtes d'auteur comprises)
+BULK_POSTS_MAX = 1000
+# Datastore refuse les chaînes indexées de plus de 1500 octets (content est indexé et projeté)
+POST_CONTENT_MAX_BYTES = 1500
+# Les têtes d'auteur sont relues dans la transaction du commit: rejouée en cas de contention
+POST_TXN_ATTEMPTS = 3
+# Commit groupé de /post: les posts concurrents partent ensemble dans un put_multi, dès
+# GROUP_COMMIT_MAX entités en attente ou GROUP_COMMIT_DELAY_MS après le premier
+GROUP_COMMIT = os.environ.get('GROUP_COMMIT', '1') == '1'
+GROUP_COMMIT_MAX = int(os.environ.get('GROUP_COMMIT_MAX', str(FANOUT_BATCH)))
+GROUP_COMMIT_DELAY_MS = float(os.environ.get('GROUP_COMMIT_DELAY_MS', '5'))
+# Threads d'écriture du seed (paquets put_multi en parallèle)
+SEED_WORKERS = int(os.environ.get('SEED_WORKERS', '8'))
+# Posts générés par /admin/seed: contenu et étalement des dates
+SEED_CONTENT = "Benchmark post {i} by {name}"
+SEED_SPREAD = timedelta(seconds=10000)
+# Jobs de seed en tâche de fond: utilisateurs par point de reprise, délai d'expiration du bail
+SEED_CHUNK_USERS = int(os.environ.get('SEED_CHUNK_USERS', '50'))
+SEED_JOB_STALE = float(os.environ.get('SEED_JOB_STALE', '60'))
+# Identité de l'instance (bail des jobs de seed)
+INSTANCE_ID = os.environ.get('GAE_INSTANCE') or uuid.uuid4().hex
+# Utilisateurs dont /_ah/warmup précharge les follows (liste séparée par des virgules)
+WARMUP_USERS = [u for u in os.environ.get('WARMUP_USERS', '').split(',') if u]
+_seed_pool = ThreadPoolExecutor(max_workers=1)
+# Nombre maximal d'utilisateurs par appel à /api/timelines
+BATCH_MAX_USERS = int(os.environ.get('BATCH_MAX_USERS', '100'))
+# Marge de sécurité du filigrane des instantanés: un post daté juste avant la lecture
+# mais visible après (horloges, cohérence des index) est rattrapé à la lecture suivante
+SNAPSHOT_LAG = timedelta(seconds=float(os.environ.get('SNAPSHOT_LAG', '5')))
+# Requêtes de projection (moins d'octets lus) quand un index composite le permet
+PROJECTION = os.environ.get('PROJECTION', '1') == '1'
+# Réponses JSON compressées au-delà de cette taille si le client accepte gzip
+GZIP_MIN_SIZE = int(os.environ.get('GZIP_MIN_SIZE', '1024'))
+# Élagage des followees par AuthorHead (date du dernier post de chaque auteur)
+HEAD_PRUNING = os.environ.get('HEAD_PRUNING', '1') == '1'
+# Requêtes de timeline exécutées en parallèle (scatter-gather), pool borné partagé
+QUERY_THREAD_PREFIX = 'timeline-query'
+_query_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('TIMELINE_WORKERS', '16')),
+                                 thread_name_prefix=QUERY_THREAD_PREFIX)
+# Posts répartis sur N shards (propriété 'shard', index (shard, author, created desc)): les écritures
+# concurrentes ne s'empilent plus en fin d'un seul index. 1 = pas de sharding. Lu par seeding.py:
+# l'app et le seed doivent utiliser la même valeur (changer de valeur impose de regénérer les posts)
+POST_SHARDS = seeding.POST_SHARDS
+
+# Caches en mémoire du processus (bornés, LRU + TTL). Les autres instances ne sont pas
+# invalidées: le TTL borne la durée pendant laquelle elles peuvent servir une donnée périmée.
+FOLLOWS_CACHE_SIZE = int(os.environ.get('FOLLOWS_CACHE_SIZE', '10000'))
+FOLLOWS_CACHE_TTL = float(os.environ.get('FOLLOWS_CACHE_TTL', '300'))
+TIMELINE_CACHE_SIZE = int(os.environ.get('TIMELINE_CACHE_SIZE', '2000'))
+TIMELINE_CACHE_TTL = float(os.environ.get('TIMELINE_CACHE_TTL', '30'))
 
 # Templates HTML minimalistes
 TEMPLATE_INDEX = '''
@@ -19,13 +116,17 @@ TEMPLATE_INDEX = '''
   </form>
   <h3>Timeline</h3>
   {% for post in timeline %}
-    <div><b>{{ post['author'] }}</b>: {{ post['content'] }}</div>
+    <div><b>{{ post.author }}</b>: {{ post.content }}</div>
   {% endfor %}
   <h3>Suivre un utilisateur</h3>
   <form action="/follow" method="post">
     <input name="to_follow" placeholder="Nom d'utilisateur" required>
     <button>Suivre</button>
   </form>
+  <form action="/unfollow" method="post">
+    <input name="to_unfollow" placeholder="Nom d'utilisateur" required>
+    <button>Ne plus suivre</button>
+  </form>
 {% else %}
   <form action="/login" method="post">
     <input name="username" placeholder="Nom d'utilisateur" required>
@@ -34,114 +135,1625 @@ TEMPLATE_INDEX = '''
 {% endif %}
 '''
 
-def get_timeline(user: str, limit: int = 20):
-    """Retourne la liste des posts (entités) pour la timeline d'un utilisateur."""
+class TTLCache:
+    """Cache LRU borné à 'maxsize' entrées qui expirent après 'ttl' secondes, avec compteurs."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # clé -> (expiration monotonic, valeur)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def discard_where(self, predicate):
+        """Invalide les entrées pour lesquelles predicate(clé, valeur) est vrai."""
+        with self._lock:
+            stale = [k for k, (_, v) in self._data.items() if predicate(k, v)]
+            for k in stale:
+                del self._data[k]
+        return len(stale)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / total, 3) if total else None,
+        }
+
+
+# user -> liste des followees (None n'est jamais mis en cache: utilisateur inconnu)
+follows_cache = TTLCache(FOLLOWS_CACHE_SIZE, FOLLOWS_CACHE_TTL)
+# (user, limit, mode) -> (auteurs lus ou None en mode push, TimelineResult)
+timeline_cache = TTLCache(TIMELINE_CACHE_SIZE, TIMELINE_CACHE_TTL)
+# user -> nombre de followers (répartition push/pull du mode hybrid)
+follower_count_cache = TTLCache(FOLLOWS_CACHE_SIZE, FOLLOWS_CACHE_TTL)
+
+
+def get_follows(user: str):
+    """Followees d'un utilisateur (None s'il n'existe pas), servis par le cache si possible."""
+    follows = follows_cache.get(user)
+    if follows is None:
+        follows = _followee_names(user)
+        if not follows:
+            # Sans arête: utilisateur inconnu, sans follows, ou pas encore migré (ancienne liste)
+            user_entity = client.get(client.key('User', user))
+            if user_entity is None:
+                return None
+            follows = list(user_entity.get('follows', []))
+        follows_cache.set(user, follows)
+    return follows
+
+
+# ------------------ GRAPHE DE FOLLOWS (arêtes Follow) ------------------
+# Une arête par relation, clé User(follower)/Follow(followee): les followees d'un utilisateur sont
+# une requête par ancêtre (fortement cohérente), ses followers une requête sur 'followee'.
+# Le User reste petit (follower_count) et n'est plus réécrit en entier à chaque follow.
+
+def follow_key(follower: str, followee: str):
+    return client.key('User', follower, 'Follow', followee)
+
+
+def follow_edge(follower: str, followee: str, created: datetime = None) -> datastore.Entity:
+    edge = datastore.Entity(follow_key(follower, followee))
+    edge.update({'follower': follower, 'followee': followee, 'created': created or datetime.utcnow()})
+    return edge
+
+
+def _followee_names(user: str):
+    query = client.query(kind='Follow', ancestor=client.key('User', user))
+    query.keys_only()
+    return [e.key.name for e in query.fetch()]
+
+
+def apply_follows(user: str, follow=(), unfollow=()):
+    """
+    Ajoute et retire des arêtes Follow de 'user' en une transaction, avec les User.follower_count
+    des followees concernés: rejouer la même demande ne change rien (clés déterministes) et deux
+    follows concurrents ne perdent pas de mise à jour. Retourne (followees ajoutés, retirés).
+    """
+    follow = [f for f in dict.fromkeys(follow) if f and f != user]
+    unfollow = [f for f in dict.fromkeys(unfollow) if f and f != user and f not in follow]
+    if not follow and not unfollow:
+        return [], []
+    for attempt in range(FOLLOW_TXN_ATTEMPTS):
+        try:
+            added, removed, users = _follow_transaction(user, follow, unfollow)
+            break
+        except Conflict:
+            # Contention sur un compteur très suivi: on rejoue la transaction
+            if attempt == FOLLOW_TXN_ATTEMPTS - 1:
+                raise
+            time.sleep(random.uniform(0.01, 0.05) * 2 ** attempt)
+
+    if added or removed:
+        # Write-through: le cache reflète l'écriture, la timeline de l'utilisateur est périmée
+        cached = follows_cache.get(user)
+        if cached is not None:
+            follows_cache.set(user, [f for f in cached if f not in removed] + [f for f in added if f not in cached])
+        invalidate_user(user)
+        for entity in users:
+            follower_count_cache.set(entity.key.name, entity['follower_count'])
+    if added and not removed:
+        # Avec des retraits, la signature change et l'instantané est reconstruit à la lecture
+        _fanout_pool.submit(refresh_snapshot_after_follow, user, added)
+    for followee in added:
+        if TIMELINE_MODE == 'push' or (TIMELINE_MODE == 'hybrid' and not celebrities([followee])):
+            _fanout_pool.submit(_backfill_followee, user, followee)
+    if TIMELINE_MODE in ('push', 'hybrid'):
+        for followee in removed:
+            _fanout_pool.submit(_drop_followee, user, followee)
+    if TIMELINE_MODE == 'hybrid':
+        # Compteurs exacts (lus dans la transaction): seul l'unfollow qui franchit le seuil déclenche
+        for entity in users:
+            if entity.key.name in removed and entity['follower_count'] == CELEBRITY_PULL_THRESHOLD - 1:
+                _fanout_pool.submit(_push_former_celebrity, entity.key.name)
+    return added, removed
+
+
+def _follow_transaction(user: str, follow, unfollow):
+    with client.transaction():
+        existing = {e.key.name for e in client.get_multi([follow_key(user, f) for f in follow + unfollow])}
+        added = [f for f in follow if f not in existing]
+        removed = [f for f in unfollow if f in existing]
+        delta = {**{f: 1 for f in added}, **{f: -1 for f in removed}}
+        counted = {e.key.name: e for e in client.get_multi([client.key('User', f) for f in delta])}
+        users = []
+        for followee, d in delta.items():
+            entity = counted.get(followee) or datastore.Entity(client.key('User', followee))
+            entity['follower_count'] = max(0, entity.get('follower_count', 0) + d)
+            users.append(entity)
+        client.put_multi([follow_edge(user, f) for f in added] + users)
+        client.delete_multi([follow_key(user, f) for f in removed])
+    return added, removed, users
+
+
+def migrate_follows(prefix: str = ''):
+    """
+    Convertit les anciennes listes User.follows (utilisateurs du jeu de données 'prefix') en arêtes
+    Follow puis retire la liste. Idempotent: un utilisateur migré n'a plus de liste.
+    """
+    migrated = []
+
+    def entities():
+        for entity in seeding.user_query(client, prefix).fetch():
+            name = entity.key.name
+            if not name or 'follows' not in entity:
+                continue
+            for followee in entity['follows']:
+                if followee != name:
+                    yield follow_edge(name, followee)
+            # Écrit après ses arêtes: une migration interrompue reprend cet utilisateur
+            del entity['follows']
+            migrated.append(name)
+            yield entity
+    written = put_in_batches(entities())
+    follows_cache.discard_where(lambda k, v: k.startswith(prefix))
+    return {'users': len(migrated), 'edges_written': written - len(migrated)}
+
+
+def invalidate_author(author: str):
+    """Un nouveau post de 'author' périme sa timeline et celles (en cache) qui le lisent en pull."""
+    timeline_cache.discard_where(lambda k, v: k[0] == author or (v[0] is not None and author in v[0]))
+
+
+def invalidate_user(user: str):
+    timeline_cache.discard_where(lambda k, v: k[0] == user)
+
+
+class TimelineItem(NamedTuple):
+    """Post d'une timeline sous forme compacte (tuple): uniquement les champs servis par l'API."""
+    author: str
+    content: str
+    created: datetime
+    post_id: object
+
+
+def _as_datetime(value):
+    # Une projection peut renvoyer la valeur d'index d'un timestamp (microsecondes depuis epoch)
+    if isinstance(value, int):
+        return datetime.fromtimestamp(value / 1e6, tz=timezone.utc)
+    return value or datetime.min
+
+
+def to_item(entity, author: str = None) -> TimelineItem:
+    """Post, TimelineEntry ou résultat de projection -> TimelineItem."""
+    return TimelineItem(
+        entity.get('author', author),
+        entity.get('content'),
+        _as_datetime(entity.get('created')),
+        entity.get('post_id') or entity.key.id_or_name,
+    )
+
+
+def _created(item: TimelineItem):
+    return item.created
+
+
+class TimelineResult(NamedTuple):
+    """Posts d'une timeline, stratégie qui les a servis et curseur opaque de la page suivante."""
+    items: list
+    strategy: str
+    cursor: str = None
+
+
+def get_timeline(user: str, limit: int = 20, mode: str = None):
+    """
+    Posts (TimelineItem, triés par date décroissante) de la première page de la timeline d'un
+    utilisateur, servie selon 'mode' (TIMELINE_MODE par défaut) par fetch_timeline: cache, puis en
+    pull la stratégie choisie par le planificateur (gql, in, chunked_in, head_pruned ou per_author).
+    """
+    return fetch_timeline(user, limit=limit, mode=mode).items
+
+
+def fetch_timeline(user: str, limit: int = 20, mode: str = None, cursor: str = None) -> TimelineResult:
+    """Calcule la timeline d'un utilisateur et indique quelle stratégie l'a servie."""
     if not user:
-        return []
-    follow_key = client.key('User', user)
-    user_entity = client.get(follow_key)
-    follows = []
-    if user_entity:
-        follows = user_entity.get('follows', [])
-    # On ajoute l'utilisateur lui-même pour voir ses propres posts
-    follows = list({*follows, user})
-
-    timeline = []
-    used_gql = False
+        return TimelineResult([], 'none')
+    mode = mode or TIMELINE_MODE
+    if cursor:
+        return fetch_next_page(user, limit, mode, cursor)
+    cache_key = (user, limit, mode)
+    cached = timeline_cache.get(cache_key)
+    if cached is not None:
+        return cached[1]
+
+    if mode == 'push':
+        with instrumentation.stage('posts'):
+            page = get_push_timeline(user, limit=limit)
+            result = push_page(user, mode, page, limit)
+        timeline_cache.set(cache_key, (None, result))
+        return result
+    # On ajoute l'utilisateur lui-même pour voir ses propres posts (ordre stable pour les curseurs)
+    with instrumentation.stage('follows'):
+        follows = sorted({*(get_follows(user) or []), user})
+    with instrumentation.stage('posts'):
+        if mode == 'incremental':
+            items, strategy = get_incremental_timeline(user, follows, limit)
+        elif mode == 'hybrid':
+            items, strategy = get_hybrid_timeline(user, follows, limit)
+        else:
+            items, strategy = pull_posts(follows, limit)
+    if strategy in ('in', 'gql') and isinstance(items, Page):
+        next_cursor = query_cursor(user, mode, items, limit, follows)
+    else:
+        next_cursor = keyset_cursor(user, mode, follows, items, limit)
+    result = TimelineResult(items, strategy, next_cursor)
+    timeline_cache.set(cache_key, (frozenset(follows), result))
+    return result
+
+
+def pull_posts(authors, limit: int, since: datetime = None):
+    """
+    Posts les plus récents des auteurs (postérieurs à 'since' si fourni) et stratégie utilisée.
+    Le planificateur écarte les stratégies connues pour échouer: pas de RPC perdue sur le chemin chaud.
+    """
+    for strategy in planner.plan(len(authors)):
+        try:
+            # Une étape par tentative: une stratégie en échec apparaît avec son coût dans Server-Timing
+            with instrumentation.stage(strategy):
+                return run_strategy(strategy, authors, limit, since=since), strategy
+        except CAPABILITY_ERRORS:
+            if strategy == 'per_author':
+                raise
+            planner.mark_failed(strategy)
+        except Exception:
+            if strategy == 'per_author':
+                raise
+            # Erreur transitoire (délai, indisponibilité): la stratégie suivante est tentée pour cette
+            # lecture, sans désactiver la capacité pour les suivantes
+            logging.warning("Stratégie '%s' en échec transitoire", strategy, exc_info=True)
+    raise RuntimeError("aucune stratégie de timeline disponible")
+
+
+# ------------------ TIMELINES EN LOT (mode pull) ------------------
+
+def get_follows_multi(users):
+    """
+    Followees de plusieurs utilisateurs: cache d'abord, puis les requêtes par ancêtre en parallèle
+    et un seul get_multi pour ceux qui n'ont aucune arête (inconnus ou non migrés).
+    """
+    found = {}
+    missing = []
+    for user in users:
+        follows = follows_cache.get(user)
+        if follows is None:
+            missing.append(user)
+        else:
+            found[user] = follows
+    edges = dict(zip(missing, _query_pool.map(instrumentation.propagate(_followee_names), missing)))
+    for user, follows in edges.items():
+        if follows:
+            follows_cache.set(user, follows)
+            found[user] = follows
+    without_edges = [u for u in missing if not edges[u]]
+    if without_edges:
+        for entity in client.get_multi([client.key('User', u) for u in without_edges]):
+            follows = list(entity.get('follows', []))
+            follows_cache.set(entity.key.name, follows)
+            found[entity.key.name] = follows
+    return found
+
+
+def fetch_timelines(users, limit: int = 20):
+    """
+    Timelines pull de plusieurs utilisateurs. Les followees communs ne sont interrogés qu'une fois:
+    une requête par auteur de l'union (limitée à 'limit'), puis fusion par utilisateur de ses auteurs.
+    Retourne {user: TimelineResult}; les curseurs se poursuivent avec /api/timeline?mode=pull.
+    """
+    results = {}
+    for user in users:
+        cached = timeline_cache.get((user, limit, 'pull'))
+        if cached is not None:
+            results[user] = cached[1]
+    pending = [u for u in users if u not in results]
+    if not pending:
+        return results
+    follows_by_user = get_follows_multi(pending)
+    follows_by_user = {u: sorted({*follows_by_user.get(u, []), u}) for u in pending}
+    authors = sorted(set().union(*follows_by_user.values()))
+    posts = dict(zip(authors, _query_pool.map(
+        instrumentation.propagate(lambda a: recent_posts([a], limit)), authors)))
+    for user, follows in follows_by_user.items():
+        items = merge_recent([posts[a] for a in follows], limit)
+        result = TimelineResult(items, 'batch', keyset_cursor(user, 'pull', follows, items, limit))
+        timeline_cache.set((user, limit, 'pull'), (frozenset(follows), result))
+        results[user] = result
+    return results
+
+
+# ------------------ PAGINATION PAR CURSEUR ------------------
+# Le curseur est un jeton opaque (JSON en base64) lié à l'utilisateur et au mode:
+# - requête unique (push, IN, GQL): il encapsule le curseur Datastore de la requête;
+# - plusieurs sources fusionnées: il garde pour chaque paquet d'auteurs sa position
+#   (created du dernier post émis et ids émis à cette date), ou 0 si la source est épuisée.
+# La page suivante reprend chaque source exactement où elle s'est arrêtée.
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class Page(list):
+    """Résultats d'une requête unique, avec le curseur Datastore de la suite (None si épuisée)."""
+    cursor = None
+
+
+def fetch_page(query, limit: int, start_cursor=None, author: str = None) -> Page:
+    """Exécute une requête et convertit chaque résultat en TimelineItem (voir to_item)."""
+    it = query.fetch(limit=limit, start_cursor=start_cursor)
+    try:
+        page = Page(to_item(e, author) for e in it)
+    except (InvalidArgument, ValueError):
+        if not start_cursor:
+            raise
+        # Le curseur Datastore vient du jeton client: refusé par Datastore, c'est une erreur du client
+        raise InvalidCursor("curseur de requête refusé par Datastore")
+    token = it.next_page_token
+    page.cursor = token.decode() if isinstance(token, bytes) else token
+    return page
+
+
+def encode_cursor(state: dict) -> str:
+    raw = json.dumps(state, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token: str) -> dict:
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise InvalidCursor("curseur illisible")
+    if not isinstance(state, dict):
+        raise InvalidCursor("curseur illisible")
+    # Le jeton vient du client: sa forme est vérifiée ici, une fois pour toutes (400, jamais 500)
+    if not isinstance(state.get('u'), str) or state.get('m') not in TIMELINE_MODES:
+        raise InvalidCursor("curseur illisible: utilisateur ou mode")
+    for field in ('q', 'a'):
+        if field in state and not isinstance(state[field], str):
+            raise InvalidCursor(f"curseur illisible: '{field}'")
+    n = state.get('n')
+    if n is not None and (type(n) is not int or n < 1):
+        raise InvalidCursor("curseur illisible: taille de paquet")
+    positions = state.get('p')
+    if positions is not None:
+        if not isinstance(positions, dict):
+            raise InvalidCursor("curseur illisible: positions")
+        for source, position in positions.items():
+            if not source.isdigit() or not _valid_position(position):
+                raise InvalidCursor("curseur illisible: position")
+    if 'o' in state and (state['o'] == 0 or not _valid_position(state['o'])):
+        raise InvalidCursor("curseur illisible: dernière entrée")
+    return state
+
+
+def _valid_position(position) -> bool:
+    """0 (source épuisée) ou [date ISO du dernier post émis, identifiants des posts émis à cette date]."""
+    if position == 0 and type(position) is int:
+        return True
+    if not isinstance(position, list) or len(position) != 2:
+        return False
+    created, emitted = position
+    if not isinstance(created, str) or not isinstance(emitted, list):
+        return False
+    try:
+        datetime.fromisoformat(created)
+    except ValueError:
+        return False
+    return all(isinstance(i, (str, int)) and not isinstance(i, bool) for i in emitted)
+
+
+def query_cursor(user: str, mode: str, page: Page, limit: int, follows=None):
+    """Jeton d'une requête unique; None si la page est la dernière."""
+    if len(page) < limit or not page.cursor:
+        return None
+    state = {'u': user, 'm': mode, 'q': page.cursor}
+    if follows is not None:
+        state['a'] = _follows_signature(follows)
+    return encode_cursor(state)
+
+
+def _last_position(items, last=None):
+    """Position après 'items' (triés par date décroissante): date du dernier émis et posts émis à cette date."""
+    if not items:
+        return last
+    created = items[-1].created.isoformat()
+    emitted = [p.post_id for p in items if p.created.isoformat() == created]
+    if last and last[0] == created:
+        emitted = list(last[1]) + emitted
+    return [created, emitted]
+
+
+def push_page(user: str, mode: str, page: Page, limit: int, last=None) -> TimelineResult:
+    """
+    Page du mode push (et part poussée du mode hybrid). Les timelines matérialisées s'arrêtent à
+    TIMELINE_DEPTH entrées (ou n'ont jamais été construites): quand elles s'épuisent, la page est
+    complétée par une lecture keyset des followees sous la plus ancienne entrée émise, et les pages
+    suivantes continuent sur ce chemin.
+    """
+    position = _last_position(page, last)
+    if len(page) >= limit and page.cursor:
+        state = {'u': user, 'm': mode, 'q': page.cursor}
+        if position:
+            state['o'] = position
+        return TimelineResult(page, 'push', encode_cursor(state))
+    follows = sorted({*(get_follows(user) or []), user})
+    chunk_size = IN_MAX if planner.available('chunked_in') else 1
+    sources = -(-len(follows) // chunk_size)
+    state = {'u': user, 'm': mode, 'a': _follows_signature(follows), 'n': chunk_size,
+             'p': {str(i): position for i in range(sources)} if position else {}}
+    if len(page) >= limit:
+        # Page pleine sans curseur de requête: la suite part directement des followees
+        return TimelineResult(page, 'push', encode_cursor(state))
+    tail = keyset_page(user, mode, follows, state, limit - len(page))
+    if not tail.items:
+        return TimelineResult(page, 'push', None)
+    return TimelineResult(list(page) + tail.items, 'push+keyset', tail.cursor)
+
+
+def _source_index(authors, chunk_size: int):
+    return {a: i // chunk_size for i, a in enumerate(authors)}
+
+
+def advance_positions(authors, items, chunk_size: int, positions=None, exhausted=()):
+    """Positions par source après émission de 'items' (posts triés par date décroissante)."""
+    index = _source_index(authors, chunk_size)
+    positions = {k: (v if v == 0 else [v[0], list(v[1])]) for k, v in (positions or {}).items()}
+    for post in items:
+        source = index.get(post.author)
+        if source is None:
+            continue
+        source = str(source)
+        created = post.created.isoformat()
+        position = positions.get(source)
+        if position and position[0] == created:
+            position[1].append(post.post_id)
+        else:
+            positions[source] = [created, [post.post_id]]
+    for source in exhausted:
+        positions[str(source)] = 0
+    return positions
+
+
+def keyset_cursor(user: str, mode: str, follows, items, limit: int, positions=None, exhausted=(),
+                  chunk_size: int = None):
+    """Jeton multi-sources construit à partir des posts émis; None si la page est la dernière."""
+    if len(items) < limit:
+        return None
+    if chunk_size is None:
+        chunk_size = IN_MAX if planner.available('chunked_in') else 1
+    positions = advance_positions(follows, items, chunk_size, positions, exhausted)
+    if positions and all(v == 0 for v in positions.values()) and len(positions) == -(-len(follows) // chunk_size):
+        return None
+    return encode_cursor({'u': user, 'm': mode, 'a': _follows_signature(follows),
+                          'n': chunk_size, 'p': positions})
+
+
+def posts_before(authors, limit: int, position):
+    """Reprend une source après sa position: (posts, source épuisée)."""
+    if not position:
+        page = recent_posts(authors, limit)
+        return list(page), len(page) < limit
+    until = datetime.fromisoformat(position[0])
+    emitted = set(position[1])
+    fetch_limit = limit + len(emitted)
+    rows = recent_posts(authors, fetch_limit, until=until)
+    exhausted = len(rows) < fetch_limit
+    rows = [p for p in rows if not (p.created == until and p.post_id in emitted)]
+    if len(rows) > limit:
+        rows, exhausted = rows[:limit], False
+    return rows, exhausted
+
+
+def keyset_page(user: str, mode: str, follows, state: dict, limit: int) -> TimelineResult:
+    """Page suivante d'une fusion multi-sources: une requête par source non épuisée, en parallèle."""
+    chunk_size = int(state.get('n') or IN_MAX)
+    positions = state.get('p') or {}
+    chunks = [follows[i:i + chunk_size] for i in range(0, len(follows), chunk_size)]
+    futures = {}
+    for i, chunk in enumerate(chunks):
+        position = positions.get(str(i))
+        if position == 0:
+            continue
+        futures[i] = _query_pool.submit(instrumentation.propagate(posts_before), chunk, limit, position)
+    fetched = {i: f.result() for i, f in futures.items()}
+    items = merge_recent([rows for rows, _ in fetched.values()], limit)
+    index = _source_index(follows, chunk_size)
+    emitted = Counter(index[p.author] for p in items)
+    exhausted = [i for i, (rows, done) in fetched.items() if done and emitted[i] == len(rows)]
+    next_cursor = keyset_cursor(user, mode, follows, items, limit, positions, exhausted, chunk_size)
+    return TimelineResult(items, 'keyset', next_cursor)
+
+
+def fetch_next_page(user: str, limit: int, mode: str, token: str) -> TimelineResult:
+    """Pages suivantes: jamais mises en cache, chaque page coûte autant que la première."""
+    state = decode_cursor(token)
+    if state.get('u') != user or state.get('m') != mode:
+        raise InvalidCursor("curseur émis pour un autre utilisateur ou un autre mode")
+    if mode == 'push' and 'q' in state:
+        page = get_push_timeline(user, limit=limit, cursor=state['q'])
+        return push_page(user, mode, page, limit, state.get('o'))
+    follows = sorted({*(get_follows(user) or []), user})
+    if state.get('a') != _follows_signature(follows):
+        raise InvalidCursor("les followees ont changé depuis la première page")
+    if 'q' in state:
+        page = query_recent_posts(follows, limit, start_cursor=state['q'])
+        return TimelineResult(page, 'in', query_cursor(user, mode, page, limit, follows))
+    return keyset_page(user, mode, follows, state, limit)
+
+
+# ------------------ MOTEUR SCATTER-GATHER (mode pull) ------------------
+
+def query_recent_posts(authors, limit: int, since: datetime = None, until: datetime = None,
+                       start_cursor=None, shard: int = None) -> Page:
+    """
+    Les 'limit' posts les plus récents d'un groupe d'auteurs (d'un seul shard si 'shard' est fourni),
+    triés par date décroissante.
+    """
+    q = client.query(kind='Post')
+    if shard is not None:
+        q.add_filter('shard', '=', shard)
+    author = None
+    if len(authors) == 1:
+        author = authors[0]
+        q.add_filter('author', '=', author)
+    else:
+        q.add_filter('author', 'IN', list(authors))
+    if since is not None:
+        q.add_filter('created', '>', since)
+    if until is not None:
+        q.add_filter('created', '<=', until)
+    q.order = ['-created']
+    if author is None or not planner.has('projection'):
+        return fetch_page(q, limit, start_cursor)
+    # Un seul auteur: projection sur l'index (author, created desc, content), l'auteur est connu.
+    # (Datastore interdit de projeter une propriété filtrée par IN: les paquets lisent l'entité.)
+    q.projection = ['content', 'created']
     try:
-        if hasattr(client, 'gql'):
+        return fetch_page(q, limit, start_cursor, author=author)
+    except CAPABILITY_ERRORS:
+        planner.disable('projection')
+        q.projection = []
+        return fetch_page(q, limit, start_cursor)
+
+
+def post_shards():
+    """Shards à interroger: None (une requête sans filtre) si les posts ne sont pas shardés."""
+    return range(POST_SHARDS) if POST_SHARDS > 1 else (None,)
+
+
+def run_parallel(fn, calls):
+    """
+    fn(*args) pour chaque tuple de 'calls' sur le pool de requêtes; résultats dans l'ordre des appels.
+    Depuis un thread du pool, les appels restent séquentiels: une tâche qui attendrait ses propres
+    sous-tâches dans un pool saturé ne se terminerait jamais.
+    """
+    if len(calls) == 1 or threading.current_thread().name.startswith(QUERY_THREAD_PREFIX):
+        return [fn(*args) for args in calls]
+    fn = instrumentation.propagate(fn)
+    futures = [_query_pool.submit(fn, *args) for args in calls]
+    return [f.result() for f in futures]
+
+
+def recent_posts(authors, limit: int, since: datetime = None, until: datetime = None):
+    """
+    query_recent_posts sur tous les shards, fusionnés. Les 'limit' posts les plus récents peuvent
+    tous tomber dans le même shard: chaque shard est lu jusqu'à 'limit'.
+    """
+    if POST_SHARDS == 1:
+        return query_recent_posts(authors, limit, since=since, until=until)
+    calls = [(authors, limit, since, until, None, shard) for shard in post_shards()]
+    return merge_recent(run_parallel(query_recent_posts, calls), limit)
+
+
+def latest_posts(author: str, limit: int):
+    """Entités des 'limit' derniers posts d'un auteur (copie dans les timelines push)."""
+    pages = []
+    for shard in post_shards():
+        q = client.query(kind='Post')
+        if shard is not None:
+            q.add_filter('shard', '=', shard)
+        q.add_filter('author', '=', author)
+        q.order = ['-created']
+        pages.append(list(q.fetch(limit=limit)))
+    return list(islice(heapq.merge(*pages, key=lambda p: p['created'], reverse=True), limit))
+
+
+def merge_recent(sources, limit: int):
+    """Fusion k-voies (tas) de sources déjà triées par date décroissante, arrêtée après 'limit' posts."""
+    return list(islice(heapq.merge(*sources, key=_created, reverse=True), limit))
+
+
+def scatter_gather(authors, limit: int, chunk_size: int = IN_MAX, since: datetime = None):
+    """
+    Découpe les auteurs en paquets de 'chunk_size', lance une requête par paquet (et par shard de
+    posts) sur le pool, chacune limitée à 'limit': aucun paquet ne peut fournir plus. Fusionne les
+    résultats. La latence suit le paquet le plus lent au lieu de la somme des requêtes.
+    """
+    authors = list(authors)
+    chunks = [authors[i:i + chunk_size] for i in range(0, len(authors), chunk_size)]
+    if not chunks:
+        return []
+    if len(chunks) == 1:
+        return recent_posts(chunks[0], limit, since=since)
+    calls = [(chunk, limit, since, None, None, shard) for chunk in chunks for shard in post_shards()]
+    return merge_recent(run_parallel(query_recent_posts, calls), limit)
+
+
+
+# ------------------ INDEX DES TÊTES D'AUTEUR (élagage par seuil) ------------------
+
+def author_head(author: str, last_post: datetime) -> datastore.Entity:
+    """AuthorHead: date du post le plus récent d'un auteur (clé = nom de l'auteur)."""
+    # Lue uniquement par clé: aucune raison de payer l'écriture d'un index
+    head = datastore.Entity(client.key('AuthorHead', author), exclude_from_indexes=('last_post',))
+    head['last_post'] = last_post
+    return head
+
+
+def get_heads(authors):
+    """Dates du dernier post par auteur, en un seul get_multi (auteurs sans tête absents du dict)."""
+    entities = client.get_multi([client.key('AuthorHead', a) for a in authors])
+    return {e.key.name: e.get('last_post') for e in entities}
+
+
+def head_pruned(authors, limit: int, since: datetime = None):
+    """
+    Algorithme à seuil: les auteurs sont visités par date de dernier post décroissante, par tours
+    d'une requête IN. Dès que 'limit' candidats sont connus, tout auteur dont la tête n'est pas plus
+    récente que le k-ième meilleur candidat ne peut plus contribuer et n'est pas interrogé.
+    Les auteurs sans tête (données antérieures à l'index) sont interrogés au premier tour.
+    """
+    heads = get_heads(authors)
+    unknown = [a for a in authors if a not in heads]
+    known = sorted((a for a, t in heads.items() if t is not None and (since is None or t > since)),
+                   key=heads.get, reverse=True)
+    pending = unknown + known
+    best = []
+    while pending:
+        if len(best) >= limit:
+            threshold = best[limit - 1].created
+            pending = [a for a in pending if heads[a] > threshold]
+            if not pending:
+                break
+        # Les auteurs sans tête sont tous pris au premier tour, quitte à dépasser un paquet IN
+        size = max(IN_MAX, len(unknown)) if not best else IN_MAX
+        batch, pending = pending[:size], pending[size:]
+        unknown = []
+        best = merge_recent([best, scatter_gather(batch, limit, since=since)], limit)
+    return best
+
+# ------------------ PLANIFICATEUR DE STRATÉGIE (mode pull) ------------------
+
+def run_strategy(strategy: str, authors, limit: int, since: datetime = None):
+    """Exécute une stratégie de requête pull sur la liste d'auteurs."""
+    if strategy == 'gql':
+        if since is None:
             gql = client.gql("SELECT * FROM Post WHERE author IN @authors ORDER BY created DESC")
-            gql.bindings["authors"] = follows
-            timeline = list(gql.fetch(limit=limit))
-            used_gql = True
+        else:
+            gql = client.gql("SELECT * FROM Post WHERE author IN @authors AND created > @since "
+                             "ORDER BY created DESC")
+            gql.bindings["since"] = since
+        gql.bindings["authors"] = authors
+        return fetch_page(gql, limit)
+    if strategy == 'in':
+        return recent_posts(authors, limit, since=since)
+    if strategy == 'chunked_in':
+        return scatter_gather(authors, limit, since=since)
+    if strategy == 'head_pruned':
+        return head_pruned(authors, limit, since=since)
+    if strategy == 'per_author':
+        return scatter_gather(authors, limit, chunk_size=1, since=since)
+    raise ValueError(f"stratégie inconnue: {strategy}")
+
+
+class StrategyPlanner:
+    """
+    Choisit la stratégie de requête selon le nombre d'auteurs et les capacités connues du Datastore.
+    Un échec permanent (CAPABILITY_ERRORS: index absent, requête refusée) désactive la capacité
+    concernée pendant 'ttl' secondes (par processus): les requêtes suivantes ne retentent pas un
+    chemin cassé avant expiration. Une erreur transitoire ne désactive rien.
+    """
+    # Capacité Datastore requise par chaque stratégie ('per_author' n'a besoin que de l'égalité)
+    CAPABILITIES = {'gql': 'gql', 'in': 'in', 'chunked_in': 'in', 'head_pruned': 'in', 'per_author': None}
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._broken = {}  # capacité -> instant (monotonic) où on la réessaie
+        self._lock = threading.Lock()
+
+    def available(self, strategy: str) -> bool:
+        capability = self.CAPABILITIES[strategy]
+        return capability is None or self.has(capability)
+
+    def has(self, capability: str) -> bool:
+        """Capacité utilisable ('gql', 'in', 'projection'...): pas d'échec récent connu."""
+        if capability == 'gql' and (not hasattr(client, 'gql') or POST_SHARDS > 1):
+            # La requête GQL ne filtre pas le shard: elle suppose l'index non shardé
+            return False
+        if capability == 'projection' and not PROJECTION:
+            return False
+        retry_at = self._broken.get(capability)
+        return retry_at is None or retry_at <= time.monotonic()
+
+    def disable(self, capability: str):
+        logging.warning("Capacité Datastore '%s' en échec, désactivée %ss", capability, self.ttl, exc_info=True)
+        with self._lock:
+            self._broken[capability] = time.monotonic() + self.ttl
+
+    def plan(self, authors_count: int):
+        """Stratégies candidates par ordre de préférence (la dernière ne peut pas être écartée)."""
+        if authors_count <= IN_MAX:
+            candidates = ('gql', 'in', 'per_author')
+        elif HEAD_PRUNING:
+            candidates = ('head_pruned', 'chunked_in', 'per_author')
+        else:
+            candidates = ('chunked_in', 'per_author')
+        return [s for s in candidates if self.available(s)]
+
+    def mark_failed(self, strategy: str):
+        self.disable(self.CAPABILITIES[strategy])
+
+    def status(self):
+        now = time.monotonic()
+        return {
+            'ttl': self.ttl,
+            'post_shards': POST_SHARDS,
+            'disabled': {c: round(t - now, 1) for c, t in self._broken.items() if t > now},
+        }
+
+
+planner = StrategyPlanner(ttl=float(os.environ.get('STRATEGY_TTL', '300')))
+# Erreurs permanentes d'une capacité (index absent, requête refusée): seules à la désactiver.
+# Une erreur transitoire (délai dépassé, service indisponible) ne dit rien de la capacité.
+CAPABILITY_ERRORS = (FailedPrecondition, InvalidArgument)
+
+
+
+# ------------------ MODE HYBRIDE PUSH/PULL ------------------
+
+def get_follower_counts(users):
+    """Nombre de followers (propriété follower_count de User) par utilisateur, via cache + get_multi."""
+    counts = {}
+    missing = []
+    for u in users:
+        count = follower_count_cache.get(u)
+        if count is None:
+            missing.append(u)
+        else:
+            counts[u] = count
+    if missing:
+        found = {e.key.name: e.get('follower_count', 0) for e in
+                 client.get_multi([client.key('User', u) for u in missing])}
+        for u in missing:
+            counts[u] = found.get(u, 0)
+            follower_count_cache.set(u, counts[u])
+    return counts
+
+
+def celebrities(authors, threshold: int = CELEBRITY_THRESHOLD):
+    """
+    Auteurs dont le nombre de followers atteint 'threshold'. À l'écriture (CELEBRITY_THRESHOLD) ils
+    ne sont pas poussés; à la lecture, tout auteur au-dessus de CELEBRITY_PULL_THRESHOLD est tiré.
+    """
+    return {a for a, n in get_follower_counts(authors).items() if n >= threshold}
+
+
+def get_hybrid_timeline(user: str, follows, limit: int):
+    """
+    Timeline hybride: entrées poussées (auteurs ordinaires) + posts des followees très suivis lus
+    à la demande, fusionnés par date. Les auteurs proches du seuil sont à la fois poussés et tirés:
+    les doublons sont écartés. Comme en push, des entrées absentes ou épuisées sont complétées par
+    une lecture keyset des followees (push_page).
+    """
+    pulled = sorted(celebrities((a for a in follows if a != user), CELEBRITY_PULL_THRESHOLD))
+    if not pulled:
+        pushed = push_page(user, 'hybrid', get_push_timeline(user, limit=limit), limit)
+        return pushed.items, f'hybrid:{pushed.strategy}'
+    # Les posts tirés sur le pool (pull_posts y reste séquentiel), les entrées poussées ici: leur
+    # complément keyset (timeline non matérialisée ou épuisée) soumet lui-même au pool
+    pull_future = _query_pool.submit(instrumentation.propagate(pull_posts), pulled, limit)
+    pushed = push_page(user, 'hybrid', get_push_timeline(user, limit=limit), limit)
+    celebrity_posts, strategy = pull_future.result()
+    seen = set()
+    merged = []
+    for post in heapq.merge(pushed.items, celebrity_posts, key=_created, reverse=True):
+        if post.post_id in seen:
+            continue
+        seen.add(post.post_id)
+        merged.append(post)
+        if len(merged) >= limit:
+            break
+    return merged, f'hybrid:{strategy}'
+
+
+# ------------------ INSTANTANÉS INCRÉMENTAUX (mode incremental) ------------------
+
+def _follows_signature(follows) -> str:
+    """Empreinte de l'ensemble des followees: un instantané n'est valable que pour ce graphe."""
+    return hashlib.sha1('\n'.join(sorted(follows)).encode()).hexdigest()
+
+
+def _snapshot_items(snapshot):
+    """Posts stockés dans un instantané (triés par date décroissante)."""
+    return [
+        TimelineItem(raw['author'], raw['content'], datetime.fromisoformat(raw['created']), raw['id'])
+        for raw in json.loads(snapshot.get('items_json') or '[]')
+    ]
+
+
+def save_snapshot(user: str, follows, items, as_of: datetime):
+    """Écrit l'instantané (au plus TIMELINE_DEPTH posts) de la timeline de 'user' et son filigrane."""
+    snapshot = datastore.Entity(client.key('TimelineSnapshot', user), exclude_from_indexes=('items_json',))
+    snapshot.update({
+        'signature': _follows_signature(follows),
+        'as_of': as_of,
+        'items_json': json.dumps([
+            {
+                'id': p.post_id,
+                'author': p.author,
+                'content': p.content,
+                'created': p.created.isoformat(),
+            }
+            for p in items[:TIMELINE_DEPTH]
+        ]),
+    })
+    client.put(snapshot)
+
+
+def merge_into(items, fresh, depth: int = TIMELINE_DEPTH):
+    """Fusionne des posts récents dans une liste triée, sans doublon (par clé). Retourne (liste, nb ajoutés)."""
+    known = {p.post_id for p in items}
+    added = [p for p in fresh if p.post_id not in known]
+    if not added:
+        return items, 0
+    added.sort(key=_created, reverse=True)
+    return merge_recent([added, items], depth), len(added)
+
+
+def get_incremental_timeline(user: str, follows, limit: int):
+    """
+    Sert la timeline depuis l'instantané de l'utilisateur: seuls les posts plus récents que le
+    filigrane 'as_of' sont demandés aux followees. L'instantané est reconstruit entièrement s'il
+    n'existe pas ou si les followees ont changé. Après chaque delta lu, même vide, le filigrane avance
+    et l'instantané est réécrit: les posts déjà intégrés ne sont pas redemandés à la lecture suivante.
+    """
+    snapshot = client.get(client.key('TimelineSnapshot', user))
+    as_of = datetime.utcnow() - SNAPSHOT_LAG
+    if snapshot is None or snapshot.get('signature') != _follows_signature(follows):
+        items, strategy = pull_posts(follows, TIMELINE_DEPTH)
+        save_snapshot(user, follows, items, as_of)
+        return items[:limit], f'snapshot_rebuild:{strategy}'
+
+    items = _snapshot_items(snapshot)
+    delta, strategy = pull_posts(follows, TIMELINE_DEPTH, since=snapshot['as_of'])
+    items, _ = merge_into(items, delta)
+    save_snapshot(user, follows, items, max(as_of, seeding.utc_naive(snapshot['as_of'])))
+    return items[:limit], f'snapshot_delta:{strategy}'
+
+
+def refresh_snapshot_after_follow(user: str, followees):
+    """Reconstruction partielle après un follow: seuls les posts des nouveaux followees sont lus."""
+    try:
+        snapshot = client.get(client.key('TimelineSnapshot', user))
+        if snapshot is None:
+            return
+        follows = list({*(get_follows(user) or []), user})
+        posts, _ = pull_posts(sorted(followees), TIMELINE_DEPTH)
+        items, _ = merge_into(_snapshot_items(snapshot), posts)
+        # Le filigrane est conservé: les posts des autres followees sont rattrapés par le prochain delta
+        save_snapshot(user, follows, items, snapshot['as_of'])
+        invalidate_user(user)
     except Exception:
-        pass
-    if not used_gql:
-        try:
-            # Tentative de requête standard avec filtre IN
-            query = client.query(kind='Post')
-            query.add_filter('author', 'IN', follows)
-            query.order = ['-created']
-            timeline = list(query.fetch(limit=limit))
-        except Exception:
-            # Fallback manuel si l'index n'est pas prêt ou erreur de requête
-            posts = []
-            for author in follows:
-                q = client.query(kind='Post')
-                q.add_filter('author', '=', author)
-                q.order = ['-created']
-                posts.extend(list(q.fetch(limit=limit)))
-            timeline = sorted(posts, key=lambda p: p.get('created'), reverse=True)[:limit]
-    return timeline
+        logging.exception("Mise à jour de l'instantané de %s après follow de %s échouée", user, followees)
+
+# ------------------ FANOUT-ON-WRITE (mode push) ------------------
+
+def get_push_timeline(user: str, limit: int = 20, cursor: str = None) -> Page:
+    """Lit la timeline pré-calculée d'un utilisateur: une seule requête indexée (owner, created desc)."""
+    query = client.query(kind='TimelineEntry')
+    query.add_filter('owner', '=', user)
+    query.order = ['-created']
+    if not planner.has('projection'):
+        return fetch_page(query, limit, cursor)
+    # Projection servie par l'index (owner, created desc, author, content, post_id)
+    query.projection = ['author', 'content', 'created', 'post_id']
+    try:
+        return fetch_page(query, limit, cursor)
+    except CAPABILITY_ERRORS:
+        planner.disable('projection')
+        query.projection = []
+        return fetch_page(query, limit, cursor)
+
+
+def timeline_entry(owner: str, post: datastore.Entity) -> datastore.Entity:
+    """Copie dénormalisée d'un post dans la timeline de 'owner'.
+    La clé (owner:id du post) rend le fanout idempotent: le rejouer réécrit les mêmes entrées."""
+    entry = datastore.Entity(client.key('TimelineEntry', f"{owner}:{post.key.id_or_name}"))
+    entry.update({
+        'owner': owner,
+        'author': post['author'],
+        'content': post['content'],
+        'created': post['created'],
+        'post_id': post.key.id_or_name,
+    })
+    return entry
+
+
+def followers_of(author: str):
+    """Noms des utilisateurs qui suivent 'author' (index natif sur Follow.followee)."""
+    query = client.query(kind='Follow')
+    query.add_filter('followee', '=', author)
+    query.keys_only()
+    return [e.key.parent.name for e in query.fetch()]
+
+
+def put_in_batches(entities, batch_size: int = FANOUT_BATCH):
+    """Écrit une séquence d'entités par paquets put_multi; retourne le nombre écrit."""
+    batch = []
+    written = 0
+    for entity in entities:
+        batch.append(entity)
+        if len(batch) >= batch_size:
+            client.put_multi(batch)
+            written += len(batch)
+            batch = []
+    if batch:
+        client.put_multi(batch)
+        written += len(batch)
+    return written
+
+
+def fanout_post(post: datastore.Entity, followers=None):
+    """Pousse un post dans la timeline de chaque follower de son auteur."""
+    if followers is None:
+        followers = followers_of(post['author'])
+    owners = [owner for owner in followers if owner != post['author']]
+    written = put_in_batches(timeline_entry(owner, post) for owner in owners)
+    owners = set(owners)
+    timeline_cache.discard_where(lambda k, v: k[0] in owners)
+    return written
 
 
-def seed_data(users: int = 5, posts_per_user: int = 10, follows_count: int = 5, prefix: str = 'user'):
+def _fanout_in_background(post: datastore.Entity):
+    try:
+        fanout_post(post)
+    except Exception:
+        logging.exception("Fanout échoué pour le post %s", post.key.id_or_name)
+
+
+def _push_former_celebrity(author: str, depth: int = TIMELINE_DEPTH):
+    """
+    Mode hybrid: un auteur repassé sous CELEBRITY_PULL_THRESHOLD n'est plus tiré à la lecture. Ses
+    posts récents, écrits sans fanout tant qu'il était au-dessus du seuil, sont copiés chez ses
+    followers (clés déterministes: les entrées déjà poussées sont simplement réécrites).
+    """
+    try:
+        owners = [owner for owner in followers_of(author) if owner != author]
+        posts = latest_posts(author, depth)
+        put_in_batches(timeline_entry(owner, p) for p in posts for owner in owners)
+        owners = set(owners)
+        timeline_cache.discard_where(lambda k, v: k[0] in owners)
+    except Exception:
+        logging.exception("Fanout des posts de %s (repassé sous le seuil) échoué", author)
+
+
+def _backfill_followee(user: str, followee: str, depth: int = TIMELINE_DEPTH):
+    """Après un follow, copie les posts récents du nouveau followee dans la timeline de 'user'."""
+    try:
+        put_in_batches(timeline_entry(user, p) for p in latest_posts(followee, depth))
+        invalidate_user(user)
+    except Exception:
+        logging.exception("Backfill de %s dans la timeline de %s échoué", followee, user)
+
+
+def _drop_followee(user: str, followee: str):
+    """Après un unfollow, retire de la timeline de 'user' les entrées poussées par 'followee'."""
+    try:
+        q = client.query(kind='TimelineEntry')
+        q.add_filter('owner', '=', user)
+        q.add_filter('author', '=', followee)
+        q.keys_only()
+        keys = [e.key for e in q.fetch()]
+        for i in range(0, len(keys), FANOUT_BATCH):
+            client.delete_multi(keys[i:i + FANOUT_BATCH])
+        invalidate_user(user)
+    except Exception:
+        logging.exception("Retrait de %s de la timeline de %s échoué", followee, user)
+
+
+def materialize_timelines(follows_by_user, posts_by_author, depth: int = TIMELINE_DEPTH,
+                          skip_authors=frozenset()):
+    """
+    Écrit les timelines pré-calculées à partir d'un graphe de follows et des posts en mémoire.
+    Chaque utilisateur reçoit au plus 'depth' entrées: ses posts et ceux de ses followees
+    (hors 'skip_authors', lus à la demande en mode hybrid).
+    """
+    def entries():
+        for owner, follows in follows_by_user.items():
+            candidates = []
+            for author in {*(set(follows) - skip_authors), owner}:
+                candidates.extend(posts_by_author.get(author, []))
+            candidates.sort(key=lambda p: p['created'], reverse=True)
+            for p in candidates[:depth]:
+                yield timeline_entry(owner, p)
+    return put_in_batches(entries())
+
+
+def rebuild_timelines(prefix: str = '', depth: int = TIMELINE_DEPTH, mode: str = 'push'):
+    """
+    Backfill du mode push pour des données existantes (utilisateurs du jeu de données 'prefix').
+    Les posts de chaque auteur ne sont lus qu'une fois (ses 'depth' plus récents).
+    En mode 'hybrid', les posts des auteurs très suivis ne sont pas matérialisés.
+    """
+    follows_by_user = {}
+    for entity in seeding.user_query(client, prefix, keys_only=True).fetch():
+        if entity.key.name:
+            follows_by_user[entity.key.name] = []
+    for key in seeding.follow_edge_keys(client, prefix):
+        if key.parent.name in follows_by_user:
+            follows_by_user[key.parent.name].append(key.name)
+
+    authors = set(follows_by_user)
+    for follows in follows_by_user.values():
+        authors.update(follows)
+    authors = sorted(authors)
+    posts_by_author = dict(zip(authors, run_parallel(latest_posts, [(a, depth) for a in authors])))
+
+    skip = celebrities(authors) if mode == 'hybrid' else set()
+    written = materialize_timelines(follows_by_user, posts_by_author, depth=depth, skip_authors=skip)
+    if prefix:
+        seeding.update_manifest(client, prefix, timelines=mode)
+    return {'users': len(follows_by_user), 'authors': len(posts_by_author), 'entries_written': written,
+            'pulled_authors': len(skip)}
+
+
+def seed_data(users: int = 5, posts_per_user: int = 10, follows_count: int = 5, prefix: str = 'user',
+              timelines: bool = None, seed=None, distribution: str = 'uniform'):
     """
-    Peuple la base de données pour le benchmark.
+    Peuple la base de données pour le benchmark (pipeline partagé avec seed.py, voir seeding.py).
     - Crée 'users' utilisateurs.
     - Chaque utilisateur suit exactement 'follows_count' autres utilisateurs.
     - Chaque utilisateur publie exactement 'posts_per_user' messages.
+    - Si 'timelines' (par défaut: en mode push), matérialise aussi les TimelineEntry.
     """
-    user_names = [f"{prefix}{i}" for i in range(1, users + 1)]
-    
-    # 1. Création des utilisateurs
-    # On vérifie d'abord s'ils existent pour ne pas écraser inutilement, 
-    # mais pour le seed initial c'est souvent vide.
-    for name in user_names:
-        key = client.key('User', name)
-        if client.get(key) is None:
-            entity = datastore.Entity(key)
-            entity['follows'] = []
-            client.put(entity)
-
-    # 2. Assignation des Follows (Fixe pour exp 3)
-    for name in user_names:
-        key = client.key('User', name)
-        entity = client.get(key)
-        
-        # On ne se suit pas soi-même
-        others = [u for u in user_names if u != name]
-        
-        # Sélection aléatoire mais nombre FIXE
-        target = min(follows_count, len(others))
-        if target > 0:
-            # On écrase les follows existants pour garantir le nombre exact demandé par le test
-            entity['follows'] = random.sample(others, target)
-            client.put(entity)
-
-    # 3. Création des Posts (Posts PAR utilisateur)
-    base_time = datetime.utcnow()
-    batch = []
-    total_posts = 0
-    
-    for name in user_names:
-        for i in range(posts_per_user):
-            p = datastore.Entity(client.key('Post'))
-            p['author'] = name
-            p['content'] = f"Benchmark post {i+1} by {name}"
-            # On étale les dates aléatoirement pour le tri
-            p['created'] = base_time - timedelta(seconds=random.randint(1, 10000))
-            batch.append(p)
-            total_posts += 1
-            
-            # Écriture par paquets de 400 pour éviter les limites de taille/temps
-            if len(batch) >= 400:
-                client.put_multi(batch)
-                batch = []
-    
-    # Écrire le reste du batch
-    if batch:
-        client.put_multi(batch)
+    if timelines is None:
+        timelines = TIMELINE_MODE in ('push', 'hybrid')
+    result = seeding.seed_dataset(
+        client, users, posts_per_user, follows_count, prefix, seed=seed, distribution=distribution,
+        workers=SEED_WORKERS, spread=SEED_SPREAD, content=SEED_CONTENT, keep_posts=timelines,
+        report=logging.info)
+    _invalidate_seeded(result.follows_by_user)
+
+    # 4. Fanout en masse: les posts ont reçu leur id lors du put_multi
+    timeline_entries = 0
+    if timelines:
+        skip = ({a for a, n in result.follower_counts.items() if n >= CELEBRITY_THRESHOLD}
+                if TIMELINE_MODE == 'hybrid' else frozenset())
+        timeline_entries = materialize_timelines(result.follows_by_user, result.posts_by_author,
+                                                 skip_authors=skip)
+        seeding.update_manifest(client, prefix, timelines='hybrid' if TIMELINE_MODE == 'hybrid' else 'push')
 
     return {
         'users_total': users,
         'posts_per_user': posts_per_user,
-        'total_posts_created': total_posts,
+        'total_posts_created': result.posts,
         'follows_per_user': follows_count,
-        'prefix': prefix
+        'timeline_entries': timeline_entries,
+        'prefix': prefix,
+        'seed': result.seed,
+        'seconds': round(result.seconds, 2),
+    }
+
+
+def _invalidate_seeded(names):
+    """Le graphe et les posts de ces utilisateurs ont changé: caches périmés."""
+    seeded = set(names)
+    follows_cache.discard_where(lambda k, v: k in seeded)
+    follower_count_cache.discard_where(lambda k, v: k in seeded)
+    timeline_cache.discard_where(lambda k, v: k[0] in seeded)
+
+
+# ------------------ ÉCRITURE DES POSTS (commit groupé) ------------------
+
+instrumentation.metrics.describe('tinyinsta_post_commit_duration_seconds', 'histogram',
+                                 "Latence des put_multi de posts par source (group, bulk)")
+instrumentation.metrics.describe('tinyinsta_post_commit_batches_total', 'counter',
+                                 "put_multi de posts par source (group, bulk)")
+instrumentation.metrics.describe('tinyinsta_post_commit_entities_total', 'counter',
+                                 "Entités écrites par les put_multi de posts (posts et têtes d'auteur)")
+
+
+def post_error(author, content):
+    """Raison pour laquelle un post serait refusé par Datastore, None s'il est valide."""
+    if not isinstance(author, str) or not author or not isinstance(content, str):
+        return "author and content must be strings"
+    if len(author.encode()) > POST_CONTENT_MAX_BYTES or len(content.encode()) > POST_CONTENT_MAX_BYTES:
+        return f"author and content are limited to {POST_CONTENT_MAX_BYTES} bytes"
+    return None
+
+
+def new_post(author: str, content: str, created: datetime = None) -> datastore.Entity:
+    """Post à écrire (clé allouée au put), avec son shard si les posts sont shardés."""
+    entity = datastore.Entity(client.key('Post'))
+    entity.update({
+        'author': author,
+        'content': content,
+        'created': created or datetime.utcnow(),
+    })
+    if POST_SHARDS > 1:
+        entity['shard'] = seeding.post_shard()
+    return entity
+
+
+def post_heads(posts):
+    """Une tête par auteur, la plus récente: un commit ne peut pas écrire deux fois la même clé."""
+    latest = {}
+    for p in posts:
+        latest[p['author']] = max(latest.get(p['author'], p['created']), p['created'])
+    return [author_head(author, created) for author, created in latest.items()]
+
+
+def commit_posts(posts, source: str, max_entities: int = FANOUT_BATCH):
+    """
+    Écrit les posts et les têtes de leurs auteurs (même transaction que leurs posts) par commits
+    d'au plus 'max_entities' entités. La latence de chaque commit est exposée dans /metrics.
+    """
+    batch, authors = [], set()
+    for p in posts:
+        if batch and len(batch) + len(authors | {p['author']}) > max_entities:
+            _put_posts(batch, source)
+            batch, authors = [], set()
+        batch.append(p)
+        authors.add(p['author'])
+    if batch:
+        _put_posts(batch, source)
+
+
+def _commit_posts_transaction(posts):
+    """
+    Posts et têtes de leurs auteurs dans une transaction: une tête n'est écrite que si elle avance,
+    un commit concurrent plus récent n'est jamais écrasé. Retourne le nombre d'entités écrites.
+    """
+    with client.transaction():
+        heads = post_heads(posts)
+        stored = {e.key.name: seeding.utc_naive(e['last_post'])
+                  for e in client.get_multi([h.key for h in heads]) if e.get('last_post')}
+        heads = [h for h in heads
+                 if h.key.name not in stored or stored[h.key.name] < seeding.utc_naive(h['last_post'])]
+        client.put_multi(posts + heads)
+    return len(posts) + len(heads)
+
+
+def _put_posts(posts, source: str):
+    started = time.perf_counter()
+    for attempt in range(POST_TXN_ATTEMPTS):
+        try:
+            written = _commit_posts_transaction(posts)
+            break
+        except Conflict:
+            # Deux commits sur la tête d'un même auteur: on relit et on rejoue
+            if attempt == POST_TXN_ATTEMPTS - 1:
+                raise
+            time.sleep(random.uniform(0.01, 0.05) * 2 ** attempt)
+    labels = {'source': source}
+    instrumentation.metrics.observe('tinyinsta_post_commit_duration_seconds', labels,
+                                    time.perf_counter() - started)
+    instrumentation.metrics.inc('tinyinsta_post_commit_batches_total', labels)
+    instrumentation.metrics.inc('tinyinsta_post_commit_entities_total', labels, written)
+
+
+def publish_posts(posts):
+    """Suite d'une écriture durable: caches des auteurs invalidés, timelines push servies."""
+    authors = {p['author'] for p in posts}
+    for author in authors:
+        invalidate_author(author)
+    if TIMELINE_MODE not in ('push', 'hybrid'):
+        return
+    # Chaque auteur voit ses posts tout de suite; les followers sont servis en tâche de fond
+    put_in_batches(timeline_entry(p['author'], p) for p in posts)
+    # En hybrid, les posts d'un auteur très suivi sont lus à la demande: pas de fanout
+    skip = celebrities(authors) if TIMELINE_MODE == 'hybrid' else set()
+    for p in posts:
+        if p['author'] not in skip:
+            _fanout_pool.submit(_fanout_in_background, p)
+
+
+class GroupCommitter:
+    """
+    Commit groupé: les posts soumis par les requêtes concurrentes sont écrits ensemble par un thread
+    dédié, en un put_multi. Un lot part dès 'max_entities' entités en attente (posts et têtes) ou
+    'delay_ms' après le premier post en attente; pendant un commit, les suivants s'accumulent pour
+    le lot suivant. Chaque requête attend le commit de son lot (même durabilité qu'un put direct).
+    """
+
+    def __init__(self, max_entities: int = GROUP_COMMIT_MAX, delay_ms: float = GROUP_COMMIT_DELAY_MS):
+        self.max_entities = max_entities
+        self.delay = delay_ms / 1000
+        self._pending = []  # (posts, future), dans l'ordre d'arrivée
+        self._cond = threading.Condition()
+        self._thread = None
+        self.batches = 0
+        self.requests = 0
+        self.entities = 0
+        self.commit_ms = 0.0
+        self.max_commit_ms = 0.0
+        self.last = None
+
+    def submit(self, posts) -> Future:
+        future = Future()
+        # Un post invalide échouerait tout le lot: il est refusé ici, seul
+        errors = [post_error(p.get('author'), p.get('content')) for p in posts]
+        if any(errors):
+            future.set_exception(ValueError(next(e for e in errors if e)))
+            return future
+        with self._cond:
+            if self._thread is None:
+                # Démarré à la première écriture: dans le processus qui sert (après un fork de Gunicorn)
+                self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                self._thread.start()
+            self._pending.append((posts, future))
+            self._cond.notify()
+        return future
+
+    def write(self, posts):
+        """Soumet les posts et attend le commit de leur lot (lève l'erreur du commit)."""
+        self.submit(posts).result()
+
+    def _pending_entities(self):
+        posts = [p for group, _ in self._pending for p in group]
+        return len(posts) + len({p['author'] for p in posts})
+
+    def _take(self):
+        """Requêtes du prochain lot: en ordre d'arrivée, jusqu'à 'max_entities' entités (au moins une)."""
+        taken, authors, size = 0, set(), 0
+        for posts, _ in self._pending:
+            new_authors = {p['author'] for p in posts} - authors
+            if taken and size + len(posts) + len(new_authors) > self.max_entities:
+                break
+            taken += 1
+            authors |= new_authors
+            size += len(posts) + len(new_authors)
+        batch, self._pending = self._pending[:taken], self._pending[taken:]
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.delay
+                while self._pending_entities() < self.max_entities:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take()
+            self._commit(batch)
+
+    def _commit(self, batch):
+        posts = [p for group, _ in batch for p in group]
+        started = time.perf_counter()
+        try:
+            commit_posts(posts, 'group', self.max_entities)
+        except Exception as e:
+            logging.exception("Commit groupé de %s posts échoué", len(posts))
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # Chaque requête est rejouée seule: seule celle qui échoue encore reçoit l'erreur
+            for group, future in batch:
+                try:
+                    commit_posts(group, 'group', self.max_entities)
+                    future.set_result(None)
+                except Exception as retry_error:
+                    future.set_exception(retry_error)
+            return
+        ms = (time.perf_counter() - started) * 1000
+        with self._cond:
+            self.batches += 1
+            self.requests += len(batch)
+            self.entities += len(posts) + len({p['author'] for p in posts})
+            self.commit_ms += ms
+            self.max_commit_ms = max(self.max_commit_ms, ms)
+            self.last = {'requests': len(batch), 'posts': len(posts), 'commit_ms': round(ms, 2)}
+        for _, future in batch:
+            future.set_result(None)
+
+    def status(self):
+        with self._cond:
+            return {
+                'enabled': GROUP_COMMIT,
+                'max_entities': self.max_entities,
+                'delay_ms': self.delay * 1000,
+                'pending': len(self._pending),
+                'batches': self.batches,
+                'requests': self.requests,
+                'entities': self.entities,
+                'requests_per_batch': round(self.requests / self.batches, 2) if self.batches else None,
+                'commit_ms': round(self.commit_ms, 2),
+                'avg_commit_ms': round(self.commit_ms / self.batches, 2) if self.batches else None,
+                'max_commit_ms': round(self.max_commit_ms, 2),
+                'last': self.last,
+            }
+
+
+committer = GroupCommitter()
+
+
+def write_posts(posts):
+    """Écrit les posts d'une requête: via le commit groupé de ce processus, ou directement."""
+    with instrumentation.stage('commit'):
+        if GROUP_COMMIT:
+            committer.write(posts)
+        else:
+            commit_posts(posts, 'direct')
+
+
+# ------------------ SEED EN TÂCHE DE FOND (jobs reprenables) ------------------
+# Un SeedJob décrit le jeu de données (avec sa graine: une reprise regénère les mêmes posts, aux
+# mêmes clés) et son avancement: phase graph -> posts (par paquets de SEED_CHUNK_USERS utilisateurs,
+# point de reprise après chacun) -> timelines -> done. L'instance qui exécute le job tient un bail
+# (owner + heartbeat); un job dont le heartbeat est trop ancien (instance arrêtée) est repris par
+# la prochaine instance qui le consulte.
+
+class SeedJobLost(Exception):
+    """Le bail du job a été repris par une autre instance."""
+
+
+def create_seed_job(users: int, posts_per_user: int, follows_count: int, prefix: str,
+                    timelines: bool = None, seed=None, distribution: str = 'uniform') -> datastore.Entity:
+    if timelines is None:
+        timelines = TIMELINE_MODE in ('push', 'hybrid')
+    now = time.time()
+    job = datastore.Entity(client.key('SeedJob', uuid.uuid4().hex[:12]), exclude_from_indexes=('error',))
+    job.update({
+        'prefix': prefix,
+        'users': users,
+        'posts_per_user': posts_per_user,
+        'follows_count': follows_count,
+        'distribution': distribution,
+        'timelines': timelines,
+        'seed': seed if seed is not None else seeding.new_seed(),
+        # Dates des posts relatives à la création du job: identiques d'une reprise à l'autre
+        'base_time': now,
+        'state': 'pending',
+        'phase': 'graph',
+        'users_done': 0,
+        'posts_done': 0,
+        'owner': None,
+        'started': now,
+        'heartbeat': None,
+        'error': None,
+    })
+    client.put(job)
+    return job
+
+
+def claim_seed_job(job_id: str, force: bool = False):
+    """Prend le bail du job s'il est libre (ou expiré); 'force' reprend aussi un job en échec."""
+    resumable = ('pending', 'running', 'failed') if force else ('pending', 'running')
+    try:
+        with client.transaction():
+            job = client.get(client.key('SeedJob', job_id))
+            if job is None or job['state'] not in resumable:
+                return None
+            heartbeat = job.get('heartbeat')
+            if job['state'] == 'running' and heartbeat and time.time() - heartbeat < SEED_JOB_STALE:
+                return None
+            job.update({'state': 'running', 'owner': INSTANCE_ID, 'heartbeat': time.time(), 'error': None})
+            client.put(job)
+    except Conflict:
+        # Une autre instance a pris le bail au même moment
+        return None
+    return job
+
+
+def checkpoint_seed_job(job_id: str, **fields) -> datastore.Entity:
+    """Enregistre l'avancement et renouvelle le bail; SeedJobLost si une autre instance l'a repris."""
+    with client.transaction():
+        job = client.get(client.key('SeedJob', job_id))
+        if job is None or job.get('owner') != INSTANCE_ID:
+            raise SeedJobLost(job_id)
+        job.update(fields)
+        job['heartbeat'] = time.time()
+        client.put(job)
+    return job
+
+
+def run_seed_job(job: datastore.Entity):
+    """Exécute (ou reprend au dernier point de reprise) un job dont on détient le bail."""
+    job_id = job.key.name
+    try:
+        names = seeding.user_names(job['prefix'], job['users'])
+        with seeding.BatchWriter(client, workers=SEED_WORKERS) as writer:
+            if job['phase'] == 'graph':
+                seeding.start_manifest(client, job['prefix'], job['users'], job['posts_per_user'],
+                                       job['follows_count'], job['seed'], job['distribution'])
+                seeding.seed_graph(client, writer, names, job['follows_count'], job['prefix'], job['seed'],
+                                   job['distribution'], report=logging.info)
+                job = checkpoint_seed_job(job_id, phase='posts')
+            base_time = datetime.utcfromtimestamp(job['base_time'])
+            while job['phase'] == 'posts' and job['users_done'] < len(names):
+                # Un paquet interrompu est réécrit à l'identique (clés et dates déterministes)
+                chunk = names[job['users_done']:job['users_done'] + SEED_CHUNK_USERS]
+                last_post, _ = seeding.seed_posts(client, writer, chunk, job['posts_per_user'], job['seed'],
+                                                  base_time, SEED_SPREAD, SEED_CONTENT, report=logging.info)
+                seeding.write_heads(client, writer, last_post)
+                job = checkpoint_seed_job(job_id, users_done=job['users_done'] + len(chunk),
+                                          posts_done=job['posts_done'] + len(chunk) * job['posts_per_user'])
+        if job['phase'] == 'posts':
+            seeding.update_manifest(client, job['prefix'], complete=True)
+            job = checkpoint_seed_job(job_id, phase='timelines')
+        if job['phase'] == 'timelines' and job['timelines']:
+            rebuild_timelines(prefix=job['prefix'], mode='hybrid' if TIMELINE_MODE == 'hybrid' else 'push')
+        _invalidate_seeded(names)
+        checkpoint_seed_job(job_id, phase='done', state='done')
+    except SeedJobLost:
+        logging.warning("Job de seed %s repris par une autre instance", job_id)
+    except Exception as e:
+        logging.exception("Job de seed %s en échec", job_id)
+        try:
+            checkpoint_seed_job(job_id, state='failed', error=repr(e)[:1500])
+        except Exception:
+            logging.exception("Impossible d'enregistrer l'échec du job de seed %s", job_id)
+
+
+def resume_seed_job(job_id: str, force: bool = False) -> bool:
+    """Lance le job en tâche de fond si son bail est libre; retourne True s'il a été (re)lancé."""
+    job = claim_seed_job(job_id, force=force)
+    if job is None:
+        return False
+    _seed_pool.submit(run_seed_job, job)
+    return True
+
+
+def seed_job_status(job: datastore.Entity) -> dict:
+    elapsed = (job.get('heartbeat') or job['started']) - job['started']
+    return {
+        'job': job.key.name,
+        'state': job['state'],
+        'phase': job['phase'],
+        'prefix': job['prefix'],
+        'seed': job['seed'],
+        'users_done': job['users_done'],
+        'users_total': job['users'],
+        'posts_done': job['posts_done'],
+        'posts_total': job['users'] * job['posts_per_user'],
+        'posts_per_second': round(job['posts_done'] / elapsed, 1) if elapsed > 0 else None,
+        'owner': job.get('owner'),
+        'error': job.get('error'),
     }
 
 
+# ------------------ DÉMARRAGE À FROID (warmup) ------------------
+# Mesures de démarrage de l'instance: import du module (dépendances comprises), création du client
+# Datastore (différée), warmup et première requête servie. Voir /admin/startup.
+startup = {'instance': INSTANCE_ID, 'import_ms': None, 'warmup': None, 'first_request': None}
+_startup_lock = threading.Lock()
+
+
+def warm_up(users=()):
+    """
+    Prépare l'instance avant son premier utilisateur; retourne la durée de chaque étape (ms):
+    - datastore: création du client, identifiants et canal gRPC ouvert par une lecture par clé;
+    - planner: une requête IN et une projection minimales, qui écartent tout de suite une
+      capacité indisponible (les utilisateurs ne paient pas la tentative en échec);
+    - follows: followees de 'users' chargés dans le cache (une passe parallèle).
+    Une étape en échec est journalisée et n'empêche pas les suivantes.
+    """
+    steps = {}
+
+    def step(name, fn):
+        started = time.perf_counter()
+        try:
+            fn()
+        except Exception:
+            logging.exception("Warmup: étape '%s' en échec", name)
+        steps[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    step('datastore', lambda: client.get(client.key('Dataset', '__warmup__')))
+    step('planner', lambda: (pull_posts(['__warmup_a__', '__warmup_b__'], 1), pull_posts(['__warmup_a__'], 1)))
+    if users:
+        step('follows', lambda: get_follows_multi(users))
+    return steps
+
+
+@app.route('/_ah/warmup')
+def warmup():
+    """Requête de warmup d'App Engine (inbound_services: warmup), avant tout trafic sur l'instance."""
+    started = time.perf_counter()
+    steps = warm_up(WARMUP_USERS)
+    startup['warmup'] = {'steps': steps, 'total_ms': round((time.perf_counter() - started) * 1000, 1)}
+    # Toujours 200: une instance dont le warmup a échoué sert quand même, à froid
+    return jsonify(startup['warmup'])
+
+
+@app.route('/admin/startup')
+def admin_startup():
+    """Mesures de démarrage de l'instance qui répond (import, client, warmup, première requête)."""
+    return jsonify({**startup, 'client_ms': client.created_ms, 'client_created': client.created,
+                    'planner': planner.status()})
+
+
+# ------------------ INSTRUMENTATION ------------------
+# Chaque requête est tracée (RPC Datastore, entités, étapes): en-tête Server-Timing, log JSON
+# structuré et métriques agrégées sur /metrics. REQUEST_LOG=0 coupe le log par requête.
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') == '1'
+
+
+@app.before_request
+def start_trace():
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    g.trace_token = instrumentation.start(route, request.method)
+    with _startup_lock:
+        # Première requête de l'instance (le warmup, s'il a eu lieu): elle a payé le démarrage.
+        # Une seule, même si plusieurs threads servent leurs premières requêtes en même temps
+        cold = startup['first_request'] is None
+        if cold:
+            startup['first_request'] = route
+    g.cold = cold
+
+
+@app.after_request
+def finish_trace(response):
+    trace = instrumentation.current()
+    if trace is None:
+        return response
+    trace.strategy = response.headers.get('X-Timeline-Strategy')
+    total_ms = trace.elapsed_ms()
+    timing = trace.server_timing(total_ms)
+    response.headers['X-Instance-Id'] = INSTANCE_ID
+    if g.get('cold'):
+        response.headers['X-Instance-Cold'] = '1'
+        timing += f', startup;desc="import";dur={startup["import_ms"]}'
+    response.headers['Server-Timing'] = timing
+    instrumentation.finish(trace, response.status_code, total_ms, log=REQUEST_LOG)
+    return response
+
+
+@app.teardown_request
+def end_trace(exc):
+    token = g.pop('trace_token', None)
+    if token is not None:
+        instrumentation.end(token)
+
+
+@app.route('/metrics')
+def metrics():
+    """Métriques de ce processus au format texte Prometheus (latences par route et par stratégie)."""
+    return Response(instrumentation.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/', methods=['GET'])
 def index():
     user = session.get('user')
@@ -160,27 +1772,98 @@ def api_timeline():
     except ValueError:
         limit = 20
     limit = max(1, min(limit, 100))
-    entities = get_timeline(user, limit=limit)
-    data = [
-        {
-            'author': e.get('author'),
-            'content': e.get('content'),
-            'created': (e.get('created') or datetime.utcnow()).isoformat() + 'Z'
-        }
-        for e in entities
-    ]
-    return jsonify({
-        'user': user,
-        'count': len(data),
-        'items': data
-    })
+    mode = request.args.get('mode') or TIMELINE_MODE
+    if mode not in TIMELINE_MODES:
+        return jsonify({"error": "invalid mode"}), 400
+    try:
+        result = fetch_timeline(user, limit=limit, mode=mode, cursor=request.args.get('cursor'))
+    except InvalidCursor as e:
+        return jsonify({"error": "invalid cursor", "details": str(e)}), 400
+    with instrumentation.stage('serialize'):
+        data = _items_json(result.items)
+        body = json.dumps({
+            'user': user,
+            'mode': mode,
+            'strategy': result.strategy,
+            'count': len(data),
+            'items': data,
+            'cursor': result.cursor
+        }, separators=(',', ':'), ensure_ascii=False).encode()
+        response = json_response(body)
+    response.headers['X-Timeline-Strategy'] = result.strategy
+    return response
+
+
+@app.route('/api/timelines', methods=['GET', 'POST'])
+def api_timelines():
+    """
+    Timelines (mode pull) de plusieurs utilisateurs en une requête: users=a,b,c en paramètre,
+    ou corps JSON {"users": [...], "limit": 20} en POST.
+    """
+    payload = (request.get_json(silent=True) or {}) if request.method == 'POST' else {}
+    users = payload.get('users') or request.values.get('users', '')
+    if isinstance(users, str):
+        users = users.split(',')
+    if not isinstance(users, list) or not all(isinstance(u, str) for u in users):
+        return jsonify({"error": "users must be a list of names"}), 400
+    users = list(dict.fromkeys(u.strip() for u in users if u.strip()))
+    if not users:
+        return jsonify({"error": "missing users"}), 400
+    if len(users) > BATCH_MAX_USERS:
+        return jsonify({"error": "too many users", "max": BATCH_MAX_USERS}), 400
+    try:
+        limit = int(payload.get('limit') or request.values.get('limit', '20'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "invalid limit"}), 400
+    limit = max(1, min(limit, 100))
+    results = fetch_timelines(users, limit=limit)
+    timelines = {}
+    for user in users:
+        result = results[user]
+        data = _items_json(result.items)
+        timelines[user] = {'strategy': result.strategy, 'count': len(data), 'items': data,
+                           'cursor': result.cursor}
+    body = json.dumps({'mode': 'pull', 'count': len(timelines), 'timelines': timelines},
+                      separators=(',', ':'), ensure_ascii=False).encode()
+    return json_response(body)
+
+
+def _items_json(items):
+    return [{'author': e.author, 'content': e.content, 'created': _iso(e.created)} for e in items]
+
+
+def _iso(created: datetime) -> str:
+    """Date ISO 8601 en UTC suffixée 'Z' (les dates Datastore sont en UTC, naïves ou non)."""
+    return seeding.utc_naive(created).isoformat() + 'Z'
+
+
+def json_response(body: bytes):
+    """
+    Réponse JSON déjà sérialisée, avec ETag fort: 304 si le client a déjà cette version, sinon
+    corps compressé en gzip quand il est assez gros et que le client l'accepte.
+    """
+    etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+    compress = len(body) >= GZIP_MIN_SIZE and 'gzip' in request.headers.get('Accept-Encoding', '')
+    if compress:
+        etag += '-gz'
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(gzip.compress(body, compresslevel=5) if compress else body,
+                                      mimetype='application/json')
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @app.route('/admin/seed', methods=['GET', 'POST'])
 def admin_seed():
     """
     Endpoint de seed adapté au benchmark.
-    Paramètres URL: users, posts (par user), follows, prefix.
+    Paramètres URL: users, posts (par user), follows, prefix, seed, distribution (uniform|zipf).
     Exemple: /admin/seed?users=1000&posts=50&follows=20&prefix=exp1
     """
     # Sécurité simple via variable d'env (optionnelle pour le test)
@@ -194,22 +1877,138 @@ def admin_seed():
         posts = int(request.args.get('posts', 10))     # Posts PAR User
         follows = int(request.args.get('follows', 5))  # Follows PAR User
         prefix = request.args.get('prefix', 'u_bench') # Préfixe pour isoler les tests
+        seed = request.args.get('seed')                 # Graine: même seed = mêmes données
+        seed = int(seed) if seed is not None else None
     except ValueError:
         return jsonify({'error': 'invalid params'}), 400
+    timelines = request.args.get('timelines')  # 1 = matérialiser les timelines (mode push)
+    distribution = request.args.get('distribution', 'uniform')
+    if distribution not in ('uniform', 'zipf'):
+        return jsonify({'error': 'invalid distribution'}), 400
+
+    if request.args.get('background') == '1':
+        # Gros volumes: job découpé en tâche de fond, suivi par /admin/seed/status?job=
+        job = create_seed_job(users=users, posts_per_user=posts, follows_count=follows, prefix=prefix,
+                              timelines=None if timelines is None else timelines == '1', seed=seed,
+                              distribution=distribution)
+        resume_seed_job(job.key.name)
+        return jsonify({'status': 'accepted', 'job': job.key.name,
+                        'status_url': url_for('admin_seed_status', job=job.key.name)}), 202
 
     # Lancer le seed
-    result = seed_data(users=users, posts_per_user=posts, follows_count=follows, prefix=prefix)
+    result = seed_data(users=users, posts_per_user=posts, follows_count=follows, prefix=prefix,
+                       timelines=None if timelines is None else timelines == '1', seed=seed,
+                       distribution=distribution)
+    return jsonify({'status': 'ok', 'details': result})
+
+
+@app.route('/admin/seed/status')
+def admin_seed_status():
+    """
+    Avancement d'un job de seed (lecture seule). Avec le jeton d'administration, un job dont
+    l'instance a disparu (heartbeat expiré) est aussi repris ici.
+    Exemple: /admin/seed/status?job=3f2a9c1b7d4e&token=...
+    """
+    job_id = request.args.get('job')
+    if not job_id:
+        return jsonify({'error': 'missing job'}), 400
+    job = client.get(client.key('SeedJob', job_id))
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
+    expected = os.environ.get('SEED_TOKEN')
+    resumed = (not expected or request.args.get('token') == expected) and resume_seed_job(job_id)
+    if resumed:
+        job = client.get(job.key)
+    return jsonify({**seed_job_status(job), 'resumed': resumed})
+
+
+@app.route('/admin/seed/resume', methods=['GET', 'POST'])
+def admin_seed_resume():
+    """Relance un job de seed interrompu ou en échec à partir de son dernier point de reprise."""
+    expected = os.environ.get('SEED_TOKEN')
+    token = request.args.get('token')
+    if expected and token != expected:
+        return jsonify({'error': 'forbidden'}), 403
+
+    job_id = request.args.get('job')
+    if not job_id:
+        return jsonify({'error': 'missing job'}), 400
+    resumed = resume_seed_job(job_id, force=True)
+    job = client.get(client.key('SeedJob', job_id))
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
+    return jsonify({**seed_job_status(job), 'resumed': resumed})
+
+
+@app.route('/admin/timelines/rebuild', methods=['GET', 'POST'])
+def admin_rebuild_timelines():
+    """
+    Backfill des timelines pré-calculées (mode push) pour les données existantes.
+    Exemple: /admin/timelines/rebuild?prefix=fan100
+    """
+    expected = os.environ.get('SEED_TOKEN')
+    token = request.args.get('token')
+    if expected and token != expected:
+        return jsonify({'error': 'forbidden'}), 403
+
+    prefix = request.args.get('prefix', '')
+    mode = request.args.get('mode', 'push')  # 'hybrid' = sans les auteurs très suivis
+    if mode not in ('push', 'hybrid'):
+        return jsonify({'error': 'invalid mode'}), 400
+    result = rebuild_timelines(prefix=prefix, mode=mode)
+    return jsonify({'status': 'ok', 'details': result})
+
+
+@app.route('/admin/follows/migrate', methods=['GET', 'POST'])
+def admin_migrate_follows():
+    """
+    Migration des anciennes listes User.follows vers les arêtes Follow.
+    Exemple: /admin/follows/migrate?prefix=exp1
+    """
+    expected = os.environ.get('SEED_TOKEN')
+    token = request.args.get('token')
+    if expected and token != expected:
+        return jsonify({'error': 'forbidden'}), 403
+
+    result = migrate_follows(prefix=request.args.get('prefix', ''))
     return jsonify({'status': 'ok', 'details': result})
 
 
+@app.route('/admin/planner')
+def admin_planner():
+    """État du planificateur de stratégie de ce processus (capacités désactivées et délai restant)."""
+    return jsonify(planner.status())
+
+
+@app.route('/admin/cache')
+def admin_cache():
+    """
+    Compteurs des caches de ce processus (hits/misses/evictions). Avec ?clear=1 (et le jeton
+    d'administration si SEED_TOKEN est défini), les caches sont vidés avant le relevé.
+    """
+    caches = {'follows': follows_cache, 'timeline': timeline_cache, 'follower_count': follower_count_cache}
+    if request.args.get('clear'):
+        expected = os.environ.get('SEED_TOKEN')
+        if expected and request.args.get('token') != expected:
+            return jsonify({'error': 'forbidden'}), 403
+        for cache in caches.values():
+            cache.discard_where(lambda k, v: True)
+    return jsonify({name: cache.stats() for name, cache in caches.items()})
+
+
+@app.route('/admin/commits')
+def admin_commits():
+    """Commit groupé de /post dans ce processus: lots, requêtes par lot, latence des commits."""
+    return jsonify(committer.status())
+
+
 @app.route('/login', methods=['POST'])
 def login():
     username = request.form['username']
-    key = client.key('User', username)
-    if not client.get(key):
-        entity = datastore.Entity(key)
-        entity.update({'follows': []})
-        client.put(entity)
+    if get_follows(username) is None:
+        key = client.key('User', username)
+        client.put(datastore.Entity(key))
+        follows_cache.set(username, [])
     session['user'] = username
     return redirect(url_for('index'))
 
@@ -226,37 +2025,101 @@ def post():
     if not user:
         return redirect(url_for('index'))
     content = request.form['content']
-    entity = datastore.Entity(client.key('Post'))
-    entity.update({
-        'author': user,
-        'content': content,
-        'created': datetime.utcnow()
-    })
-    client.put(entity)
+    error = post_error(user, content)
+    if error:
+        return jsonify({"error": f"invalid post ({error})"}), 400
+    entity = new_post(user, content)
+    write_posts([entity])
+    publish_posts([entity])
     return redirect(url_for('index'))
 
 
 @app.route('/follow', methods=['POST'])
 def follow():
     user = session.get('user')
-    to_follow = request.form['to_follow']
-    if not user or user == to_follow:
-        return redirect(url_for('index'))
-    user_key = client.key('User', user)
-    user_entity = client.get(user_key)
-    if not user_entity:
-         # Si l'user n'existe pas encore (cas rare en prod mais possible ici)
-         user_entity = datastore.Entity(user_key)
-         user_entity['follows'] = []
-
-    current_follows = user_entity.get('follows', [])
-    if to_follow not in current_follows:
-        current_follows.append(to_follow)
-        user_entity['follows'] = current_follows
-        client.put(user_entity)
+    if user:
+        apply_follows(user, follow=[request.form['to_follow']])
     return redirect(url_for('index'))
 
 
+@app.route('/unfollow', methods=['POST'])
+def unfollow():
+    user = session.get('user')
+    if user:
+        apply_follows(user, unfollow=[request.form['to_unfollow']])
+    return redirect(url_for('index'))
+
+
+def has_seed_token() -> bool:
+    """Requête porteuse du jeton d'administration (?token=SEED_TOKEN); jamais vrai sans SEED_TOKEN défini."""
+    expected = os.environ.get('SEED_TOKEN')
+    return bool(expected) and request.args.get('token') == expected
+
+
+@app.route('/api/posts', methods=['POST'])
+def api_posts():
+    """
+    Publication en lot: corps JSON {"posts": ["contenu", ...]} pour l'utilisateur de la session.
+    Avec le jeton d'administration (?token=SEED_TOKEN), "user" dans le corps ou {"author": ...,
+    "content": ...} par post permettent d'écrire pour d'autres auteurs (ingestion, tests de charge).
+    Écriture directe par put_multi de FANOUT_BATCH entités (le lot est déjà groupé).
+    """
+    payload = request.get_json(silent=True) or {}
+    items = payload.get('posts')
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "posts must be a non-empty list"}), 400
+    if len(items) > BULK_POSTS_MAX:
+        return jsonify({"error": "too many posts", "max": BULK_POSTS_MAX}), 400
+    admin = has_seed_token()
+    if not admin and (payload.get('user') is not None
+                      or any(isinstance(item, dict) and 'author' in item for item in items)):
+        return jsonify({"error": "forbidden: user and author require the admin token"}), 403
+    user = payload.get('user') if admin and payload.get('user') is not None else session.get('user')
+    if user is None and not admin:
+        return jsonify({"error": "login required"}), 401
+    now = datetime.utcnow()
+    posts = []
+    for i, item in enumerate(items):
+        author, content = (user, item) if isinstance(item, str) else (None, None)
+        if isinstance(item, dict):
+            author, content = item.get('author', user), item.get('content')
+        error = post_error(author, content)
+        if error:
+            return jsonify({"error": f"invalid post ({error})", "index": i}), 400
+        # Dates distinctes et croissantes: les timelines gardent l'ordre du lot
+        posts.append(new_post(author, content, now + timedelta(microseconds=i)))
+    with instrumentation.stage('commit'):
+        commit_posts(posts, 'bulk')
+    publish_posts(posts)
+    return jsonify({'written': len(posts), 'ids': [p.key.id_or_name for p in posts]})
+
+
+@app.route('/api/follow', methods=['POST'])
+def api_follow():
+    """
+    Follow/unfollow en lot pour l'utilisateur de la session, en une transaction: corps JSON
+    {"follow": [...], "unfollow": [...]} (noms d'utilisateur).
+    """
+    user = session.get('user')
+    if not user:
+        return jsonify({"error": "login required"}), 401
+    payload = request.get_json(silent=True) or {}
+    follow, unfollow = payload.get('follow') or [], payload.get('unfollow') or []
+    if not isinstance(follow, list) or not isinstance(unfollow, list):
+        return jsonify({"error": "follow and unfollow must be lists"}), 400
+    if not all(isinstance(name, str) and name for name in follow + unfollow):
+        return jsonify({"error": "follow and unfollow entries must be non-empty strings"}), 400
+    if len(follow) + len(unfollow) > BULK_FOLLOW_MAX:
+        return jsonify({"error": "too many edges", "max": BULK_FOLLOW_MAX}), 400
+    added, removed = apply_follows(user, follow=follow, unfollow=unfollow)
+    return jsonify({'user': user, 'followed': added, 'unfollowed': removed})
+
+
+# Dernière instruction du module: import de l'application terminé, routes comprises
+startup['import_ms'] = round((time.perf_counter() - _IMPORT_STARTED) * 1000, 1)
+logging.info("Instance %s: module importé en %sms", INSTANCE_ID, startup['import_ms'])
+
+
 if __name__ == '__main__':
     # Note: En production (App Engine), Gunicorn est utilisé, donc ce bloc n'est pas exécuté.
     # Pour le dev local:
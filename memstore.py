@@ -0,0 +1,779 @@
+"""
+Moteur Datastore en mémoire pour exécuter TinyInsta hors GCP (voir storage.py).
+
+Implémente le sous-ensemble de l'API google.cloud.datastore utilisé par le
+projet : clés, get/put/get_multi/put_multi/delete_multi, requêtes avec
+filtres (=, <, <=, >, >=, IN, __key__), ancêtre, tri, projection, keys_only,
+limites et curseurs, transactions. Chaque propriété indexée, et les clés de
+chaque type, sont tenues dans un index trié (valeur, clé) consulté par bisection.
+Comme Datastore, une requête triée (égalités, IN, bornes sur la propriété de tri)
+parcourt un index composite dans l'ordre et s'arrête à 'limit': son coût dépend du
+nombre de résultats, pas du nombre d'entités qui correspondent aux filtres.
+
+Une latence artificielle par RPC peut être injectée (MEMSTORE_LATENCY_MS)
+pour simuler les allers-retours réseau. Les données vivent dans le processus:
+tous les clients d'un même processus les partagent, rien n'est persisté.
+"""
+from __future__ import annotations
+
+import base64
+import bisect
+import heapq
+import itertools
+import json
+import operator
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from google.api_core.exceptions import InvalidArgument
+from google.cloud.datastore import Entity, Key
+
+KEY_PROPERTY = '__key__'
+
+
+def _to_utc(value):
+    """Datastore stocke les dates en UTC : on compare toujours en UTC naïf."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _key_order(key):
+    """Ordre Datastore des clés : chemin, ids numériques avant les noms."""
+    out = []
+    for kind, ident in zip(key.flat_path[0::2], key.flat_path[1::2]):
+        out.append((kind, 0, ident, '') if isinstance(ident, int) else (kind, 1, 0, ident))
+    return tuple(out)
+
+
+def _value_order(value):
+    """Clé de tri reproduisant l'ordre des types de Datastore."""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (3, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, datetime):
+        return (2, _to_utc(value))
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, bytes):
+        return (5, value)
+    if isinstance(value, Key):
+        return (6, _key_order(value))
+    return (7, repr(value))
+
+
+def _values(entity, prop):
+    """Valeurs indexables d'une propriété (une propriété liste en donne plusieurs)."""
+    if prop == KEY_PROPERTY:
+        return [entity.key]
+    if prop not in entity:
+        return []
+    value = entity[prop]
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+_COMPARE = {'=': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le,
+            '>': operator.gt, '>=': operator.ge}
+
+
+def _compile_filter(prop, op, value):
+    """Prédicat d'un filtre sur une entité; la valeur de référence n'est convertie qu'une fois."""
+    if op in ('IN', 'NOT_IN'):
+        wanted = {_value_order(v) for v in value}
+
+        def member(entity):
+            found = [_value_order(v) in wanted for v in _values(entity, prop)]
+            return any(found) if op == 'IN' else bool(found) and not any(found)
+        return member
+    if op not in _COMPARE:
+        raise ValueError(f"Opérateur non supporté: {op}")
+    ref, compare = _value_order(value), _COMPARE[op]
+    return lambda entity: any(compare(_value_order(v), ref) for v in _values(entity, prop))
+
+
+def _is_ancestor(ancestor, key):
+    path = ancestor.flat_path
+    return key.flat_path[:len(path)] == path and key.flat_path != path
+
+
+def _copy(entity):
+    """Copie d'une entité (les listes sont dupliquées, les autres valeurs sont immuables)."""
+    clone = Entity(entity.key, exclude_from_indexes=tuple(entity.exclude_from_indexes))
+    dict.update(clone, ((name, list(value) if isinstance(value, list) else value)
+                        for name, value in entity.items()))
+    return clone
+
+
+# ------------------ CURSEURS ------------------
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'t': _to_utc(value).isoformat()}
+    if isinstance(value, Key):
+        return {'k': list(value.flat_path)}
+    if isinstance(value, bytes):
+        return {'b': base64.b64encode(value).decode()}
+    return {'v': value}
+
+
+def _decode_value(data, client):
+    if 't' in data:
+        return datetime.fromisoformat(data['t'])
+    if 'k' in data:
+        return client.key(*data['k'])
+    if 'b' in data:
+        return base64.b64decode(data['b'])
+    return data['v']
+
+
+def _encode_cursor(values, key):
+    payload = {'o': [_encode_value(v) for v in values], 'k': list(key.flat_path)}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode())
+
+
+def _decode_cursor(cursor, client):
+    if isinstance(cursor, str):
+        cursor = cursor.encode()
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor))
+        return [_decode_value(v, client) for v in payload['o']], client.key(*payload['k'])
+    except (ValueError, TypeError, KeyError) as e:
+        # Comme Datastore: un curseur illisible est un argument invalide
+        raise InvalidArgument(f"Invalid cursor: {e}")
+
+
+# ------------------ INDEX ------------------
+
+class _SortedIndex:
+    """
+    Index trié de lignes (valeur, clé) d'une propriété, les deux sous forme d'ordre Datastore
+    (_value_order, _key_order): tuples natifs, triés et bissectés sans fonction de clé.
+    Les ajouts sont triés paresseusement (à la lecture suivante); un retrait se fait par
+    bisection si l'index est trié, sinon il est différé jusqu'au prochain tri.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.dirty = False
+        self.removed = Counter()
+
+    def add(self, value, key_order):
+        self.add_row((_value_order(value), key_order))
+
+    def remove(self, value, key_order):
+        self.remove_row((_value_order(value), key_order))
+
+    def add_row(self, row):
+        self.rows.append(row)
+        self.dirty = True
+
+    def remove_row(self, row):
+        if self.dirty:
+            self.removed[row] += 1
+            return
+        i = bisect.bisect_left(self.rows, row)
+        if i < len(self.rows) and self.rows[i] == row:
+            del self.rows[i]
+
+    def _settle(self):
+        if not self.dirty:
+            return
+        if self.removed:
+            kept = []
+            for row in self.rows:
+                if self.removed[row] > 0:
+                    self.removed[row] -= 1
+                else:
+                    kept.append(row)
+            self.rows = kept
+            self.removed.clear()
+        self.rows.sort()
+        self.dirty = False
+
+    def scan(self, low=None, low_inclusive=True, high=None, high_inclusive=True):
+        """Clés (_key_order) dont la valeur est dans [low, high] (bornes optionnelles)."""
+        self._settle()
+        rows = self.rows
+        start, end = 0, len(rows)
+        # (v,) précède toutes les lignes de valeur v, (v, _MAX) les suit toutes
+        if low is not None:
+            probe = (_value_order(low),) if low_inclusive else (_value_order(low), _MAX)
+            start = bisect.bisect_left(rows, probe)
+        if high is not None:
+            probe = (_value_order(high), _MAX) if high_inclusive else (_value_order(high),)
+            end = bisect.bisect_left(rows, probe)
+        return [row[1] for row in rows[start:end]]
+
+    def prefix_scan(self, key_order):
+        """Index des clés: clés descendantes de 'key_order' (contiguës dans l'ordre des chemins)."""
+        self._settle()
+        rows = self.rows
+        n = len(key_order)
+        i = bisect.bisect_right(rows, ((6, key_order), _MAX))
+        found = []
+        while i < len(rows) and rows[i][1][:n] == key_order:
+            found.append(rows[i][1])
+            i += 1
+        return found
+
+    def sorted_rows(self):
+        self._settle()
+        return self.rows
+
+
+class _CompositeIndex(_SortedIndex):
+    """
+    Index composite d'un type: lignes (valeurs des propriétés d'égalité, valeur de tri, clé), la
+    valeur de tri inversée (_Reversed) pour un tri descendant. Les égalités donnent un préfixe,
+    les lignes d'un préfixe sont déjà dans l'ordre de la requête (valeur, puis clé croissante).
+    """
+
+    def __init__(self, equality, order, desc):
+        super().__init__()
+        self.equality = equality
+        self.order = order
+        self.desc = desc
+
+    def entity_rows(self, entity, key_order):
+        """Lignes d'une entité: aucune s'il lui manque une propriété indexée (comme Datastore)."""
+        props = self.equality + (self.order,)
+        if any(p not in entity or p in entity.exclude_from_indexes for p in props):
+            return []
+        rows = []
+        for values in itertools.product(*(_values(entity, p) for p in props)):
+            ordered = _value_order(values[-1])
+            rows.append((tuple(_value_order(v) for v in values[:-1]),
+                         _Reversed(ordered) if self.desc else ordered, key_order))
+        return rows
+
+    def sort_value(self, value):
+        ordered = _value_order(value)
+        return _Reversed(ordered) if self.desc else ordered
+
+    def walk(self, prefix, bounds, after=None):
+        """
+        Clés du préfixe dans l'ordre de la requête, entre 'bounds' ([(op, valeur)] sur la propriété
+        de tri) et après la ligne 'after' (curseur), sans rien lire au-delà de ce qui est consommé.
+        """
+        rows = self.sorted_rows()
+        start = bisect.bisect_left(rows, (prefix,))
+        end = bisect.bisect_left(rows, ((*prefix, _MAX),))
+        for op, value in bounds:
+            # En ordre de parcours, '>' devient une borne de fin si le tri est descendant
+            lower = (op in ('>', '>=')) != self.desc
+            inclusive = op in ('>=', '<=')
+            probe = (prefix, self.sort_value(value))
+            if lower:
+                start = max(start, bisect.bisect_left(rows, probe if inclusive else probe + (_MAX,)))
+            else:
+                end = min(end, bisect.bisect_left(rows, probe + (_MAX,) if inclusive else probe))
+        if after is not None:
+            start = max(start, bisect.bisect_right(rows, (prefix,) + after))
+        for i in range(start, end):
+            yield rows[i]
+
+
+class _Max:
+    """Plus grand que toute clé: borne supérieure des bissections."""
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+    def __eq__(self, other):
+        return isinstance(other, _Max)
+
+    __hash__ = object.__hash__
+
+
+_MAX = _Max()
+
+
+# ------------------ REQUÊTES ------------------
+
+class MemoryIterator:
+    """Itérateur de résultats compatible avec google.cloud.datastore.query.Iterator."""
+
+    def __init__(self, query, limit=None, offset=0, start_cursor=None, end_cursor=None):
+        self._query = query
+        self._limit = limit
+        self._offset = offset or 0
+        self._start_cursor = start_cursor
+        self._results = None
+        self.next_page_token = None
+        self.num_results = 0
+
+    def _run(self):
+        if self._results is None:
+            self._results, self.next_page_token = self._query._execute(
+                self._limit, self._offset, self._start_cursor)
+        return self._results
+
+    @property
+    def pages(self):
+        yield iter(self._run())
+
+    def __iter__(self):
+        for entity in self._run():
+            self.num_results += 1
+            yield entity
+
+
+class MemoryQuery:
+    """Requête Datastore évaluée sur les index triés du MemoryClient."""
+
+    def __init__(self, client, kind=None, ancestor=None, filters=(), projection=(),
+                 order=(), distinct_on=(), **_ignored):
+        self._client = client
+        self.kind = kind
+        self.ancestor = ancestor
+        self._filters = list(filters)
+        self._projection = list(projection)
+        self._order = list(order)
+
+    @property
+    def filters(self):
+        return self._filters[:]
+
+    def add_filter(self, property_name=None, operator=None, value=None, *, filter=None):
+        if filter is not None:
+            property_name = filter.property_name
+            operator = filter.operator
+            value = filter.value
+        self._filters.append((property_name, operator, value))
+        return self
+
+    def key_filter(self, key, operator='='):
+        return self.add_filter(KEY_PROPERTY, operator, key)
+
+    def keys_only(self):
+        self._projection = [KEY_PROPERTY]
+
+    @property
+    def projection(self):
+        return self._projection[:]
+
+    @projection.setter
+    def projection(self, value):
+        self._projection = [value] if isinstance(value, str) else list(value)
+
+    @property
+    def order(self):
+        return self._order[:]
+
+    @order.setter
+    def order(self, value):
+        self._order = [value] if isinstance(value, str) else list(value)
+
+    def fetch(self, limit=None, offset=0, start_cursor=None, end_cursor=None, client=None, **_kwargs):
+        return MemoryIterator(self, limit=limit, offset=offset, start_cursor=start_cursor)
+
+    # --- exécution ---
+
+    def _candidates(self, store):
+        """Choisit le filtre le plus sélectif possible pour piloter l'index."""
+        equality = [f for f in self._filters if f[1] == '=']
+        members = [f for f in self._filters if f[1] == 'IN']
+        ranges = [f for f in self._filters if f[1] in ('<', '<=', '>', '>=')]
+        if self.ancestor is not None and self.kind is not None and not equality and not members:
+            return store.index(self.kind, KEY_PROPERTY).prefix_scan(_key_order(self.ancestor))
+        if equality:
+            prop, _, value = equality[0]
+            return store.index(self.kind, prop).scan(value, True, value, True)
+        if members:
+            prop, _, values = members[0]
+            index = store.index(self.kind, prop)
+            keys = []
+            for value in values:
+                keys.extend(index.scan(value, True, value, True))
+            return keys
+        if ranges:
+            prop = ranges[0][0]
+            low = high = None
+            low_inc = high_inc = True
+            for name, op, value in ranges:
+                if name != prop:
+                    continue
+                if op in ('>', '>='):
+                    low, low_inc = value, op == '>='
+                else:
+                    high, high_inc = value, op == '<='
+            return store.index(self.kind, prop).scan(low, low_inc, high, high_inc)
+        return store.kind_keys(self.kind)
+
+    def _sort_key(self, entity):
+        parts = []
+        for prop in self._order:
+            desc = prop.startswith('-')
+            name = prop[1:] if desc else prop
+            values = [_value_order(v) for v in _values(entity, name)] or [(-1, 0)]
+            parts.append(_Reversed(max(values)) if desc else min(values))
+        parts.append(_key_order(entity.key))
+        return tuple(parts)
+
+    def _composite_plan(self):
+        """
+        (égalités, tri, desc, préfixes, bornes) si la requête se sert d'un index composite, sinon
+        None: tri sur une seule propriété, filtres d'égalité (un IN au plus) ou bornes sur cette
+        propriété, sans ancêtre.
+        """
+        if self.kind is None or self.ancestor is not None or len(self._order) != 1:
+            return None
+        desc = self._order[0].startswith('-')
+        order = self._order[0].lstrip('-')
+        if order == KEY_PROPERTY:
+            return None
+        equality, bounds, members = {}, [], None
+        for prop, op, value in self._filters:
+            if prop == order and op in ('<', '<=', '>', '>='):
+                bounds.append((op, value))
+            elif prop in (order, KEY_PROPERTY) or prop in equality or op not in ('=', 'IN'):
+                return None
+            elif op == 'IN':
+                if members is not None:
+                    return None
+                members = prop
+                equality[prop] = list(value)
+            else:
+                equality[prop] = [value]
+        names = tuple(sorted(equality))
+        prefixes = [tuple(_value_order(v) for v in values)
+                    for values in itertools.product(*(equality[n] for n in names))]
+        return names, order, desc, prefixes, bounds
+
+    def _walk_composite(self, store, plan, filters, wanted, start_cursor):
+        """Entités dans l'ordre de la requête, lues sur l'index jusqu'à en avoir 'wanted'."""
+        names, order, desc, prefixes, bounds = plan
+        index = store.composite(self.kind, names, order, desc)
+        after = None
+        if start_cursor:
+            values, key = _decode_cursor(start_cursor, self._client)
+            after = (index.sort_value(values[0]), _key_order(key))
+        streams = [index.walk(prefix, bounds, after) for prefix in dict.fromkeys(prefixes)]
+        rows = streams[0] if len(streams) == 1 else heapq.merge(*streams, key=lambda row: row[1:])
+        entities, seen = [], set()
+        for _, _, key_order in rows:
+            if key_order in seen:
+                continue
+            seen.add(key_order)
+            entity = store.entities[key_order]
+            if all(match(entity) for match in filters):
+                entities.append(entity)
+                if wanted is not None and len(entities) >= wanted:
+                    break
+        return entities
+
+    def _execute(self, limit, offset, start_cursor):
+        client = self._client
+        client._rpc()
+        store = client._store
+        filters = [_compile_filter(*f) for f in self._filters]
+        plan = self._composite_plan()
+        if plan is not None:
+            # Un résultat de plus que demandé: il dit s'il existe une suite (curseur)
+            wanted = None if limit is None else offset + limit + 1
+            with store.lock:
+                entities = self._walk_composite(store, plan, filters, wanted, start_cursor)
+            return self._page(entities, limit, offset)
+        with store.lock:
+            seen = set()
+            entities = []
+            for key_order in self._candidates(store):
+                if key_order in seen:
+                    continue
+                seen.add(key_order)
+                entity = store.entities.get(key_order)
+                if entity is None:
+                    continue
+                if self.ancestor is not None and not _is_ancestor(self.ancestor, entity.key):
+                    continue
+                if all(match(entity) for match in filters):
+                    entities.append(entity)
+        # Tri stable en plusieurs passes (clé, puis chaque propriété de la dernière à la première):
+        # pas d'objet d'inversion à comparer pour les tris descendants
+        entities.sort(key=lambda e: _key_order(e.key))
+        for prop in reversed(self._order):
+            desc = prop.startswith('-')
+            name = prop.lstrip('-')
+            pick = max if desc else min
+            entities.sort(key=lambda e: pick([_value_order(v) for v in _values(e, name)] or [(-1, 0)]),
+                          reverse=desc)
+
+        if start_cursor:
+            values, key = _decode_cursor(start_cursor, client)
+            marker = Entity(key)
+            for prop, value in zip((o.lstrip('-') for o in self._order), values):
+                marker[prop] = value
+            bound = self._sort_key(marker)
+            entities = [e for e in entities if self._sort_key(e) > bound]
+
+        return self._page(entities, limit, offset)
+
+    def _page(self, entities, limit, offset):
+        entities = entities[offset:]
+        more = limit is not None and len(entities) > limit
+        if limit is not None:
+            entities = entities[:limit]
+        token = None
+        if more and entities:
+            last = entities[-1]
+            values = [(_values(last, o.lstrip('-')) or [None])[0] for o in self._order]
+            token = _encode_cursor(values, last.key)
+        return [self._project(e) for e in entities], token
+
+    def _project(self, entity):
+        if not self._projection:
+            return _copy(entity)
+        result = Entity(entity.key)
+        for prop in self._projection:
+            if prop != KEY_PROPERTY and prop in entity:
+                result[prop] = entity[prop]
+        return result
+
+
+class _Reversed:
+    """Inverse l'ordre d'une valeur pour les tris descendants."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return self.value > other.value
+
+    def __gt__(self, other):
+        return self.value < other.value
+
+    def __eq__(self, other):
+        return isinstance(other, _Reversed) and self.value == other.value
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __le__(self, other):
+        return self.value >= other.value
+
+    def __ge__(self, other):
+        return self.value <= other.value
+
+
+# ------------------ STOCKAGE ------------------
+
+class _Store:
+    """
+    Entités et index partagés par tous les clients d'un même processus. Les entités sont
+    rangées par _key_order (tuple natif, haché bien plus vite qu'une Key).
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.entities = {}
+        self.indexes = {}
+        self.composites = {}  # type -> {(égalités, tri, desc): _CompositeIndex}
+        self.ids = itertools.count(1 << 40)
+
+    def index(self, kind, prop):
+        return self.indexes.setdefault((kind, prop), _SortedIndex())
+
+    def composite(self, kind, equality, order, desc):
+        """Index composite, construit à la première requête qui en a besoin puis tenu à jour."""
+        indexes = self.composites.setdefault(kind, {})
+        index = indexes.get((equality, order, desc))
+        if index is None:
+            index = indexes[(equality, order, desc)] = _CompositeIndex(equality, order, desc)
+            for key_order in self.kind_keys(kind):
+                for row in index.entity_rows(self.entities[key_order], key_order):
+                    index.add_row(row)
+        return index
+
+    def kind_keys(self, kind):
+        if kind is None:
+            return list(self.entities)
+        return self.index(kind, KEY_PROPERTY).scan()
+
+    def get(self, key):
+        return self.entities.get(_key_order(key))
+
+    def _index(self, entity, key_order, add):
+        for prop in entity:
+            if prop in entity.exclude_from_indexes:
+                continue
+            index = self.index(entity.kind, prop)
+            for value in _values(entity, prop):
+                (index.add if add else index.remove)(value, key_order)
+        for index in self.composites.get(entity.kind, {}).values():
+            for row in index.entity_rows(entity, key_order):
+                (index.add_row if add else index.remove_row)(row)
+
+    def write(self, entity):
+        key_order = _key_order(entity.key)
+        old = self.entities.get(key_order)
+        if old is not None:
+            self._index(old, key_order, add=False)
+        else:
+            self.index(entity.kind, KEY_PROPERTY).add(entity.key, key_order)
+        stored = _copy(entity)
+        self.entities[key_order] = stored
+        self._index(stored, key_order, add=True)
+
+    def remove(self, key):
+        key_order = _key_order(key)
+        old = self.entities.pop(key_order, None)
+        if old is not None:
+            self._index(old, key_order, add=False)
+            self.index(key.kind, KEY_PROPERTY).remove(key, key_order)
+
+
+_STORE = _Store()
+
+
+class MemoryTransaction:
+    """Transaction sérialisée : les écritures sont appliquées au commit."""
+
+    def __init__(self, client, **_kwargs):
+        self._client = client
+        self._puts = []
+        self._deletes = []
+        self.id = None
+
+    def begin(self):
+        self._client._store.lock.acquire()
+        self._client._local.transaction = self
+        self.id = id(self)
+
+    def put(self, entity):
+        self._client._complete(entity)
+        self._puts.append(entity)
+
+    def delete(self, key):
+        self._deletes.append(key)
+
+    @property
+    def mutations(self):
+        return self._puts + self._deletes
+
+    def commit(self):
+        store = self._client._store
+        try:
+            self._client._rpc()
+            for entity in self._puts:
+                store.write(entity)
+            for key in self._deletes:
+                store.remove(key)
+        finally:
+            self._finish()
+
+    def rollback(self):
+        self._finish()
+
+    def _finish(self):
+        if self.id is not None:
+            self.id = None
+            self._client._local.transaction = None
+            self._client._store.lock.release()
+
+    def __enter__(self):
+        self.begin()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
+class MemoryClient:
+    """Client compatible avec google.cloud.datastore.Client, stocké en mémoire."""
+
+    def __init__(self, project='memory', namespace=None, latency_ms=0.0, store=None):
+        self.project = project
+        self.namespace = namespace
+        self.database = ''
+        self.latency_ms = latency_ms
+        self._store = store or _STORE
+        self._local = threading.local()
+
+    def _rpc(self):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+
+    @property
+    def current_transaction(self):
+        return getattr(self._local, 'transaction', None)
+
+    def _complete(self, entity):
+        if entity.key.is_partial:
+            entity.key = entity.key.completed_key(next(self._store.ids))
+
+    def key(self, *path_args, **kwargs):
+        kwargs['project'] = self.project
+        kwargs.setdefault('namespace', self.namespace)
+        return Key(*path_args, **kwargs)
+
+    def entity(self, key=None, exclude_from_indexes=()):
+        return Entity(key=key, exclude_from_indexes=exclude_from_indexes)
+
+    def query(self, **kwargs):
+        return MemoryQuery(self, **kwargs)
+
+    def transaction(self, **kwargs):
+        return MemoryTransaction(self, **kwargs)
+
+    def get(self, key, missing=None, deferred=None, transaction=None, eventual=False, **_kwargs):
+        found = self.get_multi([key], missing=missing)
+        return found[0] if found else None
+
+    def get_multi(self, keys, missing=None, deferred=None, transaction=None, eventual=False, **_kwargs):
+        self._rpc()
+        found = []
+        with self._store.lock:
+            for key in keys:
+                entity = self._store.get(key)
+                if entity is not None:
+                    found.append(_copy(entity))
+                elif missing is not None:
+                    missing.append(Entity(key))
+        return found
+
+    def put(self, entity, **kwargs):
+        self.put_multi([entity], **kwargs)
+
+    def put_multi(self, entities, **_kwargs):
+        entities = list(entities)
+        transaction = self.current_transaction
+        if transaction is not None:
+            for entity in entities:
+                transaction.put(entity)
+            return
+        self._rpc()
+        with self._store.lock:
+            for entity in entities:
+                self._complete(entity)
+                self._store.write(entity)
+
+    def delete(self, key, **kwargs):
+        self.delete_multi([key], **kwargs)
+
+    def delete_multi(self, keys, **_kwargs):
+        keys = list(keys)
+        transaction = self.current_transaction
+        if transaction is not None:
+            for key in keys:
+                transaction.delete(key)
+            return
+        self._rpc()
+        with self._store.lock:
+            for key in keys:
+                self._store.remove(key)
+
+    def allocate_ids(self, incomplete_key, num_ids, **_kwargs):
+        self._rpc()
+        return [incomplete_key.completed_key(next(self._store.ids)) for _ in range(num_ids)]
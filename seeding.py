@@ -0,0 +1,484 @@
+"""
+Pipeline de génération des données TinyInsta, partagé par seed.py et /admin/seed.
+
+Les entités sont produites par des générateurs (rien n'est matérialisé en entier à part le
+graphe de follows, nécessaire aux compteurs de followers) et écrites par paquets put_multi
+sur un pool borné: au-delà de 'max_pending' paquets en vol, le producteur attend.
+Chaque utilisateur a son propre générateur aléatoire, dérivé de la graine du seed et de son
+nom: le même seed reproduit les mêmes données, quel que soit l'ordre d'écriture.
+"""
+from __future__ import annotations
+
+import bisect
+import hashlib
+import itertools
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+
+from google.cloud import datastore
+
+# Limite Datastore d'entités par put_multi / delete_multi
+BATCH_SIZE = 400
+# Nombre de shards des posts (propriété 'shard', voir POST_SHARDS dans main.py); 1 = pas de sharding
+POST_SHARDS = int(os.environ.get('POST_SHARDS', '1'))
+
+
+def user_names(prefix: str, users: int):
+    return [f"{prefix}{i}" for i in range(1, users + 1)]
+
+
+def new_seed() -> int:
+    return random.randrange(2 ** 32)
+
+
+def user_rng(seed, stream: str, name: str) -> random.Random:
+    """Générateur propre à un utilisateur et à un flux ('follows', 'posts')."""
+    return random.Random(f"{seed}:{stream}:{name}")
+
+
+# ------------------ ÉCHANTILLONNAGE DES FOLLOWEES ------------------
+
+def sample_uniform(rng: random.Random, n: int, k: int, exclude: int):
+    """k indices distincts de [0, n) sans 'exclude', en O(k): on tire dans [0, n-1) et on décale."""
+    return [j + 1 if j >= exclude else j for j in rng.sample(range(n - 1), k)]
+
+
+class ZipfSampler:
+    """Le i-ème utilisateur est choisi avec une probabilité ∝ 1 / i^s (quelques auteurs très suivis)."""
+
+    def __init__(self, n: int, s: float):
+        self.n = n
+        self.cum_weights = list(itertools.accumulate(1.0 / (i ** s) for i in range(1, n + 1)))
+
+    def __call__(self, rng: random.Random, n: int, k: int, exclude: int):
+        total = self.cum_weights[-1]
+        chosen = set()
+        for _ in range(20 * k):
+            if len(chosen) >= k:
+                break
+            i = bisect.bisect(self.cum_weights, rng.random() * total)
+            if i != exclude and i < n:
+                chosen.add(i)
+        if len(chosen) < k:
+            # Presque tout le monde est suivi: on complète uniformément parmi les restants
+            rest = [i for i in range(n) if i != exclude and i not in chosen]
+            chosen.update(rng.sample(rest, k - len(chosen)))
+        return list(chosen)
+
+
+def iter_follows(names, follows_count: int, seed, distribution: str = 'uniform', zipf_s: float = 1.1):
+    """Génère (utilisateur, followees): exactement min(follows_count, n-1) followees, jamais soi-même."""
+    n = len(names)
+    k = min(follows_count, n - 1)
+    sample = ZipfSampler(n, zipf_s) if distribution == 'zipf' else sample_uniform
+    for i, name in enumerate(names):
+        if k <= 0:
+            yield name, []
+            continue
+        rng = user_rng(seed, 'follows', name)
+        yield name, [names[j] for j in sample(rng, n, k, i)]
+
+
+# ------------------ GÉNÉRATEURS D'ENTITÉS ------------------
+
+def iter_users(client, names, follower_counts):
+    for name in names:
+        entity = datastore.Entity(client.key('User', name))
+        entity['follower_count'] = follower_counts.get(name, 0)
+        yield entity
+
+
+def iter_follow_edges(client, follows_by_user, created: datetime):
+    for name, follows in follows_by_user.items():
+        for followee in follows:
+            edge = datastore.Entity(client.key('User', name, 'Follow', followee))
+            edge.update({'follower': name, 'followee': followee, 'created': created})
+            yield edge
+
+
+def post_key(client, seed, name: str, i: int):
+    """
+    Clé nommée déterministe: réécrire un paquet (seed repris après une interruption) ne crée pas
+    de doublon. Le hachage répartit les clés et évite les points chauds d'un nom séquentiel.
+    """
+    return client.key('Post', hashlib.blake2b(f"{seed}:{name}:{i}".encode(), digest_size=8).hexdigest())
+
+
+def post_shard(key=None) -> int:
+    """
+    Shard d'un post: dérivé du nom haché de sa clé (seed reproductible), tiré au hasard sinon
+    (clé allouée au put). Dans les deux cas, deux posts consécutifs tombent dans des shards différents.
+    """
+    if key is not None and key.name:
+        return int(key.name, 16) % POST_SHARDS
+    return random.randrange(POST_SHARDS)
+
+
+def iter_posts(client, names, posts_per_user: int, seed, base_time: datetime, spread: timedelta,
+               content: str, last_post: dict, first: int = 0):
+    """
+    Posts [first, posts_per_user[ de chaque utilisateur, datés aléatoirement dans
+    [base_time - spread, base_time[ ('first' > 0: compléter un jeu de données existant).
+    """
+    spread_s = max(1, int(spread.total_seconds()))
+    for name in names:
+        rng = user_rng(seed, 'posts', name)
+        for i in range(posts_per_user):
+            offset = rng.randint(1, spread_s)  # tiré même pour les posts sautés: tirages reproductibles
+            if i < first:
+                continue
+            p = datastore.Entity(post_key(client, seed, name, i))
+            p['author'] = name
+            p['content'] = content.format(i=i + 1, name=name)
+            p['created'] = base_time - timedelta(seconds=offset)
+            if POST_SHARDS > 1:
+                p['shard'] = post_shard(p.key)
+            last_post[name] = max(last_post.get(name, p['created']), p['created'])
+            yield p
+
+
+# ------------------ ÉCRITURE PARALLÈLE ------------------
+
+class Progress:
+    """Compteur partagé qui affiche l'avancement et le débit au plus toutes les 'interval' secondes."""
+
+    def __init__(self, label: str, total: int = None, report=print, interval: float = 2.0):
+        self.label = label
+        self.total = total
+        self.report = report
+        self.interval = interval
+        self.done = 0
+        self.started = time.monotonic()
+        self._last = self.started
+        self._lock = threading.Lock()
+
+    def add(self, n: int):
+        with self._lock:
+            self.done += n
+            now = time.monotonic()
+            if now - self._last < self.interval:
+                return
+            self._last = now
+        self.report(f"   -> {self}")
+
+    @property
+    def rate(self) -> float:
+        return self.done / max(time.monotonic() - self.started, 1e-9)
+
+    def finish(self):
+        self.report(f"   -> {self} (terminé en {time.monotonic() - self.started:.1f}s)")
+
+    def __str__(self):
+        total = f"/{self.total}" if self.total is not None else ''
+        return f"{self.label}: {self.done}{total} ({self.rate:.0f}/s)"
+
+
+class BatchWriter:
+    """
+    Regroupe les entités en paquets de BATCH_SIZE et les écrit sur un pool de 'workers' threads.
+    Au plus 'max_pending' paquets sont en vol: le producteur est freiné plutôt que de tout
+    accumuler en mémoire. La première erreur d'écriture est relevée à l'appel suivant.
+    """
+
+    def __init__(self, client, workers: int = 8, max_pending: int = None):
+        self.client = client
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.Semaphore(max_pending or 2 * workers)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._error = None
+
+    def put(self, entities, progress: Progress = None):
+        """Écrit une séquence (ou un générateur) d'entités; retourne le nombre soumis."""
+        return self._run(self.client.put_multi, entities, progress)
+
+    def delete(self, keys, progress: Progress = None):
+        return self._run(self.client.delete_multi, keys, progress)
+
+    def get(self, keys):
+        """get_multi par paquets en parallèle (lecture: résultats attendus avant de rendre la main)."""
+        keys = list(keys)
+        chunks = [keys[i:i + BATCH_SIZE] for i in range(0, len(keys), BATCH_SIZE)]
+        return list(itertools.chain.from_iterable(self._pool.map(self.client.get_multi, chunks)))
+
+    def _run(self, rpc, items, progress):
+        count = 0
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= BATCH_SIZE:
+                self._submit(rpc, batch, progress)
+                count += len(batch)
+                batch = []
+        if batch:
+            self._submit(rpc, batch, progress)
+            count += len(batch)
+        return count
+
+    def _submit(self, rpc, batch, progress):
+        self._raise_error()
+        self._slots.acquire()
+        future = self._pool.submit(self._call, rpc, batch, progress)
+        with self._lock:
+            self._pending.add(future)
+
+    def _call(self, rpc, batch, progress):
+        try:
+            rpc(batch)
+            if progress is not None:
+                progress.add(len(batch))
+        except Exception as e:
+            with self._lock:
+                self._error = self._error or e
+        finally:
+            self._slots.release()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def flush(self):
+        """Attend toutes les écritures en vol (les clés incomplètes sont alors allouées)."""
+        with self._lock:
+            pending, self._pending = self._pending, set()
+        for future in pending:
+            future.result()
+        self._raise_error()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+# ------------------ ÉTAPES DU SEED ------------------
+
+def prefix_range(prefix: str):
+    """
+    Bornes [basse, haute[ des noms '<prefix><n>' générés par le seed (n >= 1, sans zéro en tête):
+    la plage de 'exp1' (exp11.., exp1999) exclut les utilisateurs de 'exp10' (exp101..).
+    """
+    return prefix + '1', prefix + ':'
+
+
+def user_query(client, prefix: str, keys_only: bool = False):
+    """Requête sur les User du jeu de données 'prefix' (plage de clés); tous les User sans préfixe."""
+    query = client.query(kind='User')
+    if prefix:
+        low, high = prefix_range(prefix)
+        query.key_filter(client.key('User', low), '>=')
+        query.key_filter(client.key('User', high), '<')
+    if keys_only:
+        query.keys_only()
+    return query
+
+
+def follow_edge_keys(client, prefix: str):
+    """Clés des arêtes Follow dont le follower appartient au jeu de données 'prefix'."""
+    query = client.query(kind='Follow')
+    if prefix:
+        low, high = prefix_range(prefix)
+        query.add_filter('follower', '>=', low)
+        query.add_filter('follower', '<', high)
+    query.keys_only()
+    return (e.key for e in query.fetch())
+
+
+def seed_graph(client, writer: BatchWriter, names, follows_count: int, prefix: str, seed,
+               distribution: str = 'uniform', zipf_s: float = 1.1, report=print):
+    """Utilisateurs (avec follower_count) et arêtes Follow; remplace les arêtes d'un seed précédent."""
+    follows_by_user = dict(iter_follows(names, follows_count, seed, distribution, zipf_s))
+    follower_counts = Counter(f for follows in follows_by_user.values() for f in follows)
+
+    progress = Progress('utilisateurs', len(names), report)
+    writer.put(iter_users(client, names, follower_counts), progress)
+    # Les anciennes arêtes doivent avoir disparu avant d'écrire les nouvelles (mêmes clés possibles)
+    deleted = writer.delete(follow_edge_keys(client, prefix))
+    writer.flush()
+    progress.finish()
+    if deleted:
+        report(f"   -> {deleted} anciennes arêtes Follow supprimées")
+
+    total = sum(len(f) for f in follows_by_user.values())
+    progress = Progress('arêtes Follow', total, report)
+    writer.put(iter_follow_edges(client, follows_by_user, datetime.utcnow()), progress)
+    writer.flush()
+    progress.finish()
+    return follows_by_user, follower_counts
+
+
+def seed_posts(client, writer: BatchWriter, names, posts_per_user: int, seed, base_time: datetime,
+               spread: timedelta, content: str, keep_posts: bool = False, report=print, first: int = 0):
+    """Posts des utilisateurs 'names'. Retourne (date du dernier post par auteur, posts par auteur)."""
+    last_post = {}
+    posts_by_author = {}
+    posts = iter_posts(client, names, posts_per_user, seed, base_time, spread, content, last_post, first)
+    if keep_posts:
+        posts = _collect(posts, posts_by_author)
+    progress = Progress('posts', len(names) * (posts_per_user - first), report)
+    writer.put(posts, progress)
+    writer.flush()
+    progress.finish()
+    return last_post, posts_by_author
+
+
+def _collect(posts, posts_by_author):
+    for p in posts:
+        posts_by_author.setdefault(p['author'], []).append(p)
+        yield p
+
+
+def utc_naive(value: datetime) -> datetime:
+    """Date naïve en UTC: Datastore rend des dates avec fuseau, les posts générés sont naïfs."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def write_heads(client, writer: BatchWriter, last_post: dict):
+    """AuthorHead de chaque auteur: on garde la plus récente entre l'existante et les posts créés."""
+    for head in writer.get(client.key('AuthorHead', n) for n in last_post):
+        previous = head.get('last_post')
+        if previous is not None and utc_naive(previous) > utc_naive(last_post[head.key.name]):
+            last_post[head.key.name] = previous
+
+    def heads():
+        for name, created in last_post.items():
+            head = datastore.Entity(client.key('AuthorHead', name), exclude_from_indexes=('last_post',))
+            head['last_post'] = created
+            yield head
+    writer.put(heads())
+    writer.flush()
+
+
+# ------------------ MANIFESTE DU JEU DE DONNÉES ------------------
+# Une entité Dataset par préfixe décrit le jeu de données présent (paramètres et graine) et n'est
+# marquée complète qu'à la fin du seed: un benchmark peut réutiliser un jeu identique au lieu de
+# tout regénérer, ou ne compléter que ce qui manque.
+
+GRAPH_FIELDS = ('users', 'follows_count', 'distribution', 'zipf_s', 'seed')
+
+
+def get_manifest(client, prefix: str):
+    return client.get(client.key('Dataset', prefix))
+
+
+def start_manifest(client, prefix: str, users: int, posts_per_user: int, follows_count: int, seed,
+                   distribution: str = 'uniform', zipf_s: float = 1.1):
+    """Remplace le manifeste du préfixe par un manifeste incomplet (seed en cours)."""
+    manifest = datastore.Entity(client.key('Dataset', prefix))
+    manifest.update({
+        'prefix': prefix,
+        'users': users,
+        'posts_per_user': posts_per_user,
+        'follows_count': follows_count,
+        'distribution': distribution,
+        'zipf_s': zipf_s,
+        'seed': seed,
+        'post_shards': POST_SHARDS,
+        'timelines': None,
+        'complete': False,
+        'updated': datetime.utcnow(),
+    })
+    client.put(manifest)
+    return manifest
+
+
+def update_manifest(client, prefix: str, **fields):
+    """Met à jour un manifeste existant (ex: complete=True, timelines='push')."""
+    manifest = get_manifest(client, prefix)
+    if manifest is None:
+        return None
+    manifest.update(fields)
+    manifest['updated'] = datetime.utcnow()
+    client.put(manifest)
+    return manifest
+
+
+def same_graph(manifest, **params) -> bool:
+    """Le manifeste (complet) décrit-il les mêmes utilisateurs et le même graphe de follows?"""
+    return (manifest is not None and manifest.get('complete')
+            and all(manifest.get(f) == params[f] for f in GRAPH_FIELDS))
+
+
+class SeedResult(NamedTuple):
+    seed: object
+    users: int
+    posts: int
+    edges: int
+    seconds: float
+    follows_by_user: dict
+    follower_counts: Counter
+    posts_by_author: dict
+
+
+def seed_dataset(client, users: int, posts_per_user: int, follows_count: int, prefix: str,
+                 seed=None, distribution: str = 'uniform', zipf_s: float = 1.1, workers: int = 8,
+                 spread: timedelta = timedelta(days=100),
+                 content: str = "Ceci est le message {i} de l'utilisateur {name} pour le benchmark.",
+                 keep_posts: bool = False, report=print) -> SeedResult:
+    """
+    Génère un jeu de données complet: utilisateurs, graphe de follows, posts et têtes d'auteur.
+    'keep_posts' garde les posts en mémoire (matérialisation des timelines après le seed).
+    """
+    if seed is None:
+        seed = new_seed()
+    started = time.monotonic()
+    names = user_names(prefix, users)
+    start_manifest(client, prefix, users, posts_per_user, follows_count, seed, distribution, zipf_s)
+    with BatchWriter(client, workers=workers) as writer:
+        report("[1/3] Utilisateurs et follows...")
+        follows_by_user, follower_counts = seed_graph(client, writer, names, follows_count, prefix, seed,
+                                                      distribution, zipf_s, report)
+        report("[2/3] Posts...")
+        last_post, posts_by_author = seed_posts(client, writer, names, posts_per_user, seed,
+                                                datetime.utcnow(), spread, content, keep_posts, report)
+        report("[3/3] Têtes d'auteur...")
+        write_heads(client, writer, last_post)
+    update_manifest(client, prefix, complete=True)
+    return SeedResult(
+        seed=seed,
+        users=len(names),
+        posts=len(names) * posts_per_user,
+        edges=sum(follower_counts.values()),
+        seconds=time.monotonic() - started,
+        follows_by_user=follows_by_user,
+        follower_counts=follower_counts,
+        posts_by_author=posts_by_author,
+    )
+
+
+def extend_posts(client, prefix: str, posts_per_user: int, workers: int = 8,
+                 spread: timedelta = timedelta(days=100),
+                 content: str = "Ceci est le message {i} de l'utilisateur {name} pour le benchmark.",
+                 report=print) -> int:
+    """
+    Complète un jeu de données complet jusqu'à 'posts_per_user' posts par utilisateur (mêmes clés
+    et mêmes tirages qu'un seed complet avec la même graine). Retourne le nombre de posts ajoutés.
+    """
+    manifest = get_manifest(client, prefix)
+    first = manifest['posts_per_user']
+    if posts_per_user <= first:
+        return 0
+    names = user_names(prefix, manifest['users'])
+    update_manifest(client, prefix, complete=False)
+    with BatchWriter(client, workers=workers) as writer:
+        last_post, _ = seed_posts(client, writer, names, posts_per_user, manifest['seed'], datetime.utcnow(),
+                                  spread, content, report=report, first=first)
+        write_heads(client, writer, last_post)
+    # Les timelines matérialisées ne contiennent pas les nouveaux posts
+    update_manifest(client, prefix, posts_per_user=posts_per_user, timelines=None, complete=True)
+    return len(names) * (posts_per_user - first)
@@ -0,0 +1,61 @@
+"""
+Choix du backend de stockage de TinyInsta, par variable d'environnement:
+- DATASTORE_BACKEND=datastore (défaut): google.cloud.datastore.Client (GCP, ou l'émulateur
+  si DATASTORE_EMULATOR_HOST est défini);
+- DATASTORE_BACKEND=memory: moteur en mémoire de memstore.py, sans réseau ni identifiants,
+  pour profiler et comparer les algorithmes localement. MEMSTORE_LATENCY_MS ajoute une
+  latence fixe à chaque RPC pour simuler les allers-retours.
+"""
+import os
+import threading
+import time
+
+from google.cloud import datastore
+
+BACKENDS = ('datastore', 'memory')
+
+
+def backend() -> str:
+    name = os.environ.get('DATASTORE_BACKEND', 'datastore')
+    if name not in BACKENDS:
+        raise ValueError(f"DATASTORE_BACKEND inconnu: {name!r} (attendu: {', '.join(BACKENDS)})")
+    return name
+
+
+def get_client():
+    """Nouveau client du backend configuré (en mémoire: même stockage pour tout le processus)."""
+    if backend() == 'memory':
+        import memstore  # seulement pour ce backend: rien à charger au démarrage d'une instance GCP
+        return memstore.MemoryClient(latency_ms=float(os.environ.get('MEMSTORE_LATENCY_MS', '0')))
+    return datastore.Client()
+
+
+class LazyClient:
+    """
+    Client créé au premier attribut demandé (warmup ou première requête), pas à l'import: le
+    démarrage d'une instance ne paie ni la recherche des identifiants ni la création du client.
+    Création unique même si plusieurs threads servent déjà; 'created_ms' mesure sa durée.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+        self.created_ms = None
+
+    @property
+    def created(self) -> bool:
+        return self._client is not None
+
+    def resolve(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    started = time.perf_counter()
+                    client = self._factory()
+                    self.created_ms = round((time.perf_counter() - started) * 1000, 1)
+                    self._client = client
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)